@@ -1,20 +1,32 @@
 from __future__ import annotations
 
-from typing import Optional
-import os
+import asyncio
+import logging
+import secrets
+from collections import OrderedDict
+from typing import Optional, Sequence
 
-from celery.result import AsyncResult
 from fastapi import Header, HTTPException
 from pydantic import BaseModel
-import redis
 
-from libs.py_core.config import get_settings
+from libs.py_core.config import get_settings, is_s3_storage_enabled
+from libs.py_core.db import _client_cache, _hash_api_key
+from libs.py_core.db_async import resolve_api_client
+from libs.py_core.events import CLIENTS_CHANNEL
+from libs.py_core.storage import get_s3_storage
+from libs.py_core.storage_keys import candidate_paths
 
+from apps.api.event_hub import get_event_hub
+from apps.api.redis_client import get_redis
+from apps.api.task_state import TaskState
+
+
+logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
-# Simple Redis client for storing per-task auth metadata and history.
-redis_client: redis.Redis = redis.Redis.from_url(str(settings.redis_url))
+# Parsed once; API_ALLOWED_KEYS is not re-read per request.
+ALLOWED_KEYS = frozenset(key.strip() for key in settings.api_allowed_keys.split(",") if key.strip())
 
 TASK_OWNER_KEY_PREFIX = "zimage:task_owner:"
 TASK_OWNER_TTL_SECONDS = 7 * 24 * 60 * 60  # 7 days
@@ -22,6 +34,15 @@ USER_TASKS_KEY_PREFIX = "zimage:user_tasks:"
 ALL_TASKS_KEY = "zimage:all_tasks"
 USER_TASKS_MAX_ITEMS = 100
 DELETED_TASKS_KEY = "zimage:deleted_tasks"
+# Short-lived tokens standing in for the key on SSE URLs (EventSource cannot
+# send headers, and a raw key in the URL ends up in access logs / history).
+STREAM_TOKEN_KEY_PREFIX = "zimage:stream_token:"
+STREAM_TOKEN_TTL_SECONDS = 60
+# task_id -> owner key. Ownership never changes once a task is registered,
+# so entries only leave the cache when it is full.
+TASK_OWNER_CACHE_MAX_ITEMS = 50_000
+
+_task_owner_cache: OrderedDict[str, str] = OrderedDict()
 
 
 class AuthContext(BaseModel):
@@ -36,27 +57,40 @@ class AuthContext(BaseModel):
     is_admin: bool = False
 
 
-def _resolve_auth_context(raw_key: Optional[str]) -> AuthContext:
+async def _resolve_auth_context(raw_key: Optional[str], *, resolve_client: bool = False) -> AuthContext:
     """
-    Internal helper to resolve AuthContext and apply whitelist checks.
+    Internal helper to resolve AuthContext and apply whitelist / active checks.
+
+    Only enqueue paths (`resolve_client=True`) resolve the api_clients row,
+    creating it on first sight; if that lookup fails the request is
+    rejected. Every other route only consults the per-process client cache
+    (no I/O): task access itself is decided by the task-owner check.
     """
 
     admin_key = settings.api_admin_key
     is_admin = bool(admin_key) and raw_key == admin_key
 
-    # If a whitelist is configured, enforce it for non-admin keys.
-    allowed_raw = os.getenv("API_ALLOWED_KEYS", "").strip()
-    if settings.api_enable_auth and raw_key and not is_admin and allowed_raw:
-        allowed = {k.strip() for k in allowed_raw.split(",") if k.strip()}
-        if allowed and raw_key not in allowed:
+    if settings.api_enable_auth and raw_key and not is_admin:
+        # If a whitelist is configured, enforce it for non-admin keys.
+        if ALLOWED_KEYS and raw_key not in ALLOWED_KEYS:
             raise HTTPException(status_code=403, detail="API key not allowed")
 
+        if resolve_client:
+            try:
+                client = await resolve_api_client(raw_key)
+            except Exception:
+                logger.warning("auth: could not resolve API client", exc_info=True)
+                raise HTTPException(status_code=503, detail="Cannot verify API key, try again later")
+        else:
+            client = _client_cache.get(_hash_api_key(raw_key), allow_stale=True)
+        if client is not None and not client.is_active:
+            raise HTTPException(status_code=403, detail="API key disabled")
+
     return AuthContext(key=raw_key, is_admin=is_admin)
 
 
-def get_auth_context(
+async def get_auth_context(
     x_auth_key: Optional[str] = Header(default=None, alias="X-Auth-Key"),
-    auth_key: Optional[str] = None,
 ) -> AuthContext:
     """
     Strict auth context resolver.
@@ -67,21 +101,35 @@ def get_auth_context(
 
     Additionally, if `API_ALLOWED_KEYS` is configured as a comma-separated
     whitelist, non-admin keys must appear in that list to be considered
-    valid.
+    valid, and keys whose api_clients row is deactivated get a 403.
     """
 
-    raw_key = x_auth_key or auth_key
+    raw_key = x_auth_key
 
     if settings.api_enable_auth:
         if not raw_key:
             raise HTTPException(status_code=401, detail="Missing API auth key")
 
-    return _resolve_auth_context(raw_key)
+    return await _resolve_auth_context(raw_key)
 
 
-def get_auth_context_optional(
+async def get_enqueue_auth_context(
+    x_auth_key: Optional[str] = Header(default=None, alias="X-Auth-Key"),
+) -> AuthContext:
+    """
+    `get_auth_context` for the generate endpoints: also resolves (and on
+    first sight creates) the caller's api_clients row, failing closed with
+    503 when it cannot be looked up.
+    """
+
+    if settings.api_enable_auth and not x_auth_key:
+        raise HTTPException(status_code=401, detail="Missing API auth key")
+
+    return await _resolve_auth_context(x_auth_key, resolve_client=True)
+
+
+async def get_auth_context_optional(
     x_auth_key: Optional[str] = Header(default=None, alias="X-Auth-Key"),
-    auth_key: Optional[str] = None,
 ) -> AuthContext:
     """
     Lenient auth context resolver.
@@ -96,15 +144,44 @@ def get_auth_context_optional(
     - 鉴权关闭且不带 key：视为匿名访客，由业务逻辑决定行为（当前实现为全局历史）。
     """
 
-    raw_key = x_auth_key or auth_key
+    raw_key = x_auth_key
 
     if settings.api_enable_auth and not raw_key:
         raise HTTPException(status_code=401, detail="Missing API auth key")
 
-    return _resolve_auth_context(raw_key)
+    return await _resolve_auth_context(raw_key)
+
+
+async def issue_stream_token(auth: AuthContext) -> str:
+    """
+    Opaque token for `?stream_token=` on the SSE endpoints, valid for
+    STREAM_TOKEN_TTL_SECONDS and mapped to the caller's key in Redis.
+    """
+
+    token = secrets.token_urlsafe(24)
+    await get_redis().setex(f"{STREAM_TOKEN_KEY_PREFIX}{token}", STREAM_TOKEN_TTL_SECONDS, auth.key or "")
+    return token
 
 
-def enforce_task_access(task_id: str, auth: AuthContext, result: AsyncResult) -> None:
+async def get_stream_auth_context(
+    x_auth_key: Optional[str] = Header(default=None, alias="X-Auth-Key"),
+    stream_token: Optional[str] = None,
+) -> AuthContext:
+    """
+    Auth context for SSE endpoints: the `X-Auth-Key` header, or a token
+    from POST /v1/events/token (EventSource cannot set headers).
+    """
+
+    if x_auth_key or not stream_token:
+        return await get_auth_context_optional(x_auth_key)
+
+    raw = await get_redis().get(f"{STREAM_TOKEN_KEY_PREFIX}{stream_token}")
+    if raw is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream token")
+    return await get_auth_context_optional(raw.decode("utf-8") or None)
+
+
+async def enforce_task_access(task_id: str, auth: AuthContext, result: TaskState) -> None:
     """
     Enforce that the current caller is allowed to access the task.
 
@@ -114,6 +191,16 @@ def enforce_task_access(task_id: str, auth: AuthContext, result: AsyncResult) ->
       back to the `auth_key` field in the task result for completed tasks.
     """
 
+    await enforce_tasks_access(auth, [result])
+
+
+async def enforce_tasks_access(auth: AuthContext, results: Sequence[TaskState]) -> None:
+    """
+    Bulk form of `enforce_task_access`: owner keys come from the
+    in-process owner cache, the misses from one MGET, and a 403 is raised
+    if any of the tasks belongs to another key.
+    """
+
     if not settings.api_enable_auth:
         return
 
@@ -123,25 +210,45 @@ def enforce_task_access(task_id: str, auth: AuthContext, result: AsyncResult) ->
     if not auth.key:
         raise HTTPException(status_code=401, detail="Missing API auth key")
 
-    owner_key_bytes = redis_client.get(f"{TASK_OWNER_KEY_PREFIX}{task_id}")
-    if owner_key_bytes is not None:
-        owner_key = owner_key_bytes.decode("utf-8")
-        if owner_key != auth.key:
-            raise HTTPException(status_code=403, detail="Not allowed to access this task")
+    if not results:
         return
 
-    # Fallback: if the task has already completed and we no longer have a
-    # Redis entry (e.g. TTL expired), try to validate against the stored
-    # `auth_key` in the task result payload.
-    if result.successful():
-        payload = result.result
-        if isinstance(payload, dict):
-            owner_key = payload.get("auth_key")
-            if owner_key and owner_key != auth.key:
+    # Batch items are owned through their batch task.
+    owners = {result.celery_task_id: _task_owner_cache.get(result.celery_task_id) for result in results}
+    missing = [task_id for task_id, owner in owners.items() if owner is None]
+    if missing:
+        owner_keys = await get_redis().mget([f"{TASK_OWNER_KEY_PREFIX}{task_id}" for task_id in missing])
+        for task_id, owner_key_bytes in zip(missing, owner_keys):
+            if owner_key_bytes is not None:
+                owners[task_id] = owner_key_bytes.decode("utf-8")
+                _remember_task_owner(task_id, owners[task_id])
+
+    for result in results:
+        owner_key = owners.get(result.celery_task_id)
+        if owner_key is not None:
+            if owner_key != auth.key:
                 raise HTTPException(status_code=403, detail="Not allowed to access this task")
+            continue
+
+        # Fallback: if the task has already completed and we no longer have a
+        # Redis entry (e.g. TTL expired), try to validate against the stored
+        # `auth_key` in the task result payload.
+        if result.successful():
+            payload = result.result
+            if isinstance(payload, dict):
+                owner_key = payload.get("auth_key")
+                if owner_key and owner_key != auth.key:
+                    raise HTTPException(status_code=403, detail="Not allowed to access this task")
+
 
+def _remember_task_owner(task_id: str, owner_key: str) -> None:
+    _task_owner_cache[task_id] = owner_key
+    _task_owner_cache.move_to_end(task_id)
+    while len(_task_owner_cache) > TASK_OWNER_CACHE_MAX_ITEMS:
+        _task_owner_cache.popitem(last=False)
 
-def register_task(task_id: str, auth_key: Optional[str] = None) -> None:
+
+async def register_task(task_id: str, auth_key: Optional[str] = None) -> None:
     """
     Record task ownership and simple per-key / global history in Redis.
 
@@ -149,21 +256,50 @@ def register_task(task_id: str, auth_key: Optional[str] = None) -> None:
       best-effort owner mapping for access control.
     - Regardless of `auth_key`, we always append to the global history
       list so that anonymous / preview usage can still see recent tasks.
+
+    All commands are sent in one pipelined round trip.
     """
 
+    pipe = get_redis().pipeline(transaction=False)
+
     if auth_key:
-        redis_client.setex(
+        pipe.setex(
             name=f"{TASK_OWNER_KEY_PREFIX}{task_id}",
             time=TASK_OWNER_TTL_SECONDS,
             value=auth_key,
         )
 
         user_list_key = f"{USER_TASKS_KEY_PREFIX}{auth_key}"
-        redis_client.lpush(user_list_key, task_id)
-        redis_client.ltrim(user_list_key, 0, USER_TASKS_MAX_ITEMS - 1)
+        pipe.lpush(user_list_key, task_id)
+        pipe.ltrim(user_list_key, 0, USER_TASKS_MAX_ITEMS - 1)
 
-    redis_client.lpush(ALL_TASKS_KEY, task_id)
-    redis_client.ltrim(ALL_TASKS_KEY, 0, USER_TASKS_MAX_ITEMS - 1)
+    pipe.lpush(ALL_TASKS_KEY, task_id)
+    pipe.ltrim(ALL_TASKS_KEY, 0, USER_TASKS_MAX_ITEMS - 1)
+
+    await pipe.execute()
+    if auth_key:
+        _remember_task_owner(task_id, auth_key)
+
+
+async def watch_client_invalidations() -> None:
+    """
+    Apply `events.publish_client_invalidation` messages to this process's
+    client cache; runs for the lifetime of the API (see main.lifespan).
+    """
+
+    while True:
+        try:
+            async with get_event_hub().subscribe(CLIENTS_CHANNEL) as queue:
+                while True:
+                    event = await queue.get()
+                    client_id = event.get("client_id")
+                    _client_cache.invalidate_client(client_id if isinstance(client_id, str) else None)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Redis unavailable at subscribe time; entries still expire.
+            logger.warning("auth: client invalidation subscription failed, retrying", exc_info=True)
+            await asyncio.sleep(5.0)
 
 
 def build_image_url(relative_path: str) -> str:
@@ -173,3 +309,30 @@ def build_image_url(relative_path: str) -> str:
 
     relative_path = relative_path.lstrip("/")
     return f"/generated-images/{relative_path}"
+
+
+def build_embedded_image_url(relative_path: str) -> str:
+    """
+    `image_url` for history / batch responses: a presigned object-storage
+    URL when S3_PRESIGN_IMAGE_URLS is on (S3 backend only), otherwise the
+    same path as `build_image_url`.
+
+    Called from async handlers, so no S3 round trip here: files from before
+    the switch to S3 are still on disk, and a legacy path whose location is
+    not known yet (before / after scripts/migrate_storage_layout.py) goes
+    through `/generated-images/...`, which checks and caches it.
+    """
+
+    if settings.s3_presign_image_urls and is_s3_storage_enabled():
+        candidates = candidate_paths(relative_path)
+        output_root = settings.outputs_dir.resolve()
+        if any((output_root / candidate).is_file() for candidate in candidates):
+            return build_image_url(relative_path)
+        storage = get_s3_storage()
+        if len(candidates) == 1:
+            url, _ = storage.presigned_get_url(relative_path=candidates[0])
+            return url
+        presigned = storage.presigned_get_url_for_existing(relative_paths=candidates, lookup=False)
+        if presigned is not None:
+            return presigned[0]
+    return build_image_url(relative_path)
@@ -0,0 +1,118 @@
+"""
+Conditional GET helpers (ETag / If-None-Match -> 304).
+
+Polling clients mostly get back exactly what they already have, so the
+polled endpoints tag responses with a weak ETag built from a cheap
+version instead of hashing the body:
+
+- task status: a digest of the raw Redis values the response is built
+  from (Celery result meta + progress key), see `TaskState.version`;
+- batch detail / history: the Redis counters bumped by the worker
+  (libs/py_core/events.py) and by the API on enqueue / delete, read
+  *before* querying Postgres so a match skips the query entirely.
+
+Versions are only bumped after the DB write they describe, so a response
+is never older than its tag. Tags also roll over every
+ETAG_REVALIDATE_SECONDS, which bounds staleness if a bump is ever lost
+(e.g. writes made by maintenance scripts).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import secrets
+import time
+from typing import Optional
+
+from fastapi import Response
+
+from libs.py_core.events import VERSION_TTL_SECONDS, queue_version_bump
+
+from apps.api.redis_client import get_redis
+
+
+ETAG_REVALIDATE_SECONDS = 60
+
+
+def make_etag(*parts: object) -> str:
+    raw = "\x1f".join("" if part is None else str(part) for part in parts)
+    return 'W/"' + hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest() + '"'
+
+
+def make_version_etag(*parts: object) -> str:
+    """
+    ETag for a Redis-counter version; includes the revalidation bucket.
+    """
+
+    return make_etag(*parts, int(time.time() // ETAG_REVALIDATE_SECONDS))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header against `etag`.
+    """
+
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    # Cacheable, but always revalidated: the next poll sends If-None-Match.
+    response.headers["Cache-Control"] = "no-cache"
+
+
+async def read_version(key: str) -> str:
+    """
+    Current value of a version counter. A missing key is created with a
+    random base so that a counter that expired (or was flushed) cannot
+    repeat a value an old ETag was built from.
+    """
+
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.set(key, secrets.randbits(40), nx=True, ex=VERSION_TTL_SECONDS)
+    pipe.get(key)
+    _, value = await pipe.execute()
+    return value.decode("ascii") if isinstance(value, bytes) else str(value)
+
+
+async def version_etag(key: str, *parts: object) -> Optional[str]:
+    """
+    ETag for the version counter `key` plus `parts` (the response scope),
+    or None when Redis is unavailable (the response is then sent untagged).
+    """
+
+    try:
+        version = await read_version(key)
+    except Exception:
+        return None
+    return make_version_etag(*parts, version)
+
+
+async def bump_versions(
+    batch_id: Optional[str],
+    *,
+    history: bool = True,
+    api_client_id: Optional[str] = None,
+) -> None:
+    """
+    Best-effort version bump after the API itself changed a batch owned by
+    `api_client_id` (enqueue / delete).
+    """
+
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        queue_version_bump(pipe, batch_id, history=history, api_client_id=api_client_id)
+        await pipe.execute()
+    except Exception:
+        return
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager, suppress
+from typing import Any, AsyncIterator, Optional
+
+from apps.api.redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Per-subscriber buffer; when a slow client falls this far behind, the
+# oldest events are dropped (progress is lossy, terminal states are
+# re-read from the DB on reconnect).
+QUEUE_MAX_EVENTS = 256
+
+
+class EventHub:
+    """
+    Fan out worker events (libs/py_core/events.py) to SSE streams.
+
+    The whole API process shares one Redis pub/sub connection: a channel
+    is subscribed when its first stream starts and unsubscribed when the
+    last one ends, so many open tabs cost one connection, not one each.
+    """
+
+    def __init__(self) -> None:
+        self._listeners: dict[str, set[asyncio.Queue[dict[str, Any]]]] = {}
+        self._pubsub: Any = None
+        self._reader: Optional[asyncio.Task[None]] = None
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def subscribe(self, *channels: str) -> AsyncIterator[asyncio.Queue[dict[str, Any]]]:
+        queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize=QUEUE_MAX_EVENTS)
+        async with self._lock:
+            if self._pubsub is None:
+                self._pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            new_channels = [channel for channel in channels if channel not in self._listeners]
+            if new_channels:
+                await self._pubsub.subscribe(*new_channels)
+            for channel in channels:
+                self._listeners.setdefault(channel, set()).add(queue)
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._run())
+        try:
+            yield queue
+        finally:
+            async with self._lock:
+                idle: list[str] = []
+                for channel in channels:
+                    listeners = self._listeners.get(channel)
+                    if listeners is None:
+                        continue
+                    listeners.discard(queue)
+                    if not listeners:
+                        del self._listeners[channel]
+                        idle.append(channel)
+                if idle and self._pubsub is not None:
+                    with suppress(Exception):
+                        await self._pubsub.unsubscribe(*idle)
+
+    def _dispatch(self, channel: str, event: dict[str, Any]) -> None:
+        for queue in self._listeners.get(channel, ()):
+            if queue.full():
+                with suppress(asyncio.QueueEmpty):
+                    queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def _run(self) -> None:
+        while True:
+            if not self._listeners:
+                await asyncio.sleep(0.5)
+                continue
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # redis-py re-subscribes every channel when it reconnects.
+                logger.warning("event hub: pub/sub read failed, retrying", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+            if not message or message.get("type") != "message":
+                continue
+            try:
+                channel = message["channel"].decode("utf-8")
+                event = json.loads(message["data"])
+            except Exception:
+                continue
+            if isinstance(event, dict):
+                self._dispatch(channel, event)
+
+    async def close(self) -> None:
+        reader, self._reader = self._reader, None
+        if reader is not None:
+            reader.cancel()
+            with suppress(BaseException):
+                await reader
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            with suppress(Exception):
+                await pubsub.aclose()
+        self._listeners.clear()
+
+
+_hub: Optional[EventHub] = None
+
+
+def get_event_hub() -> EventHub:
+    global _hub
+
+    if _hub is None:
+        _hub = EventHub()
+    return _hub
+
+
+async def close_event_hub() -> None:
+    global _hub
+
+    hub, _hub = _hub, None
+    if hub is not None:
+        await hub.close()
@@ -1,5 +1,7 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
-from typing import cast
+from typing import AsyncIterator
 
 from dotenv import load_dotenv
 
@@ -17,46 +19,44 @@ env_file = APP_ROOT / ".env"
 if env_file.exists():
     load_dotenv(env_file, override=False)
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
-from fastapi.responses import StreamingResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI
 
-from libs.py_core.config import get_output_root, get_settings, is_s3_storage_enabled
-from libs.py_core.storage import S3Storage, get_storage
-from apps.api.routes import images, system
+from libs.py_core import db_async
+from apps.api.auth import watch_client_invalidations
+from apps.api.event_hub import close_event_hub
+from apps.api.redis_client import close_redis, get_redis
+from apps.api.routes import events, generated_images, images, system
 
 
-app = FastAPI(title="Z-Image API")
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    # Request handlers only use the async Postgres pool / Redis client, so
+    # a slow query never blocks the event loop for other requests.
+    await db_async.open_pool()
+    get_redis()
+    invalidations = asyncio.create_task(watch_client_invalidations())
+    try:
+        yield
+    finally:
+        invalidations.cancel()
+        with suppress(asyncio.CancelledError):
+            await invalidations
+        await close_event_hub()
+        await close_redis()
+        await db_async.close_pool()
 
 
-if is_s3_storage_enabled():
-    storage = cast(S3Storage, get_storage())
-    output_root = get_settings().outputs_dir.resolve()
+app = FastAPI(title="Z-Image API", lifespan=lifespan)
 
-    @app.get("/generated-images/{relative_path:path}")
-    def get_generated_image(relative_path: str):
-        # Smooth transition: when S3 is enabled but some historical files are still
-        # on disk, we fall back to the legacy local outputs folder.
-        try:
-            obj = storage.get_object(relative_path=relative_path)
-        except FileNotFoundError:
-            local_path = (output_root / relative_path.lstrip("/")).resolve()
-            if local_path.is_file():
-                return FileResponse(path=str(local_path))
-            raise HTTPException(status_code=404, detail="Image not found")
-
-        media_type = obj.content_type or "application/octet-stream"
-        return StreamingResponse(obj.iter_chunks(), media_type=media_type)
-else:
-    # Expose generated images via a static mount so that the API can
-    # return simple relative URLs (e.g. /generated-images/20250101/xxx.png).
-    output_root = get_output_root()
-    app.mount("/generated-images", StaticFiles(directory=str(output_root)), name="generated-images")
 
+# Generated images (/generated-images/...), local disk or S3 / MinIO.
+app.include_router(generated_images.router)
 
 # System / health endpoints (root scope).
 app.include_router(system.router)
 
 # Core image-generation API (versioned under /v1).
 app.include_router(images.router, prefix="/v1")
+
+# Server-Sent Events progress streams (/v1/tasks/{id}/events, /v1/history/{id}/events).
+app.include_router(events.router, prefix="/v1")
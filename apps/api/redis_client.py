@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+from libs.py_core.config import get_settings
+
+
+_client: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """
+    Shared asyncio Redis client (with its own connection pool) for the API.
+
+    Created on first use / at startup by the app lifespan and closed on
+    shutdown via `close_redis()`.
+    """
+
+    global _client
+
+    if _client is None:
+        _client = aioredis.Redis.from_url(str(get_settings().redis_url))
+    return _client
+
+
+async def close_redis() -> None:
+    global _client
+
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from libs.py_core.events import batch_channel, task_channel
+
+from apps.api.auth import (
+    STREAM_TOKEN_TTL_SECONDS,
+    AuthContext,
+    build_embedded_image_url,
+    get_auth_context,
+    get_stream_auth_context,
+    issue_stream_token,
+)
+from apps.api.event_hub import get_event_hub
+from apps.api.routes.images import batch_detail_snapshot, task_status_snapshot
+from apps.api.schemas import BatchDetail, BatchImageItem, StreamTokenResponse, TaskStatusResponse
+from apps.api.task_state import TERMINAL_STATES
+
+
+router = APIRouter(tags=["events"])
+
+HEARTBEAT_SECONDS = 15.0
+# Streams are closed after this long; EventSource reconnects on its own
+# and gets a fresh snapshot.
+STREAM_MAX_SECONDS = 30 * 60
+
+TERMINAL_ITEM_STATUSES = {"success", "error", "cancelled"}
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Disable proxy buffering (nginx) so events are delivered immediately.
+    "X-Accel-Buffering": "no",
+}
+
+
+def _sse(event: str, data: Any) -> str:
+    if isinstance(data, BaseModel):
+        data = data.model_dump()
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def _translate(event: dict[str, Any]) -> Optional[tuple[str, Any]]:
+    """
+    Map a worker event (libs/py_core/events.py) to an SSE (event, data) pair.
+    """
+
+    task_id = event.get("task_id")
+    index = event.get("batch_index")
+    if event.get("type") == "progress":
+        return "progress", {"task_id": task_id, "index": index, "progress": event.get("progress")}
+
+    if event.get("type") == "status":
+        rel = event.get("preview_relative_path") or event.get("relative_path")
+        return "item", BatchImageItem(
+            task_id=str(task_id),
+            index=index if isinstance(index, int) else 0,
+            status=str(event.get("status")),
+            image_url=build_embedded_image_url(str(rel)) if rel else None,
+            width=event.get("width"),
+            height=event.get("height"),
+            seed=event.get("seed"),
+            error_code=event.get("error_code"),
+            error_hint=event.get("error_hint"),
+        )
+
+    return None
+
+
+async def _next_event(queue: asyncio.Queue[dict[str, Any]], deadline: float) -> Optional[dict[str, Any]]:
+    """
+    Wait for the next event; None means "send a heartbeat".
+    """
+
+    timeout = min(HEARTBEAT_SECONDS, max(0.0, deadline - time.monotonic()))
+    try:
+        return await asyncio.wait_for(queue.get(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None
+
+
+async def _batch_stream(
+    request: Request,
+    stack: AsyncExitStack,
+    queue: asyncio.Queue[dict[str, Any]],
+    batch_id: str,
+    snapshot: BatchDetail,
+) -> AsyncIterator[str]:
+    try:
+        batch_size = snapshot.batch.batch_size or len(snapshot.items)
+        statuses = {item.task_id: item.status for item in snapshot.items}
+        yield _sse("snapshot", snapshot)
+
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while True:
+            finished = [status for status in statuses.values() if status in TERMINAL_ITEM_STATUSES]
+            if len(finished) >= batch_size:
+                yield _sse(
+                    "done",
+                    {
+                        "batch_id": batch_id,
+                        "success_count": finished.count("success"),
+                        "failed_count": len(finished) - finished.count("success"),
+                    },
+                )
+                return
+            if time.monotonic() >= deadline or await request.is_disconnected():
+                return
+
+            event = await _next_event(queue, deadline)
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            translated = _translate(event)
+            if translated is None:
+                continue
+            name, data = translated
+            if name == "item":
+                if statuses.get(data.task_id) in TERMINAL_ITEM_STATUSES:
+                    # Already reported by the snapshot.
+                    continue
+                statuses[data.task_id] = data.status
+            yield _sse(name, data)
+    finally:
+        await stack.aclose()
+
+
+async def _task_stream(
+    request: Request,
+    stack: AsyncExitStack,
+    queue: asyncio.Queue[dict[str, Any]],
+    snapshot: TaskStatusResponse,
+) -> AsyncIterator[str]:
+    try:
+        yield _sse("snapshot", snapshot)
+        if snapshot.status in TERMINAL_STATES:
+            yield _sse("done", {"task_id": snapshot.task_id, "status": snapshot.status})
+            return
+
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline and not await request.is_disconnected():
+            event = await _next_event(queue, deadline)
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            translated = _translate(event)
+            if translated is None:
+                continue
+            name, data = translated
+            yield _sse(name, data)
+            if name == "item" and data.status in TERMINAL_ITEM_STATUSES:
+                yield _sse(
+                    "done",
+                    {"task_id": snapshot.task_id, "status": "SUCCESS" if data.status == "success" else "FAILURE"},
+                )
+                return
+    finally:
+        await stack.aclose()
+
+
+@router.post("/events/token", response_model=StreamTokenResponse)
+async def create_stream_token(auth: AuthContext = Depends(get_auth_context)) -> StreamTokenResponse:
+    """
+    Short-lived token for the SSE endpoints below. EventSource cannot send
+    headers, so browsers pass `?stream_token=...` instead of the key.
+    """
+
+    return StreamTokenResponse(token=await issue_stream_token(auth), expires_in=STREAM_TOKEN_TTL_SECONDS)
+
+
+@router.get("/tasks/{task_id}/events")
+async def stream_task_events(
+    task_id: str,
+    request: Request,
+    auth: AuthContext = Depends(get_stream_auth_context),
+) -> StreamingResponse:
+    """
+    Server-Sent Events stream for one task.
+
+    Events: `snapshot` (same body as GET /v1/tasks/{task_id}), then
+    `progress` / `item` as the worker reports them, and a final `done`
+    after which the server closes the stream. Authenticate with the
+    `X-Auth-Key` header or `?stream_token=` (POST /v1/events/token).
+    """
+
+    stack = AsyncExitStack()
+    # Subscribe before taking the snapshot so no event falls in between.
+    queue = await stack.enter_async_context(get_event_hub().subscribe(task_channel(task_id)))
+    try:
+        snapshot = await task_status_snapshot(task_id, auth)
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    return StreamingResponse(
+        _task_stream(request, stack, queue, snapshot),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@router.get("/history/{batch_id}/events")
+async def stream_batch_events(
+    batch_id: str,
+    request: Request,
+    auth: AuthContext = Depends(get_stream_auth_context),
+) -> StreamingResponse:
+    """
+    Server-Sent Events stream for a generation batch (auth as for the
+    task stream).
+
+    Events: `snapshot` (same body as GET /v1/history/{batch_id}), then
+    `progress` ({task_id, index, progress}) and `item` (a BatchImageItem
+    whenever an image starts, succeeds or fails), and a final `done`
+    ({batch_id, success_count, failed_count}) once every image finished.
+    """
+
+    stack = AsyncExitStack()
+    queue = await stack.enter_async_context(get_event_hub().subscribe(batch_channel(batch_id)))
+    try:
+        snapshot = await batch_detail_snapshot(batch_id, auth)
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    return StreamingResponse(
+        _batch_stream(request, stack, queue, batch_id, snapshot),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
@@ -0,0 +1,229 @@
+"""
+GET /generated-images/{relative_path}: serving generated image files.
+
+Every file name embeds a unique image_id and is never rewritten, so:
+
+- the ETag is a strong tag derived from the path alone (identical for the
+  local and S3 backends) and If-None-Match is answered with 304 before
+  touching the disk or S3;
+- responses carry `Cache-Control: public, max-age=..., immutable`, so
+  browsers / CDNs do not even revalidate.
+
+Range requests are supported for both backends (Starlette's FileResponse
+locally, a pass-through `Range` on S3 GETs). With Z_IMAGE_SENDFILE_MODE
+local files are handed to the fronting proxy via X-Accel-Redirect /
+X-Sendfile and Python never reads them.
+
+In S3 proxy mode objects are read through a local disk cache
+(`storage.get_s3_read_cache`, Z_IMAGE_S3_CACHE_*) and served as files, so
+hot previews do not cost an S3 GET each time.
+
+Paths in the legacy date layout are also looked up at their sharded
+location (libs/py_core/storage_keys.py), so URLs stored before
+scripts/migrate_storage_layout.py moved the objects keep working.
+
+`?w=<width>` returns a WebP downscaled to the nearest configured preview
+width (libs/py_core/previews.py), produced from the original on first
+request and kept in a byte-bounded disk cache (Z_IMAGE_RESIZE_CACHE_*).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import mimetypes
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Optional, TypeVar, cast
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+
+from libs.py_core.config import get_output_root, get_settings, is_s3_storage_enabled
+from libs.py_core.disk_cache import DiskCache
+from libs.py_core.previews import resize_encoded, snap_preview_width
+from libs.py_core.storage import InvalidRangeError, S3Storage, get_s3_read_cache, get_storage
+from libs.py_core.storage_keys import candidate_paths
+
+from apps.api.etags import etag_matches
+
+
+router = APIRouter(tags=["generated-images"])
+
+T = TypeVar("T")
+
+settings = get_settings()
+
+# Single "bytes=<start>-<end>" range; anything else gets the full body.
+_SINGLE_RANGE_RE = re.compile(r"^bytes=(\d+-\d*|-\d+)$")
+
+
+def _output_root() -> Path:
+    if is_s3_storage_enabled():
+        # Legacy files from before the switch to S3; do not create the dir.
+        return settings.outputs_dir.resolve()
+    return get_output_root()
+
+
+def image_etag(relative_path: str) -> str:
+    digest = hashlib.blake2b(relative_path.lstrip("/").encode("utf-8"), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def _cache_headers(etag: str) -> dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.z_image_image_cache_max_age}, immutable",
+    }
+
+
+def _local_file(relative_path: str) -> Optional[Path]:
+    output_root = _output_root()
+    for candidate in candidate_paths(relative_path):
+        local_path = (output_root / candidate).resolve()
+        if local_path.is_relative_to(output_root) and local_path.is_file():
+            return local_path
+    return None
+
+
+def _first_found(relative_path: str, fetch: Callable[[str], T]) -> T:
+    """
+    `fetch` the first existing candidate location of `relative_path`.
+    """
+
+    candidates = candidate_paths(relative_path)
+    for candidate in candidates[:-1]:
+        try:
+            return fetch(candidate)
+        except FileNotFoundError:
+            continue
+    return fetch(candidates[-1])
+
+
+def _serve_local(local_path: Path, headers: dict[str, str]) -> Response:
+    mode = settings.z_image_sendfile_mode.strip().lower()
+    if mode in ("x-accel-redirect", "x-sendfile"):
+        if mode == "x-accel-redirect":
+            prefix = settings.z_image_sendfile_prefix.rstrip("/")
+            # The file found may be the sharded location of a legacy path.
+            served_path = local_path.relative_to(_output_root()).as_posix()
+            headers["X-Accel-Redirect"] = f"{prefix}/{quote(served_path)}"
+        else:
+            headers["X-Sendfile"] = str(local_path)
+        media_type = mimetypes.guess_type(local_path.name)[0] or "application/octet-stream"
+        return Response(headers=headers, media_type=media_type)
+
+    return FileResponse(path=str(local_path), headers=headers)
+
+
+@lru_cache(maxsize=1)
+def get_resize_cache() -> DiskCache:
+    return DiskCache(
+        root=settings.z_image_resize_cache_dir.resolve(),
+        max_bytes=settings.z_image_resize_cache_max_bytes,
+    )
+
+
+def _read_original(relative_path: str) -> bytes:
+    local_path = _local_file(relative_path)
+    if local_path is not None:
+        return local_path.read_bytes()
+    if not is_s3_storage_enabled():
+        raise FileNotFoundError(relative_path)
+    s3_cache = get_s3_read_cache()
+    if s3_cache is not None:
+        return _first_found(relative_path, s3_cache.fetch).read_bytes()
+    return _first_found(relative_path, lambda path: cast(S3Storage, get_storage()).get_bytes(relative_path=path))
+
+
+def _serve_resized(relative_path: str, width: int, headers: dict[str, str]) -> Response:
+    cache = get_resize_cache()
+    key = f"w{width}/{relative_path}"
+    path = cache.get(key)
+    if path is None:
+        try:
+            data = _read_original(relative_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Image not found")
+        try:
+            encoded = resize_encoded(data, width)
+        except Exception:
+            raise HTTPException(status_code=415, detail="Cannot resize this file")
+        path = cache.put(key, encoded.data)
+    return FileResponse(path=str(path), headers=headers, media_type="image/webp")
+
+
+def _serve_s3(relative_path: str, request: Request, headers: dict[str, str]) -> Response:
+    storage = cast(S3Storage, get_storage())
+
+    if settings.z_image_s3_serve_mode.strip().lower() == "redirect":
+        # Sign the candidate that exists (e.g. a legacy path not migrated yet).
+        presigned = storage.presigned_get_url_for_existing(relative_paths=candidate_paths(relative_path))
+        if presigned is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        url, max_age = presigned
+        # The browser may reuse the redirect while the cached URL is still
+        # being handed out (the URL itself stays valid longer).
+        return RedirectResponse(url, status_code=302, headers={"Cache-Control": f"private, max-age={max_age}"})
+
+    s3_cache = get_s3_read_cache()
+    if s3_cache is not None:
+        try:
+            cached_path = _first_found(relative_path, s3_cache.fetch)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Image not found")
+        # FileResponse handles Range / HEAD for the cached copy.
+        media_type = mimetypes.guess_type(relative_path)[0] or "application/octet-stream"
+        return FileResponse(path=str(cached_path), headers=headers, media_type=media_type)
+
+    byte_range = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if byte_range and (not _SINGLE_RANGE_RE.match(byte_range.replace(" ", "")) or (if_range and if_range != headers["ETag"])):
+        byte_range = None
+
+    try:
+        obj = _first_found(relative_path, lambda path: storage.get_object(relative_path=path, byte_range=byte_range))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except InvalidRangeError:
+        return Response(status_code=416, headers=headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    if obj.content_length is not None:
+        headers["Content-Length"] = str(obj.content_length)
+    status_code = 200
+    if byte_range and obj.content_range:
+        status_code = 206
+        headers["Content-Range"] = obj.content_range
+
+    media_type = obj.content_type or "application/octet-stream"
+    return StreamingResponse(obj.iter_chunks(), status_code=status_code, media_type=media_type, headers=headers)
+
+
+@router.api_route("/generated-images/{relative_path:path}", methods=["GET", "HEAD"])
+def get_generated_image(
+    relative_path: str,
+    request: Request,
+    w: Optional[int] = Query(default=None, ge=1),
+) -> Response:
+    relative_path = relative_path.lstrip("/")
+    # Widths snap up to the configured set; wider than all = the original.
+    width = snap_preview_width(w) if w else None
+    etag = image_etag(relative_path if width is None else f"{relative_path}?w={width}")
+    headers = _cache_headers(etag)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if width is not None:
+        return _serve_resized(relative_path, width, headers)
+
+    # With S3 enabled, files from before the switch still live on disk
+    # (smooth transition); a stat is much cheaper than an S3 round trip.
+    local_path = _local_file(relative_path)
+    if local_path is not None:
+        return _serve_local(local_path, headers)
+    if not is_s3_storage_enabled():
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    return _serve_s3(relative_path, request, headers)
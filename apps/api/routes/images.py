@@ -1,14 +1,26 @@
 from __future__ import annotations
 
+import base64
 import json
-from typing import Optional, cast
+from datetime import datetime
+from collections import OrderedDict
+from typing import Callable, Optional, Union, cast
+from uuid import UUID, uuid4
 
-from celery.result import AsyncResult
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
 
 from libs.py_core.celery_app import celery_app
-from libs.py_core.db import get_api_client_id_for_key, get_db_cursor
-from libs.py_core.tasks import generate_image_task
+from libs.py_core.db import record_generation_failed
+from libs.py_core.db_async import (
+    get_api_client_id_for_key,
+    get_db_cursor,
+    record_generation_cancelled,
+    record_generation_enqueued,
+)
+from libs.py_core.events import batch_version_key, history_version_key, queue_task_cancelled
+from libs.py_core.previews import pick_preview_variant, snap_preview_width
+from libs.py_core.tasks import generate_image_batch_task, generate_image_task
 from libs.py_core.types import GenerationResult
 
 from apps.api.schemas import (
@@ -16,23 +28,43 @@ from apps.api.schemas import (
     BatchImageItem,
     CancelTaskResponse,
     DeleteTaskResponse,
+    GenerateImageBatchRequest,
+    GenerateImageBatchResponse,
     GenerateImageRequest,
     GenerateImageResponse,
+    TaskStatusBatchRequest,
     TaskStatusResponse,
     TaskSummary,
 )
 from apps.api.auth import (
     AuthContext,
+    build_embedded_image_url,
     build_image_url,
     enforce_task_access,
+    enforce_tasks_access,
     get_auth_context,
     get_auth_context_optional,
+    get_enqueue_auth_context,
     settings,
 )
+from apps.api.etags import bump_versions, etag_matches, make_etag, not_modified, set_etag, version_etag
+from apps.api.redis_client import get_redis
+from apps.api.task_state import (
+    TERMINAL_STATES,
+    TaskState,
+    fetch_task_state,
+    fetch_task_states,
+    wait_for_task_state,
+)
 
 
 router = APIRouter(tags=["images"])
 
+# batch_id -> api_client_id, for the ownership check in front of a 304.
+# A batch never changes owner; the cache is only bounded in size.
+BATCH_OWNER_CACHE_MAX_ITEMS = 50_000
+_batch_owner_cache: OrderedDict[str, Optional[str]] = OrderedDict()
+
 
 def _decode_error_payload(raw: object) -> tuple[Optional[str], Optional[str], Optional[str]]:
     """
@@ -43,6 +75,11 @@ def _decode_error_payload(raw: object) -> tuple[Optional[str], Optional[str], Op
     if raw is None:
         return None, None, None
 
+    if isinstance(raw, BaseException):
+        # Failed tasks come back as the re-raised RuntimeError whose message
+        # is the JSON payload built by the worker.
+        raw = str(raw)
+
     if isinstance(raw, str):
         try:
             data = json.loads(raw)
@@ -71,16 +108,89 @@ def _decode_error_payload(raw: object) -> tuple[Optional[str], Optional[str], Op
     return code, hint, detail
 
 
+def _with_batch_id(
+    metadata: Optional[dict[str, object]],
+    api_client_id: Optional[str] = None,
+) -> tuple[dict[str, object], str]:
+    """
+    Copy request metadata, making sure it carries a valid batch_id so that
+    the enqueue-time rows and the worker agree on the batch, and the
+    owner's api_client_id (the worker bumps that client's history version).
+    """
+
+    normalized: dict[str, object] = dict(metadata or {})
+    raw_batch_id = normalized.get("batch_id")
+    try:
+        batch_id = str(UUID(str(raw_batch_id))) if raw_batch_id else str(uuid4())
+    except ValueError:
+        batch_id = str(uuid4())
+    normalized["batch_id"] = batch_id
+    normalized.pop("api_client_id", None)
+    if api_client_id:
+        normalized["api_client_id"] = api_client_id
+    return normalized, batch_id
+
+
+async def _history_owner_for(auth_key: Optional[str]) -> Optional[str]:
+    """
+    api_client_id whose history a new batch shows up in (a cache hit after
+    get_enqueue_auth_context); None if it cannot be resolved.
+    """
+
+    try:
+        return await get_api_client_id_for_key(auth_key)
+    except Exception:
+        return None
+
+
+async def _publish_or_fail(
+    task_ids: list[str],
+    batch_id: str,
+    publish: Callable[[], object],
+    *,
+    api_client_id: Optional[str] = None,
+) -> None:
+    """
+    Publish a task whose `pending` rows were already written; if the broker
+    rejects it, mark those rows failed instead of leaving them pending.
+
+    Celery publishing is blocking (kombu), so it runs in the threadpool.
+    """
+
+    try:
+        await run_in_threadpool(publish)
+    except Exception as exc:
+        for task_id in task_ids:
+            await run_in_threadpool(
+                record_generation_failed,
+                task_id,
+                error_code="enqueue_failed",
+                error_hint="任务入队失败，请稍后重试。",
+                error_message=str(exc),
+            )
+        await bump_versions(batch_id, api_client_id=api_client_id)
+        raise
+
+
+def _wait_timeout(wait: float) -> float:
+    return min(wait, settings.api_max_wait_seconds)
+
+
 @router.post("/images/generate", response_model=GenerateImageResponse)
 async def enqueue_image_generation(
     payload: GenerateImageRequest,
-    auth: AuthContext = Depends(get_auth_context),
+    auth: AuthContext = Depends(get_enqueue_auth_context),
+    wait: float = Query(default=0.0, ge=0),
 ) -> GenerateImageResponse:
     """
     Enqueue an image generation task.
 
     Returns a task_id that can be polled via /v1/tasks/{task_id}, and
     includes a convenience status_url for front-end usage.
+
+    With `?wait=<seconds>` (capped by API_MAX_WAIT_SECONDS) the response is
+    held until the task finishes or the wait expires, and carries the
+    status / image_url at that point.
     """
 
     if settings.api_enable_auth:
@@ -91,19 +201,51 @@ async def enqueue_image_generation(
         # In dev / local mode, auth is optional.
         auth_key_for_task = auth.key
 
-    task = generate_image_task.delay(
+    api_client_id = await _history_owner_for(auth_key_for_task)
+    metadata, batch_id = _with_batch_id(payload.metadata, api_client_id)
+    task_id = str(uuid4())
+
+    # Write the batch + pending task rows before publishing so the task is
+    # visible in history immediately; the worker then only flips its status.
+    await record_generation_enqueued(
+        [task_id],
         prompt=payload.prompt,
         height=payload.height,
         width=payload.width,
         num_inference_steps=payload.num_inference_steps,
         guidance_scale=payload.guidance_scale,
-        seed=payload.seed,
-        negative_prompt=payload.negative_prompt,
+        seeds=[payload.seed],
+        negative_prompt=payload.negative_prompt if payload.negative_prompt is not None else "",
         cfg_normalization=payload.cfg_normalization,
         cfg_truncation=payload.cfg_truncation,
         max_sequence_length=payload.max_sequence_length,
         auth_key=auth_key_for_task,
-        metadata=payload.metadata,
+        metadata=metadata,
+        callback_url=payload.callback_url,
+    )
+    await bump_versions(batch_id, api_client_id=api_client_id)
+
+    await _publish_or_fail(
+        [task_id],
+        batch_id,
+        lambda: generate_image_task.apply_async(
+            kwargs={
+                "prompt": payload.prompt,
+                "height": payload.height,
+                "width": payload.width,
+                "num_inference_steps": payload.num_inference_steps,
+                "guidance_scale": payload.guidance_scale,
+                "seed": payload.seed,
+                "negative_prompt": payload.negative_prompt,
+                "cfg_normalization": payload.cfg_normalization,
+                "cfg_truncation": payload.cfg_truncation,
+                "max_sequence_length": payload.max_sequence_length,
+                "auth_key": auth_key_for_task,
+                "metadata": metadata,
+            },
+            task_id=task_id,
+        ),
+        api_client_id=api_client_id,
     )
 
     # Store a lightweight owner mapping for quick access control checks
@@ -113,32 +255,180 @@ async def enqueue_image_generation(
     # recent generations.
     from apps.api.auth import register_task  # local import to avoid cycles
 
-    register_task(task.id, auth_key_for_task)
+    await register_task(task_id, auth_key_for_task)
 
-    status_url = f"/v1/tasks/{task.id}"
+    status_url = f"/v1/tasks/{task_id}"
 
-    return GenerateImageResponse(task_id=task.id, status_url=status_url, image_url=None)
+    if wait > 0:
+        task_status = _build_task_status(await wait_for_task_state(task_id, _wait_timeout(wait)))
+        return GenerateImageResponse(
+            task_id=task_id,
+            status_url=status_url,
+            image_url=task_status.image_url,
+            status=task_status.status,
+            error_code=task_status.error_code,
+            error_hint=task_status.error_hint,
+        )
+
+    return GenerateImageResponse(task_id=task_id, status_url=status_url, image_url=None)
+
+
+@router.post("/images/generate-batch", response_model=GenerateImageBatchResponse)
+async def enqueue_image_batch_generation(
+    payload: GenerateImageBatchRequest,
+    auth: AuthContext = Depends(get_enqueue_auth_context),
+) -> GenerateImageBatchResponse:
+    """
+    Enqueue a batch of images that the worker renders in one batched
+    pipeline call (the prompt is encoded once for the whole batch).
+
+    Each image is still recorded as its own history item; progress can be
+    polled via /v1/history/{batch_id} or the returned status_url.
+    """
+
+    if settings.api_enable_auth:
+        if not auth.key:
+            raise HTTPException(status_code=401, detail="Missing API auth key")
+    auth_key_for_task: Optional[str] = auth.key
+
+    if payload.seeds is not None:
+        if len(payload.seeds) != payload.num_images:
+            raise HTTPException(status_code=422, detail="len(seeds) must equal num_images")
+        seeds: list[Optional[int]] = list(payload.seeds)
+    elif payload.seed is not None:
+        seeds = [payload.seed + index for index in range(payload.num_images)]
+    else:
+        seeds = [None] * payload.num_images
+
+    api_client_id = await _history_owner_for(auth_key_for_task)
+    metadata, batch_id = _with_batch_id(payload.metadata, api_client_id)
+
+    task_id = uuid4().hex
+    item_task_ids = [f"{task_id}-{index}" for index in range(len(seeds))]
+
+    # One multi-row insert for the batch and all of its pending items.
+    await record_generation_enqueued(
+        item_task_ids,
+        prompt=payload.prompt,
+        height=payload.height,
+        width=payload.width,
+        num_inference_steps=payload.num_inference_steps,
+        guidance_scale=payload.guidance_scale,
+        seeds=seeds,
+        negative_prompt=payload.negative_prompt if payload.negative_prompt is not None else "",
+        cfg_normalization=payload.cfg_normalization,
+        cfg_truncation=payload.cfg_truncation,
+        max_sequence_length=payload.max_sequence_length,
+        auth_key=auth_key_for_task,
+        metadata={**metadata, "batch_size": len(seeds), "batch_index": 0, "batch_task_id": task_id},
+        callback_url=payload.callback_url,
+    )
+    await bump_versions(batch_id, api_client_id=api_client_id)
+
+    await _publish_or_fail(
+        item_task_ids,
+        batch_id,
+        lambda: generate_image_batch_task.apply_async(
+            args=(payload.prompt,),
+            kwargs={
+                "seeds": seeds,
+                "height": payload.height,
+                "width": payload.width,
+                "num_inference_steps": payload.num_inference_steps,
+                "guidance_scale": payload.guidance_scale,
+                "negative_prompt": payload.negative_prompt,
+                "cfg_normalization": payload.cfg_normalization,
+                "cfg_truncation": payload.cfg_truncation,
+                "max_sequence_length": payload.max_sequence_length,
+                "auth_key": auth_key_for_task,
+                "metadata": metadata,
+            },
+            task_id=task_id,
+        ),
+        api_client_id=api_client_id,
+    )
+
+    from apps.api.auth import register_task  # local import to avoid cycles
+
+    await register_task(task_id, auth_key_for_task)
+
+    return GenerateImageBatchResponse(
+        task_id=task_id,
+        batch_id=batch_id,
+        status_url=f"/v1/tasks/{task_id}",
+        item_task_ids=item_task_ids,
+    )
 
 
 @router.get("/tasks/{task_id}", response_model=TaskStatusResponse)
 async def get_task_status(
     task_id: str,
+    response: Response,
     auth: AuthContext = Depends(get_auth_context),
-) -> TaskStatusResponse:
+    wait: float = Query(default=0.0, ge=0),
+    if_none_match: Optional[str] = Header(default=None),
+) -> Union[TaskStatusResponse, Response]:
     """
     Get the current status of a generation task.
 
     When completed successfully, includes the full result payload as well
     as a convenience image_url pointing at the static files mount.
+
+    Long-poll: with `?wait=<seconds>` (capped by API_MAX_WAIT_SECONDS) the
+    request is held until the task reaches a terminal state or the wait
+    expires, instead of returning the current state immediately.
+
+    Responses carry an ETag; a poll with a matching If-None-Match gets an
+    empty 304 instead of the body.
     """
 
-    result = AsyncResult(task_id, app=celery_app)
+    result = await fetch_task_state(task_id)
+
+    await enforce_task_access(task_id, auth, result)
 
-    if result is None:
-        raise HTTPException(status_code=404, detail="Task not found")
+    if wait > 0 and result.status not in TERMINAL_STATES:
+        result = await wait_for_task_state(task_id, _wait_timeout(wait))
 
-    enforce_task_access(task_id, auth, result)
+    etag = make_etag("task", result.version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    return _build_task_status(result)
+
+
+async def task_status_snapshot(task_id: str, auth: AuthContext) -> TaskStatusResponse:
+    """
+    GET /v1/tasks/{task_id} body without long-poll / conditional handling.
+    """
 
+    result = await fetch_task_state(task_id)
+    await enforce_task_access(task_id, auth, result)
+    return _build_task_status(result)
+
+
+@router.post("/tasks/status", response_model=list[TaskStatusResponse])
+async def get_task_statuses(
+    payload: TaskStatusBatchRequest,
+    auth: AuthContext = Depends(get_auth_context),
+) -> list[TaskStatusResponse]:
+    """
+    Bulk form of GET /v1/tasks/{task_id}: resolve up to 100 tasks with one
+    Redis MGET (result + progress) and one MGET for the access check.
+
+    Items are returned in request order (duplicates removed). If any task
+    belongs to another key the whole request fails with 403.
+    """
+
+    task_ids = list(dict.fromkeys(payload.task_ids))
+    results = await fetch_task_states(task_ids)
+
+    await enforce_tasks_access(auth, results)
+
+    return [_build_task_status(result) for result in results]
+
+
+def _build_task_status(result: TaskState) -> TaskStatusResponse:
+    task_id = result.task_id
     status = result.status
     payload: GenerationResult | None = None
     error: Optional[str] = None
@@ -179,6 +469,35 @@ async def get_task_status(
     )
 
 
+async def _finish_cancelled(task_id: str) -> None:
+    """
+    Record a revoked task as finished right away. A queued task never
+    reaches a worker that would do it, so without this its rows (and
+    batch) would stay `pending`.
+
+    - DB: still pending / running rows -> `cancelled`;
+    - Celery result -> REVOKED, so status polls and long-polls end;
+    - a `cancelled` status event per row (SSE, versions) and on the task
+      channel of a batch task (wakes `?wait=`).
+    """
+
+    cancelled = await record_generation_cancelled(task_id)
+    try:
+        await run_in_threadpool(celery_app.backend.mark_as_revoked, task_id, "cancelled")
+    except Exception:
+        pass
+
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for item_task_id, metadata in cancelled:
+            queue_task_cancelled(pipe, item_task_id, metadata)
+        if task_id not in {item_task_id for item_task_id, _ in cancelled}:
+            queue_task_cancelled(pipe, task_id, None)
+        await pipe.execute()
+    except Exception:
+        return
+
+
 @router.post("/tasks/{task_id}/cancel", response_model=CancelTaskResponse)
 async def cancel_task(
     task_id: str,
@@ -186,13 +505,14 @@ async def cancel_task(
 ) -> CancelTaskResponse:
     """
     Request cancellation of a running generation task.
+
+    A batch item id (`<task_id>-<index>`) cancels its whole batch task: the
+    images of a batch are rendered in one pipeline call.
     """
 
-    result = AsyncResult(task_id, app=celery_app)
-    if result is None:
-        raise HTTPException(status_code=404, detail="Task not found")
+    result = await fetch_task_state(task_id)
 
-    enforce_task_access(task_id, auth, result)
+    await enforce_task_access(task_id, auth, result)
 
     terminal_states = {"SUCCESS", "FAILURE", "REVOKED"}
     status = result.status or "PENDING"
@@ -203,11 +523,15 @@ async def cancel_task(
             message="Task already completed" if status != "REVOKED" else "Task already cancelled",
         )
 
-    celery_app.control.revoke(task_id, terminate=True, signal="SIGTERM")
+    celery_task_id = result.celery_task_id
+    await run_in_threadpool(celery_app.control.revoke, celery_task_id, terminate=True, signal="SIGTERM")
+    await _finish_cancelled(celery_task_id)
     return CancelTaskResponse(
         task_id=task_id,
         status="CANCELLED",
-        message="Cancellation requested",
+        message="Cancellation requested"
+        if celery_task_id == task_id
+        else f"Cancellation requested for batch task {celery_task_id}",
     )
 
 
@@ -228,26 +552,26 @@ async def soft_delete_history_item(
     if settings.api_enable_auth and not auth.is_admin:
         if not auth.key:
             raise HTTPException(status_code=401, detail="Missing API auth key")
-        api_client_id = get_api_client_id_for_key(auth.key)
+        api_client_id = await get_api_client_id_for_key(auth.key)
         if api_client_id is None:
             raise HTTPException(status_code=403, detail="Not allowed to delete this history item")
 
-    deleted = 0
-    with get_db_cursor() as cur:
+    async with get_db_cursor() as cur:
         params: list[object] = [batch_id]
         where_clauses = ["id = %s"]
         if api_client_id is not None:
             where_clauses.append("api_client_id = %s")
             params.append(api_client_id)
 
-        cur.execute(
-            f"DELETE FROM image_generation_batches WHERE {' AND '.join(where_clauses)};",
+        await cur.execute(
+            f"DELETE FROM image_generation_batches WHERE {' AND '.join(where_clauses)} RETURNING api_client_id;",
             params,
         )
-        deleted = cur.rowcount
+        deleted_rows = await cur.fetchall()
 
-    if deleted == 0:
+    if not deleted_rows:
         raise HTTPException(status_code=404, detail="History batch not found")
+    await bump_versions(batch_id, api_client_id=deleted_rows[0][0])
 
     return DeleteTaskResponse(
         task_id=batch_id,
@@ -256,12 +580,53 @@ async def soft_delete_history_item(
     )
 
 
+def _card_image_url(
+    relative_path: str,
+    variants: Optional[dict[str, object]],
+    preview_width: int,
+) -> str:
+    """
+    image_url for a card `preview_width` px wide: the smallest recorded
+    preview variant that fits, else the on-demand resizer for rows written
+    before variants existed, else the full-size preview.
+    """
+
+    if preview_width > 0:
+        if variants is None:
+            width = snap_preview_width(preview_width)
+            if width is not None:
+                return f"{build_image_url(relative_path)}?w={width}"
+        else:
+            variant = pick_preview_variant(variants, preview_width)
+            if variant:
+                return build_embedded_image_url(variant)
+    return build_embedded_image_url(relative_path)
+
+
+def _encode_history_cursor(created_at: datetime, batch_id: object) -> str:
+    raw = json.dumps({"t": created_at.isoformat(), "id": str(batch_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_history_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(data["t"]), UUID(data["id"])
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="Invalid history cursor") from exc
+
+
 @router.get("/history", response_model=list[TaskSummary])
 async def list_history(
+    response: Response,
     limit: int = 20,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    preview_width: Optional[int] = Query(default=None, ge=0),
     auth: AuthContext = Depends(get_auth_context_optional),
-) -> list[TaskSummary]:
+    if_none_match: Optional[str] = Header(default=None),
+) -> Union[list[TaskSummary], Response]:
     """
     Return recent generation batches for the current caller.
 
@@ -271,10 +636,21 @@ async def list_history(
 
     注意：此接口现在按“批次”返回，一行代表一次点击生成；
     `task_id` 字段此时等于 `batch_id`。
+
+    分页：优先使用游标。若还有下一页，响应头 `X-Next-Cursor` 给出游标，
+    下次请求传 `?cursor=...` 即可，翻到多深每页开销都一样；
+    `offset` 仍然可用（未传 cursor 时生效），用于兼容旧客户端。
+
+    条件请求：响应带 ETag（由 worker 维护的 Redis 版本号生成），带匹配的
+    If-None-Match 时直接返回 304，不查询数据库。
+
+    缩略图：`image_url` 指向宽度不小于 `preview_width`（默认
+    API_HISTORY_PREVIEW_WIDTH）的最小预览图；传 0 返回原尺寸预览。
     """
 
     limit = max(1, min(limit, 50))
     offset = max(0, offset)
+    after = _decode_history_cursor(cursor) if cursor else None
 
     api_client_id: Optional[str] = None
     if settings.api_enable_auth:
@@ -283,16 +659,27 @@ async def list_history(
         else:
             if not auth.key:
                 raise HTTPException(status_code=401, detail="Missing API auth key")
-            api_client_id = get_api_client_id_for_key(auth.key)
+            api_client_id = await get_api_client_id_for_key(auth.key)
             if api_client_id is None:
                 return []
     else:
         # 鉴权关闭时，如果有 key 就按 key 过滤，否则返回全局历史。
         if auth.key:
-            api_client_id = get_api_client_id_for_key(auth.key)
+            api_client_id = await get_api_client_id_for_key(auth.key)
+
+    if preview_width is None:
+        preview_width = settings.api_history_preview_width
+
+    etag = await version_etag(
+        history_version_key(api_client_id), "history", api_client_id, limit, offset, cursor, preview_width
+    )
+    if etag is not None:
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
 
     summaries: list[TaskSummary] = []
-    with get_db_cursor() as cur:
+    async with get_db_cursor() as cur:
         params: list[object] = []
         where_clauses: list[str] = []
 
@@ -300,11 +687,18 @@ async def list_history(
             where_clauses.append("b.api_client_id = %s")
             params.append(api_client_id)
 
+        if after is not None:
+            # Keyset: continue strictly after the last row of the previous page.
+            where_clauses.append("(b.created_at, b.id) < (%s, %s)")
+            params.extend(after)
+            offset = 0
+
         where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
 
-        params.extend([limit, offset])
+        # One extra row tells us whether there is a next page.
+        params.extend([limit + 1, offset])
 
-        cur.execute(
+        await cur.execute(
             f"""
             SELECT
                 b.id,
@@ -319,32 +713,26 @@ async def list_history(
                 b.batch_size,
                 b.success_count,
                 b.failed_count,
-                t.relative_path,
-                t.preview_relative_path,
-                t.width,
-                t.height,
-                t.seed
+                b.cover_relative_path,
+                b.cover_preview_relative_path,
+                b.cover_preview_variants,
+                b.cover_width,
+                b.cover_height,
+                b.cover_seed
             FROM image_generation_batches AS b
-            LEFT JOIN LATERAL (
-                SELECT
-                    relative_path,
-                    preview_relative_path,
-                    width,
-                    height,
-                    seed
-                FROM image_generation_tasks
-                WHERE batch_id = b.id AND status = 'success'
-                ORDER BY batch_index
-                LIMIT 1
-            ) AS t ON TRUE
             {where_sql}
-            ORDER BY b.created_at DESC
+            ORDER BY b.created_at DESC, b.id DESC
             LIMIT %s OFFSET %s;
             """,
             params,
         )
 
-        rows = cur.fetchall()
+        rows = await cur.fetchall()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = _encode_history_cursor(last[2], last[0])
 
     for (
         batch_id,
@@ -361,6 +749,7 @@ async def list_history(
         failed_count,
         relative_path,
         preview_relative_path,
+        preview_variants,
         item_width,
         item_height,
         seed,
@@ -369,7 +758,7 @@ async def list_history(
         rel = preview_relative_path or relative_path
         image_url: Optional[str] = None
         if rel:
-            image_url = build_image_url(str(rel))
+            image_url = _card_image_url(str(rel), preview_variants, preview_width)
 
         # Map internal batch status to a coarse UI-oriented status so
         # existing front-end logic (e.g. SUCCESS filter) keeps working.
@@ -406,14 +795,9 @@ async def list_history(
     return summaries
 
 
-@router.get("/history/{batch_id}", response_model=BatchDetail)
-async def get_history_batch_detail(
-    batch_id: str,
-    auth: AuthContext = Depends(get_auth_context_optional),
-) -> BatchDetail:
+async def _batch_scope(auth: AuthContext) -> Optional[str]:
     """
-    Get detailed information for a given generation batch, including all
-    per-image items. Non-admin callers只能访问自己的批次。
+    api_client_id a batch must belong to for this caller (None = any).
     """
 
     api_client_id: Optional[str] = None
@@ -423,15 +807,82 @@ async def get_history_batch_detail(
         else:
             if not auth.key:
                 raise HTTPException(status_code=401, detail="Missing API auth key")
-            api_client_id = get_api_client_id_for_key(auth.key)
+            api_client_id = await get_api_client_id_for_key(auth.key)
             if api_client_id is None:
                 raise HTTPException(status_code=404, detail="Batch not found")
     else:
         if auth.key:
-            api_client_id = get_api_client_id_for_key(auth.key)
+            api_client_id = await get_api_client_id_for_key(auth.key)
+    return api_client_id
 
-    with get_db_cursor() as cur:
-        # Fetch batch metadata + a representative preview image.
+
+def _remember_batch_owner(batch_id: str, api_client_id: Optional[str]) -> None:
+    _batch_owner_cache[batch_id] = api_client_id
+    _batch_owner_cache.move_to_end(batch_id)
+    while len(_batch_owner_cache) > BATCH_OWNER_CACHE_MAX_ITEMS:
+        _batch_owner_cache.popitem(last=False)
+
+
+async def _batch_visible(batch_id: str, api_client_id: Optional[str]) -> bool:
+    """
+    Whether the batch exists for this scope, without the full detail query.
+    """
+
+    if api_client_id is None:
+        # Unscoped: a deleted batch bumps its version, so a matching ETag
+        # already implies the batch still exists.
+        return True
+    if batch_id not in _batch_owner_cache:
+        async with get_db_cursor() as cur:
+            await cur.execute("SELECT api_client_id FROM image_generation_batches WHERE id = %s;", (batch_id,))
+            row = await cur.fetchone()
+        if row is None:
+            return False
+        _remember_batch_owner(batch_id, row[0])
+    return _batch_owner_cache[batch_id] == api_client_id
+
+
+@router.get("/history/{batch_id}", response_model=BatchDetail)
+async def get_history_batch_detail(
+    batch_id: str,
+    response: Response,
+    preview_width: int = Query(default=0, ge=0),
+    auth: AuthContext = Depends(get_auth_context_optional),
+    if_none_match: Optional[str] = Header(default=None),
+) -> Union[BatchDetail, Response]:
+    """
+    Get detailed information for a given generation batch, including all
+    per-image items. Non-admin callers只能访问自己的批次。
+    `?preview_width=` picks card-sized previews as in GET /v1/history.
+
+    The ETag comes from the batch's Redis version key (bumped by the worker
+    on every status / progress change), so a matching If-None-Match is
+    answered with 304 before the batch is queried.
+    """
+
+    api_client_id = await _batch_scope(auth)
+
+    etag = await version_etag(batch_version_key(batch_id), "batch", batch_id, api_client_id, preview_width)
+    if etag is not None and etag_matches(if_none_match, etag) and await _batch_visible(batch_id, api_client_id):
+        return not_modified(etag)
+
+    detail = await _load_batch_detail(batch_id, api_client_id, preview_width=preview_width)
+    if etag is not None:
+        set_etag(response, etag)
+    return detail
+
+
+async def batch_detail_snapshot(batch_id: str, auth: AuthContext) -> BatchDetail:
+    """
+    GET /v1/history/{batch_id} body without conditional handling.
+    """
+
+    return await _load_batch_detail(batch_id, await _batch_scope(auth))
+
+
+async def _load_batch_detail(batch_id: str, api_client_id: Optional[str], *, preview_width: int = 0) -> BatchDetail:
+    async with get_db_cursor() as cur:
+        # Fetch batch metadata + its cover (first successful) image.
         params: list[object] = [batch_id]
         where_clauses = ["b.id = %s"]
         if api_client_id is not None:
@@ -440,7 +891,7 @@ async def get_history_batch_detail(
 
         where_sql = " AND ".join(where_clauses)
 
-        cur.execute(
+        await cur.execute(
             f"""
             SELECT
                 b.id,
@@ -455,32 +906,23 @@ async def get_history_batch_detail(
                 b.batch_size,
                 b.success_count,
                 b.failed_count,
-                t.relative_path,
-                t.preview_relative_path,
-                t.width,
-                t.height,
-                t.seed
+                b.cover_relative_path,
+                b.cover_preview_relative_path,
+                b.cover_preview_variants,
+                b.cover_width,
+                b.cover_height,
+                b.cover_seed
             FROM image_generation_batches AS b
-            LEFT JOIN LATERAL (
-                SELECT
-                    relative_path,
-                    preview_relative_path,
-                    width,
-                    height,
-                    seed
-                FROM image_generation_tasks
-                WHERE batch_id = b.id AND status = 'success'
-                ORDER BY batch_index
-                LIMIT 1
-            ) AS t ON TRUE
             WHERE {where_sql};
             """,
             params,
         )
 
-        batch_row = cur.fetchone()
+        batch_row = await cur.fetchone()
         if not batch_row:
             raise HTTPException(status_code=404, detail="Batch not found")
+        if api_client_id is not None:
+            _remember_batch_owner(batch_id, api_client_id)
 
         (
             _batch_id,
@@ -497,6 +939,7 @@ async def get_history_batch_detail(
             failed_count,
             relative_path,
             preview_relative_path,
+            preview_variants,
             item_width,
             item_height,
             seed,
@@ -506,7 +949,7 @@ async def get_history_batch_detail(
         rel = preview_relative_path or relative_path
         image_url: Optional[str] = None
         if rel:
-            image_url = build_image_url(str(rel))
+            image_url = _card_image_url(str(rel), preview_variants, preview_width)
 
         batch_summary = TaskSummary(
             task_id=str(_batch_id),
@@ -534,7 +977,7 @@ async def get_history_batch_detail(
         )
 
         # Fetch all items in this batch.
-        cur.execute(
+        await cur.execute(
             """
             SELECT
                 task_id,
@@ -542,6 +985,7 @@ async def get_history_batch_detail(
                 status,
                 relative_path,
                 preview_relative_path,
+                preview_variants,
                 width,
                 height,
                 seed,
@@ -554,7 +998,20 @@ async def get_history_batch_detail(
             (batch_id,),
         )
 
-        item_rows = cur.fetchall()
+        item_rows = await cur.fetchall()
+
+    # 对于正在运行的任务，与 POST /v1/tasks/status 相同，一次 MGET 读取实时进度
+    running_ids = [row[0] for row in item_rows if row[2] == "running"]
+    live_progress: dict[str, Optional[int]] = {}
+    if running_ids:
+        try:
+            live_progress = {
+                result.task_id: _build_task_status(result).progress
+                for result in await fetch_task_states(running_ids)
+            }
+        except Exception:
+            # 如果 Redis 查询失败，忽略错误，继续返回 progress=None
+            live_progress = {}
 
     items: list[BatchImageItem] = []
     for (
@@ -563,6 +1020,7 @@ async def get_history_batch_detail(
         status,
         relative_path,
         preview_relative_path,
+        preview_variants,
         width,
         height,
         seed,
@@ -572,20 +1030,9 @@ async def get_history_batch_detail(
         rel_item = preview_relative_path or relative_path
         image_url: Optional[str] = None
         if rel_item:
-            image_url = build_image_url(str(rel_item))
-
-        # 对于正在运行的任务，从 Celery 获取实时进度
-        progress: Optional[int] = None
-        if status == "running":
-            try:
-                celery_result = AsyncResult(task_id, app=celery_app)
-                if celery_result.status == "PROGRESS" and isinstance(
-                    celery_result.info, dict
-                ):
-                    progress = celery_result.info.get("progress")
-            except Exception:
-                # 如果 Celery 查询失败，忽略错误，继续返回 progress=None
-                pass
+            image_url = _card_image_url(str(rel_item), preview_variants, preview_width)
+
+        progress = live_progress.get(task_id)
 
         items.append(
             BatchImageItem(
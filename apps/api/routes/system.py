@@ -1,8 +1,18 @@
 from __future__ import annotations
 
+from typing import Any
+
 from fastapi import APIRouter
 
 from libs.py_core.config import get_settings
+from libs.py_core.db import get_client_cache_stats, get_db_stats
+from libs.py_core.db_async import get_pool_stats
+from libs.py_core.metrics import read_stats
+from libs.py_core.microbatch import read_microbatch_stats
+from libs.py_core.prompt_cache import read_prompt_cache_stats
+from libs.py_core.storage import get_presigned_url_cache_stats, get_s3_read_cache
+
+from apps.api.routes.generated_images import get_resize_cache
 
 
 router = APIRouter(tags=["system"])
@@ -22,3 +32,53 @@ async def health() -> dict[str, str]:
 async def root() -> dict[str, str]:
     return {"message": "Z-Image API is running"}
 
+
+
+@router.get("/metrics/prompt-cache")
+def prompt_cache_metrics() -> dict[str, dict[str, int]]:
+    """
+    Prompt-embedding cache counters (hits / misses / evictions / bytes),
+    keyed by "<hostname>:<pid>" of each worker process.
+    """
+
+    return read_prompt_cache_stats()
+
+
+@router.get("/metrics/microbatch")
+def microbatch_metrics() -> dict[str, dict[str, Any]]:
+    """
+    Batch-size distribution actually achieved by each worker's micro-batcher,
+    keyed by "<hostname>:<pid>".
+    """
+
+    return read_microbatch_stats()
+
+
+@router.get("/metrics/db")
+def db_metrics() -> dict[str, Any]:
+    """
+    Connection-pool usage and per-operation latency: this API process under
+    "api" (plus its API-key cache hit rate), and each worker process keyed
+    by "<hostname>:<pid>".
+    """
+
+    return {
+        "api": {**get_db_stats(), "pool": get_pool_stats(), "client_cache": get_client_cache_stats()},
+        "workers": read_stats("db"),
+    }
+
+
+@router.get("/metrics/storage")
+def storage_metrics() -> dict[str, Any]:
+    """
+    Image-serving counters of this API process: presigned URL cache, the
+    `?w=` resize cache and the S3 read-through cache (hit ratio, bytes
+    served locally instead of from S3; null when disabled).
+    """
+
+    s3_cache = get_s3_read_cache()
+    return {
+        "presigned_urls": get_presigned_url_cache_stats(),
+        "resize_cache": get_resize_cache().stats(),
+        "s3_cache": s3_cache.stats() if s3_cache is not None else None,
+    }
@@ -18,6 +18,17 @@ class GenerateImageRequest(BaseModel):
     max_sequence_length: Optional[int] = Field(default=None, ge=1)
     # 使用宽松的 dict[str, Any]，避免 Pydantic 对递归类型别名的前向引用解析问题。
     metadata: Optional[dict[str, Any]] = None
+    # 完成回调：批次（单张生成即 1 张的批次）全部结束后由 webhook dispatcher
+    # POST 一次汇总结果；省略时使用 api_clients.callback_url（若已登记）。
+    callback_url: Optional[str] = Field(default=None, max_length=2048, pattern=r"^https?://")
+
+
+class GenerateImageBatchRequest(GenerateImageRequest):
+    # 一次点击生成的图片数量；所有图片在 worker 中以单次批量推理完成。
+    num_images: int = Field(default=1, ge=1, le=8)
+    # 显式指定每张图片的 seed（长度需与 num_images 一致）；
+    # 省略时若提供了 seed，则按 seed + index 递增。
+    seeds: Optional[list[Optional[int]]] = None
 
 
 class GenerateImageResponse(BaseModel):
@@ -26,6 +37,19 @@ class GenerateImageResponse(BaseModel):
     status_url: str
     # 任务完成后可填充图片访问地址；初始创建时通常为 null。
     image_url: Optional[str] = None
+    # 仅在请求带 `?wait=` 时填充：等待结束时的任务状态（同 TaskStatusResponse.status）。
+    status: Optional[str] = None
+    error_code: Optional[str] = None
+    error_hint: Optional[str] = None
+
+
+class GenerateImageBatchResponse(BaseModel):
+    # 批量任务对应的 Celery task id（整个批次共用一个）。
+    task_id: str
+    batch_id: str
+    status_url: str
+    # 每张图片在 image_generation_tasks 中的 task_id，按 batch_index 排列。
+    item_task_ids: list[str]
 
 
 class TaskStatusResponse(BaseModel):
@@ -40,6 +64,11 @@ class TaskStatusResponse(BaseModel):
     progress: Optional[int] = None
 
 
+class TaskStatusBatchRequest(BaseModel):
+    # 一次最多查询 100 个任务
+    task_ids: list[str] = Field(..., min_length=1, max_length=100)
+
+
 class TaskSummary(BaseModel):
     task_id: str
     status: str
@@ -83,6 +112,12 @@ class CancelTaskResponse(BaseModel):
     message: Optional[str] = None
 
 
+class StreamTokenResponse(BaseModel):
+    # 用于 SSE 接口的 `?stream_token=`，有效期 expires_in 秒。
+    token: str
+    expires_in: int
+
+
 class DeleteTaskResponse(BaseModel):
     task_id: str
     status: str
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import re
+from dataclasses import dataclass, replace
+from typing import Any, Optional, Sequence
+
+from libs.py_core.celery_app import celery_app
+from libs.py_core.events import progress_key, task_channel
+
+from apps.api.event_hub import get_event_hub
+from apps.api.redis_client import get_redis
+
+
+TERMINAL_STATES = frozenset({"SUCCESS", "FAILURE", "REVOKED"})
+
+# While waiting, re-read the stored state at least this often in case a
+# completion event was missed (pub/sub is fire-and-forget).
+WAIT_RECHECK_SECONDS = 2.0
+# The worker publishes completion right before Celery stores the result;
+# give the result this long to show up after the event.
+WAIT_SETTLE_SECONDS = 1.0
+
+# Items of a batch task are recorded as `<celery task id>-<index>`; they
+# have no Celery result of their own.
+_ITEM_TASK_ID_RE = re.compile(r"^(?P<task_id>[0-9a-f]{32})-(?P<index>\d+)$")
+
+
+def parse_item_task_id(task_id: str) -> Optional[tuple[str, int]]:
+    """
+    (batch task id, index) for a batch item id, None for any other id.
+    """
+
+    match = _ITEM_TASK_ID_RE.match(task_id)
+    if match is None:
+        return None
+    return match["task_id"], int(match["index"])
+
+
+def celery_task_id_for(task_id: str) -> str:
+    item = parse_item_task_id(task_id)
+    return item[0] if item is not None else task_id
+
+
+@dataclass
+class TaskState:
+    """
+    Read-only view of a Celery task's stored state, mirroring the parts of
+    `AsyncResult` used by the API (status / result / info).
+
+    `AsyncResult` lookups are synchronous Redis calls; this reads the same
+    result-backend key through the asyncio Redis client instead.
+    """
+
+    task_id: str
+    status: str = "PENDING"
+    result: Any = None
+    # Digest of the raw Redis values this state was decoded from; equal
+    # versions mean identical responses (used as the ETag).
+    version: str = ""
+    # For a batch item id: the batch task whose result this was read from
+    # (ownership and cancellation go through it).
+    source_task_id: Optional[str] = None
+
+    @property
+    def celery_task_id(self) -> str:
+        return self.source_task_id or self.task_id
+
+    @property
+    def info(self) -> Any:
+        return self.result
+
+    def successful(self) -> bool:
+        return self.status == "SUCCESS"
+
+    def failed(self) -> bool:
+        return self.status == "FAILURE"
+
+
+def _parse_progress(raw: bytes | None) -> int | None:
+    try:
+        return int(raw) if raw is not None else None
+    except ValueError:
+        return None
+
+
+def _raw_version(raw: bytes | None, raw_progress: bytes | None) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(b"-" if raw is None else b"+" + raw)
+    digest.update(b"\x00")
+    digest.update(b"-" if raw_progress is None else b"+" + raw_progress)
+    return digest.hexdigest()
+
+
+def _decode(task_id: str, raw: bytes | None, raw_progress: bytes | None) -> TaskState:
+    version = _raw_version(raw, raw_progress)
+    state = TaskState(task_id=task_id, version=version)
+    if raw is not None:
+        # meta_from_decoded() rebuilds exceptions for FAILURE/REVOKED, exactly
+        # as AsyncResult would.
+        meta = celery_app.backend.meta_from_decoded(celery_app.backend.decode_result(raw))
+        state = TaskState(
+            task_id=task_id,
+            status=meta.get("status") or "PENDING",
+            result=meta.get("result"),
+            version=version,
+        )
+
+    # Workers report progress through the `zimage:progress:<id>` key rather
+    # than Celery's PROGRESS state; present it the same way to callers.
+    progress = _parse_progress(raw_progress)
+    if progress is not None and state.status in ("PENDING", "STARTED", "PROGRESS"):
+        state = TaskState(task_id=task_id, status="PROGRESS", result={"progress": progress}, version=version)
+    return state
+
+
+def _item_state(batch_state: TaskState, item_task_id: str, index: int) -> TaskState:
+    """
+    State of one item, derived from its batch task. Once the batch has a
+    result, the item's own entry decides: its GenerationResult, or FAILURE
+    with its error (a partial batch still succeeds). Otherwise the batch
+    state (the batch fails as a whole only when every item failed).
+    """
+
+    state = replace(batch_state, task_id=item_task_id, source_task_id=batch_state.task_id)
+    if batch_state.successful() and isinstance(batch_state.result, dict):
+        items = batch_state.result.get("items")
+        if isinstance(items, list) and index < len(items):
+            entry = items[index]
+            if isinstance(entry, dict) and "error" in entry:
+                state = replace(state, status="FAILURE", result=entry["error"])
+            else:
+                state = replace(state, result=entry)
+    return state
+
+
+def _decode_for(task_id: str, raw: bytes | None, raw_progress: bytes | None) -> TaskState:
+    item = parse_item_task_id(task_id)
+    if item is None:
+        return _decode(task_id, raw, raw_progress)
+    # `raw` is the batch task's result, `raw_progress` the item's own key.
+    return _item_state(_decode(item[0], raw, raw_progress), task_id, item[1])
+
+
+async def fetch_task_state(task_id: str) -> TaskState:
+    raw, raw_progress = await get_redis().mget(
+        [celery_app.backend.get_key_for_task(celery_task_id_for(task_id)), progress_key(task_id)]
+    )
+    return _decode_for(task_id, raw, raw_progress)
+
+
+async def fetch_task_states(task_ids: Sequence[str]) -> list[TaskState]:
+    """
+    Fetch several task states (result meta + progress) with a single MGET.
+    """
+
+    if not task_ids:
+        return []
+    keys = [celery_app.backend.get_key_for_task(celery_task_id_for(task_id)) for task_id in task_ids]
+    keys += [progress_key(task_id) for task_id in task_ids]
+    raws = await get_redis().mget(keys)
+    count = len(task_ids)
+    return [_decode_for(task_id, raws[i], raws[count + i]) for i, task_id in enumerate(task_ids)]
+
+
+async def wait_for_task_state(task_id: str, timeout: float) -> TaskState:
+    """
+    Return the task's state once it is terminal, or when `timeout` seconds
+    have passed. Woken by the worker's completion event on the task channel
+    (libs/py_core/events.py), so waiting costs no Redis polling.
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    async with get_event_hub().subscribe(task_channel(task_id)) as queue:
+        state = await fetch_task_state(task_id)
+        while state.status not in TERMINAL_STATES:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=min(remaining, WAIT_RECHECK_SECONDS))
+            except asyncio.TimeoutError:
+                state = await fetch_task_state(task_id)
+                continue
+
+            if event.get("type") != "status" or event.get("status") not in ("success", "error", "cancelled"):
+                continue
+
+            settle_until = min(deadline, loop.time() + WAIT_SETTLE_SECONDS)
+            state = await fetch_task_state(task_id)
+            while state.status not in TERMINAL_STATES and loop.time() < settle_until:
+                await asyncio.sleep(0.05)
+                state = await fetch_task_state(task_id)
+
+    return state
+
@@ -1,9 +1,17 @@
 import {
   BatchDetail,
+  BatchDoneEvent,
+  BatchEventHandlers,
+  BatchItemDetail,
+  BatchProgressEvent,
   BatchSummary,
   CancelTaskResponse,
+  GenerateImageBatchRequest,
+  GenerateImageBatchResponse,
   GenerateImageRequest,
   GenerateImageResponse,
+  HistoryPage,
+  StreamTokenResponse,
   TaskStatusResponse,
 } from "./types";
 
@@ -43,6 +51,26 @@ export const generateImage = async (
   return response.json() as Promise<GenerateImageResponse>;
 };
 
+/**
+ * 批量生成：整个批次由 worker 以一次批量推理完成
+ */
+export const generateImageBatch = async (
+  request: GenerateImageBatchRequest,
+  authKey?: string,
+): Promise<GenerateImageBatchResponse> => {
+  const response = await fetch("/v1/images/generate-batch", {
+    method: "POST",
+    headers: buildHeaders(authKey),
+    body: JSON.stringify(request),
+  });
+
+  if (!response.ok) {
+    throw new Error(`Error generating image batch: ${response.statusText}`);
+  }
+
+  return response.json() as Promise<GenerateImageBatchResponse>;
+};
+
 export const getTaskStatus = async (taskId: string, authKey?: string): Promise<TaskStatusResponse> => {
   const response = await fetch(`/v1/tasks/${taskId}`, {
     headers: buildHeaders(authKey),
@@ -79,12 +107,20 @@ export const getDownloadUrl = (imageUrl: string): string => {
 };
 
 /**
- * 获取历史批次列表
+ * 获取历史批次列表（游标分页）
+ *
+ * 传入上一页返回的 nextCursor 获取下一页；nextCursor 为 null 表示已到末页。
  */
-export const getHistory = async (authKey?: string, limit = 20, offset = 0): Promise<BatchSummary[]> => {
+export const getHistory = async (
+  authKey?: string,
+  limit = 20,
+  cursor?: string | null
+): Promise<HistoryPage> => {
   const params = new URLSearchParams();
   params.set("limit", String(limit));
-  params.set("offset", String(Math.max(offset, 0)));
+  if (cursor) {
+    params.set("cursor", cursor);
+  }
 
   const response = await fetch(`/v1/history?${params.toString()}`, {
     headers: buildHeaders(authKey),
@@ -94,7 +130,8 @@ export const getHistory = async (authKey?: string, limit = 20, offset = 0): Prom
     throw new ApiError(`Error fetching history: ${response.statusText}`, response.status);
   }
 
-  return response.json() as Promise<BatchSummary[]>;
+  const items = (await response.json()) as BatchSummary[];
+  return { items, nextCursor: response.headers.get("X-Next-Cursor") };
 };
 
 /**
@@ -112,6 +149,69 @@ export const getBatchDetail = async (batchId: string, authKey?: string): Promise
   return response.json() as Promise<BatchDetail>;
 };
 
+export const createStreamToken = async (authKey?: string): Promise<StreamTokenResponse> => {
+  const response = await fetch("/v1/events/token", {
+    method: "POST",
+    headers: buildHeaders(authKey),
+  });
+
+  if (!response.ok) {
+    throw new ApiError(`Error creating stream token: ${response.statusText}`, response.status);
+  }
+
+  return response.json() as Promise<StreamTokenResponse>;
+};
+
+const attachBatchEventHandlers = (source: EventSource, handlers: BatchEventHandlers): void => {
+  const parse = <T,>(event: MessageEvent) => JSON.parse(event.data as string) as T;
+
+  source.addEventListener("snapshot", (event) => handlers.onSnapshot(parse<BatchDetail>(event as MessageEvent)));
+  source.addEventListener("progress", (event) =>
+    handlers.onProgress(parse<BatchProgressEvent>(event as MessageEvent))
+  );
+  source.addEventListener("item", (event) => handlers.onItem(parse<BatchItemDetail>(event as MessageEvent)));
+  source.addEventListener("done", (event) => {
+    // 服务端发送 done 后会断开；先关闭，避免 EventSource 自动重连。
+    source.close();
+    handlers.onDone(parse<BatchDoneEvent>(event as MessageEvent));
+  });
+  source.onerror = () => {
+    source.close();
+    handlers.onError();
+  };
+};
+
+/**
+ * 订阅批次进度（Server-Sent Events），替代对 getBatchDetail 的轮询。
+ * EventSource 不能带自定义 header：先用 key 换取短期 stream token，
+ * 再通过 query 传递 token（key 本身不会出现在 URL / 访问日志中）。
+ * 返回关闭函数；收到 done 后会自动关闭。
+ */
+export const subscribeBatchEvents = (
+  batchId: string,
+  authKey: string | undefined,
+  handlers: BatchEventHandlers
+): (() => void) => {
+  let source: EventSource | null = null;
+  let closed = false;
+
+  createStreamToken(authKey)
+    .then(({ token }) => {
+      if (closed) return;
+      const params = new URLSearchParams({ stream_token: token });
+      source = new EventSource(`/v1/history/${batchId}/events?${params.toString()}`);
+      attachBatchEventHandlers(source, handlers);
+    })
+    .catch(() => {
+      if (!closed) handlers.onError();
+    });
+
+  return () => {
+    closed = true;
+    source?.close();
+  };
+};
+
 export const cancelTask = async (taskId: string, authKey?: string): Promise<CancelTaskResponse> => {
   const response = await fetch(`/v1/tasks/${taskId}/cancel`, {
     method: "POST",
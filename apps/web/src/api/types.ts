@@ -12,6 +12,18 @@ export interface GenerateImageRequest {
   metadata?: Record<string, unknown>;
 }
 
+export interface GenerateImageBatchRequest extends GenerateImageRequest {
+  num_images: number;
+  seeds?: (number | null)[];
+}
+
+export interface GenerateImageBatchResponse {
+  task_id: string;
+  batch_id: string;
+  status_url: string;
+  item_task_ids: string[];
+}
+
 export interface GenerateImageResponse {
   task_id: string;
   status_url: string;
@@ -71,6 +83,14 @@ export interface BatchSummary {
   base_seed?: number | null;
 }
 
+/**
+ * /v1/history 的一页结果，nextCursor 来自响应头 X-Next-Cursor
+ */
+export interface HistoryPage {
+  items: BatchSummary[];
+  nextCursor: string | null;
+}
+
 /**
  * 批次内单个图片的状态，对应 /v1/history/{batch_id} 返回的 items 数组元素
  */
@@ -95,6 +115,30 @@ export interface BatchDetail {
   items: BatchItemDetail[];
 }
 
+/**
+ * /v1/history/{batch_id}/events 推送的 SSE 事件
+ */
+export interface BatchProgressEvent {
+  task_id: string;
+  index: number | null;
+  progress: number;
+}
+
+export interface BatchDoneEvent {
+  batch_id: string;
+  success_count: number;
+  failed_count: number;
+}
+
+export interface BatchEventHandlers {
+  onSnapshot: (detail: BatchDetail) => void;
+  onProgress: (event: BatchProgressEvent) => void;
+  onItem: (item: BatchItemDetail) => void;
+  onDone: (event: BatchDoneEvent) => void;
+  /** 连接失败或中断（调用方可退回轮询） */
+  onError: () => void;
+}
+
 /** 选中图片时携带的完整信息 */
 export interface ImageSelectionInfo {
   imageUrl: string;
@@ -111,6 +155,12 @@ export interface ImageSelectionInfo {
   seed?: number | null;
 }
 
+/** SSE 鉴权用的短期 token（POST /v1/events/token） */
+export interface StreamTokenResponse {
+  token: string;
+  expires_in: number;
+}
+
 export interface CancelTaskResponse {
   task_id: string;
   status: string;
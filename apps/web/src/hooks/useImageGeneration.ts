@@ -1,5 +1,5 @@
 import { useCallback, useEffect, useRef } from "react";
-import { cancelTask, generateImage, getBatchDetail, getImageUrl } from "../api/client";
+import { cancelTask, generateImageBatch, getBatchDetail, getImageUrl, subscribeBatchEvents } from "../api/client";
 import type { BatchItem, BatchItemDetail, ImageSelectionInfo } from "../api/types";
 import { useI18n } from "../i18n";
 import { useGenerationStore, type GenerationSettings, type BatchMeta } from "../store/generationStore";
@@ -14,6 +14,10 @@ export interface UseImageGenerationOptions {
 
 const DEFAULT_MAX_ACTIVE_TASKS = 8;
 
+/** 批量任务中每张图片的 task_id 为 `<批量任务 id>-<index>`，取消时需作用于批量任务本身 */
+const ITEM_TASK_ID_RE = /^([0-9a-f]{32})-\d+$/;
+const toCeleryTaskId = (taskId: string): string => ITEM_TASK_ID_RE.exec(taskId)?.[1] ?? taskId;
+
 /** 将后端 BatchItemDetail 转换为前端 BatchItem */
 const toBatchItem = (item: BatchItemDetail): BatchItem => ({
   taskId: item.task_id,
@@ -60,7 +64,9 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
   } = useGenerationStore();
 
   const batchPollTimer = useRef<number | null>(null);
+  const batchEventsClose = useRef<(() => void) | null>(null);
   const currentBatchIdRef = useRef<string | null>(null);
+  const batchTaskIdRef = useRef<string | null>(null);
   const generationStartTimeRef = useRef<number>(0);
 
   const clearBatchPoll = useCallback(() => {
@@ -68,6 +74,10 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
       clearInterval(batchPollTimer.current);
       batchPollTimer.current = null;
     }
+    if (batchEventsClose.current) {
+      batchEventsClose.current();
+      batchEventsClose.current = null;
+    }
   }, []);
 
   const setSingleImageState = useCallback(
@@ -98,6 +108,7 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
 
       const effectiveBatchId = batchId ?? `preview-${Date.now()}`;
       currentBatchIdRef.current = effectiveBatchId;
+      batchTaskIdRef.current = null;
 
       setImageUrl(imageUrl);
       setStatus("success");
@@ -130,7 +141,56 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
     [clearBatchPoll, setCurrentBatchItems, setCurrentBatchMeta, setError, setImageUrl, setIsCancellingBatch, setLastSize, setStatus]
   );
 
-  /** 开始轮询批次状态 */
+  /** 根据最新的批次项目更新界面；全部完成时停止跟踪 */
+  const applyBatchItems = useCallback(
+    (items: BatchItem[], batchSize: number) => {
+      // 更新批次项目
+      setCurrentBatchItems(items);
+
+      // 找到第一张成功的图片作为主预览
+      const firstSuccess = items.find((item) => item.status === "success" && item.imageUrl);
+      if (firstSuccess?.imageUrl) {
+        setImageUrl(firstSuccess.imageUrl);
+        if (firstSuccess.width && firstSuccess.height) {
+          setLastSize({ width: firstSuccess.width, height: firstSuccess.height });
+        }
+      }
+
+      // 计算完成状态
+      const successCount = items.filter((item) => item.status === "success").length;
+      const failedCount = items.filter(
+        (item) => item.status === "error" || item.status === "cancelled"
+      ).length;
+      const finishedCount = successCount + failedCount;
+
+      // 如果所有任务都完成了
+      if (finishedCount >= batchSize) {
+        clearBatchPoll();
+        const endTime = performance.now();
+        setGenerationTime((endTime - generationStartTimeRef.current) / 1000);
+
+        if (successCount > 0) {
+          setStatus("success");
+        } else {
+          setStatus("error");
+          const firstError = items.find((item) => item.status === "error");
+          if (firstError?.errorHint) {
+            setError(firstError.errorHint);
+          }
+        }
+
+        if (onHistoryUpdated) {
+          onHistoryUpdated();
+        }
+      } else {
+        // 还有任务在进行中
+        setStatus("generating");
+      }
+    },
+    [clearBatchPoll, onHistoryUpdated, setCurrentBatchItems, setError, setGenerationTime, setImageUrl, setLastSize, setStatus]
+  );
+
+  /** 开始轮询批次状态（不支持 SSE 或 SSE 连接失败时使用） */
   const startBatchPolling = useCallback(
     (batchId: string, batchSize: number) => {
       clearBatchPoll();
@@ -143,50 +203,7 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
 
         try {
           const detail = await getBatchDetail(batchId, authKey || "admin");
-          const items = detail.items.map(toBatchItem).sort((a, b) => a.index - b.index);
-
-          // 更新批次项目
-          setCurrentBatchItems(items);
-
-          // 找到第一张成功的图片作为主预览
-          const firstSuccess = items.find((item) => item.status === "success" && item.imageUrl);
-          if (firstSuccess?.imageUrl) {
-            setImageUrl(firstSuccess.imageUrl);
-            if (firstSuccess.width && firstSuccess.height) {
-              setLastSize({ width: firstSuccess.width, height: firstSuccess.height });
-            }
-          }
-
-          // 计算完成状态
-          const successCount = items.filter((item) => item.status === "success").length;
-          const failedCount = items.filter(
-            (item) => item.status === "error" || item.status === "cancelled"
-          ).length;
-          const finishedCount = successCount + failedCount;
-
-          // 如果所有任务都完成了
-          if (finishedCount >= batchSize) {
-            clearBatchPoll();
-            const endTime = performance.now();
-            setGenerationTime((endTime - generationStartTimeRef.current) / 1000);
-
-            if (successCount > 0) {
-              setStatus("success");
-            } else {
-              setStatus("error");
-              const firstError = items.find((item) => item.status === "error");
-              if (firstError?.errorHint) {
-                setError(firstError.errorHint);
-              }
-            }
-
-            if (onHistoryUpdated) {
-              onHistoryUpdated();
-            }
-          } else {
-            // 还有任务在进行中
-            setStatus("generating");
-          }
+          applyBatchItems(detail.items.map(toBatchItem).sort((a, b) => a.index - b.index), batchSize);
         } catch (err) {
           console.error("Batch polling error:", err);
           // 不要因为单次轮询失败就停止，继续重试
@@ -197,7 +214,58 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
       void poll();
       batchPollTimer.current = window.setInterval(poll, 800);
     },
-    [authKey, clearBatchPoll, onHistoryUpdated, setCurrentBatchItems, setError, setGenerationTime, setImageUrl, setLastSize, setStatus]
+    [applyBatchItems, authKey, clearBatchPoll]
+  );
+
+  /** 开始跟踪批次状态：优先订阅服务端推送（SSE），失败时退回轮询 */
+  const startBatchTracking = useCallback(
+    (batchId: string, batchSize: number) => {
+      clearBatchPoll();
+
+      if (typeof EventSource === "undefined") {
+        startBatchPolling(batchId, batchSize);
+        return;
+      }
+
+      let items: BatchItem[] = [];
+      const isCurrent = () => currentBatchIdRef.current === batchId;
+      const upsert = (next: BatchItem) => {
+        const rest = items.filter((item) => item.taskId !== next.taskId);
+        items = [...rest, next].sort((a, b) => a.index - b.index);
+      };
+
+      batchEventsClose.current = subscribeBatchEvents(batchId, authKey || "admin", {
+        onSnapshot: (detail) => {
+          if (!isCurrent()) return;
+          items = detail.items.map(toBatchItem).sort((a, b) => a.index - b.index);
+          applyBatchItems(items, batchSize);
+        },
+        onProgress: (event) => {
+          if (!isCurrent()) return;
+          const current = items.find((item) => item.taskId === event.task_id);
+          if (current) {
+            upsert({ ...current, progress: event.progress });
+            setCurrentBatchItems(items);
+          }
+        },
+        onItem: (item) => {
+          if (!isCurrent()) return;
+          const current = items.find((existing) => existing.taskId === item.task_id);
+          upsert({ ...toBatchItem(item), progress: item.status === "running" ? current?.progress : undefined });
+          applyBatchItems(items, batchSize);
+        },
+        onDone: () => {
+          batchEventsClose.current = null;
+        },
+        onError: () => {
+          batchEventsClose.current = null;
+          if (isCurrent()) {
+            startBatchPolling(batchId, batchSize);
+          }
+        },
+      });
+    },
+    [applyBatchItems, authKey, clearBatchPoll, setCurrentBatchItems, startBatchPolling]
   );
 
   const handleGenerate = useCallback(async () => {
@@ -236,36 +304,33 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
 
     // 初始化状态
     currentBatchIdRef.current = batchId;
+    batchTaskIdRef.current = null;
     generationStartTimeRef.current = performance.now();
     initBatch(batchId, batchSize, settings.width, settings.height);
 
     try {
-      // 串行发送所有生成请求，确保按顺序入队
-      for (let index = 0; index < batchSize; index++) {
-        const seed =
-          settings.seed === null || settings.seed === undefined ? null : settings.seed + index;
-
-        await generateImage(
-          {
-            prompt,
-            height: settings.height,
-            width: settings.width,
-            num_inference_steps: settings.steps,
-            guidance_scale: settings.guidance,
-            seed,
-            metadata: {
-              batch_id: batchId,
-              batch_index: index,
-              batch_size: batchSize,
-            },
+      // 整个批次作为一个任务入队，由 worker 以单次批量推理完成
+      const response = await generateImageBatch(
+        {
+          prompt,
+          height: settings.height,
+          width: settings.width,
+          num_inference_steps: settings.steps,
+          guidance_scale: settings.guidance,
+          seed: settings.seed ?? null,
+          num_images: batchSize,
+          metadata: {
+            batch_id: batchId,
+            batch_size: batchSize,
           },
-          authKey || "admin"
-        );
-      }
+        },
+        authKey || "admin"
+      );
+      batchTaskIdRef.current = response.task_id;
 
-      // 所有请求发送完毕后，开始轮询批次状态
+      // 所有请求发送完毕后，开始跟踪批次状态
       setStatus("generating");
-      startBatchPolling(batchId, batchSize);
+      startBatchTracking(batchId, batchSize);
     } catch (err: unknown) {
       const fallbackMessage = t("errors.failedToStart");
       const message = err instanceof Error && err.message ? err.message : fallbackMessage;
@@ -284,7 +349,7 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
     setIsSubmitting,
     setStatus,
     settings,
-    startBatchPolling,
+    startBatchTracking,
     t,
   ]);
 
@@ -302,9 +367,20 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
 
     setIsCancellingBatch(true);
     try {
+      // 批量任务的所有图片共用一个 Celery 任务，取消一次即可；
+      // 从历史记录打开的批次没有 batchTaskIdRef，由图片的 task_id 推出批量任务 id
+      const taskIds = batchTaskIdRef.current
+        ? [batchTaskIdRef.current]
+        : Array.from(
+            new Set(
+              cancellableTasks
+                .filter((item) => !item.taskId.startsWith("history-"))
+                .map((item) => toCeleryTaskId(item.taskId))
+            )
+          );
       await Promise.all(
-        cancellableTasks.map((item) =>
-          cancelTask(item.taskId, authKey || "admin").catch((err) => {
+        taskIds.map((taskId) =>
+          cancelTask(taskId, authKey || "admin").catch((err) => {
             console.error("Failed to cancel task", err);
           })
         )
@@ -373,6 +449,7 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
         // 准备状态
         clearBatchPoll();
         currentBatchIdRef.current = info.batchId;
+        batchTaskIdRef.current = null;
 
         setCurrentBatchMeta({ id: info.batchId, size: batchSize });
         setCurrentBatchItems(
@@ -391,8 +468,8 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
           setLastSize({ width: info.width, height: info.height });
         }
 
-        // 启动一次批次轮询，从后端加载该 batch 的所有图片
-        startBatchPolling(info.batchId, batchSize);
+        // 从后端加载该 batch 的所有图片（仍在生成中则继续跟踪进度）
+        startBatchTracking(info.batchId, batchSize);
       }
 
       // 更新提示词
@@ -428,7 +505,7 @@ export function useImageGeneration(options: UseImageGenerationOptions) {
       setPrompt,
       setStatus,
       setSingleImageState,
-      startBatchPolling,
+      startBatchTracking,
       updateSettings,
     ]
   );
@@ -11,7 +11,7 @@ interface HistoryState {
   error: HistoryError;
   hasMore: boolean;
   isDeletingMany: boolean;
-  offset: number;
+  cursor: string | null;
 
   // Actions
   setItems: (items: BatchSummary[] | ((prev: BatchSummary[]) => BatchSummary[])) => void;
@@ -19,8 +19,7 @@ interface HistoryState {
   setError: (error: HistoryError) => void;
   setHasMore: (hasMore: boolean) => void;
   setIsDeletingMany: (isDeletingMany: boolean) => void;
-  resetOffset: () => void;
-  incrementOffset: (count: number) => void;
+  resetCursor: () => void;
 
   // Async Actions
   fetchHistory: (authKey: string, reset?: boolean, clearBeforeFetch?: boolean) => Promise<void>;
@@ -36,7 +35,7 @@ export const useHistoryStore = create<HistoryState>((set, get) => ({
   error: null,
   hasMore: true,
   isDeletingMany: false,
-  offset: 0,
+  cursor: null,
 
   // Simple Setters
   setItems: (itemsOrUpdater) =>
@@ -47,15 +46,14 @@ export const useHistoryStore = create<HistoryState>((set, get) => ({
   setError: (error) => set({ error }),
   setHasMore: (hasMore) => set({ hasMore }),
   setIsDeletingMany: (isDeletingMany) => set({ isDeletingMany }),
-  resetOffset: () => set({ offset: 0 }),
-  incrementOffset: (count) => set((state) => ({ offset: state.offset + count })),
+  resetCursor: () => set({ cursor: null }),
 
   // Async Actions
   fetchHistory: async (authKey, reset = false, clearBeforeFetch = false) => {
     const state = get();
     
     if (reset) {
-      set({ offset: 0, hasMore: true });
+      set({ cursor: null, hasMore: true });
       if (clearBeforeFetch) {
         set({ items: [] });
       }
@@ -64,13 +62,13 @@ export const useHistoryStore = create<HistoryState>((set, get) => ({
     set({ error: null, isLoading: true });
 
     try {
-      const offset = reset ? 0 : state.offset;
-      const fetched = await getHistory(authKey || "admin", HISTORY_PAGE_SIZE, offset);
+      const cursor = reset ? null : state.cursor;
+      const page = await getHistory(authKey || "admin", HISTORY_PAGE_SIZE, cursor);
 
       set((s) => ({
-        items: reset ? fetched : [...s.items, ...fetched],
-        offset: offset + fetched.length,
-        hasMore: fetched.length === HISTORY_PAGE_SIZE,
+        items: reset ? page.items : [...s.items, ...page.items],
+        cursor: page.nextCursor,
+        hasMore: page.nextCursor !== null,
         isLoading: false,
       }));
     } catch (err) {
@@ -78,7 +76,7 @@ export const useHistoryStore = create<HistoryState>((set, get) => ({
         set({
           error: "unauthorized",
           items: [],
-          offset: 0,
+          cursor: null,
           hasMore: false,
           isLoading: false,
         });
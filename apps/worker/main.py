@@ -14,10 +14,20 @@ if env_file.exists():
     load_dotenv(env_file, override=False)
 
 from libs.py_core.celery_app import celery_app
+from libs.py_core.config import get_settings
 
 
 if __name__ == "__main__":
     # Entry point for running a Celery worker via:
     # uv run python -m apps.worker.main
     # Celery 5.x expects the `worker` sub-command in argv.
-    celery_app.worker_main(argv=["worker", "-l", "info"])
+    argv = ["worker", "-l", "info"]
+
+    # Micro-batching needs several tasks in flight inside one process that
+    # shares the GPU pipeline, so switch to the threads pool sized to the
+    # maximum batch.
+    microbatch_size = get_settings().z_image_microbatch_max_size
+    if microbatch_size > 1:
+        argv += ["-P", "threads", "-c", str(microbatch_size)]
+
+    celery_app.worker_main(argv=argv)
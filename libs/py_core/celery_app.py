@@ -1,7 +1,7 @@
 import os
 
 from celery import Celery
-from celery.signals import worker_process_init
+from celery.signals import worker_process_init, worker_process_shutdown, worker_ready, worker_shutdown
 
 from .config import get_settings
 
@@ -47,3 +47,36 @@ def _warmup_z_image_pipeline(**kwargs):
     except Exception:
         # Warmup is best-effort; avoid crashing the worker process.
         return
+
+
+if settings.z_image_microbatch_max_size > 1:
+    # The threads pool used for micro-batching never forks child processes,
+    # so worker_process_init does not fire; warm up once the worker is ready.
+    worker_ready.connect(_warmup_z_image_pipeline)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _drain_postprocessing(**kwargs):
+    """
+    Finish queued encode / upload jobs before the worker (or its pool child
+    process) exits, so no already-generated image is lost.
+    """
+
+    try:
+        from libs.py_core.postprocess import drain_postprocessing  # type: ignore
+    except Exception:
+        return
+
+    drain_postprocessing()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _close_db_pool(**kwargs):
+    try:
+        from libs.py_core.db import close_pool  # type: ignore
+    except Exception:
+        return
+
+    close_pool()
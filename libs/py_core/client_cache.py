@@ -0,0 +1,110 @@
+"""
+In-process cache of API key resolutions.
+
+Every authenticated request needs the caller's `api_clients` row (id for
+history filters, `is_active` for access). The row is keyed by the SHA-256
+of the raw key and almost never changes, so each process keeps
+key-hash -> ClientInfo for API_CLIENT_CACHE_TTL_SECONDS and only goes to
+Postgres on a miss.
+
+- Inactive clients are cached too ("negative" entries), for the shorter
+  API_CLIENT_CACHE_NEGATIVE_TTL_SECONDS, so a disabled key hammering the
+  API is rejected without a query and re-enabling it takes effect soon.
+- `invalidate_client()` drops every entry of a client id; the API calls
+  it when scripts/set_api_client_active.py announces a change (see
+  `events.publish_client_invalidation`), so the TTL only bounds staleness
+  when that message is lost.
+- Expired entries are kept until evicted and can be served with
+  `allow_stale=True` when the database is unreachable.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class ClientInfo:
+    id: str
+    role: str
+    is_active: bool = True
+
+
+@dataclass
+class ClientCacheStats:
+    hits: int = 0
+    misses: int = 0
+    stale_hits: int = 0
+    invalidations: int = 0
+    entries: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return dict(self.__dict__)
+
+
+@dataclass
+class ClientCache:
+    """
+    Thread-safe LRU of key hash -> (ClientInfo, expires_at).
+    """
+
+    ttl_seconds: float = 60.0
+    negative_ttl_seconds: float = 10.0
+    max_entries: int = 10_000
+    _entries: OrderedDict[str, tuple[ClientInfo, float]] = field(default_factory=OrderedDict)
+    _stats: ClientCacheStats = field(default_factory=ClientCacheStats)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def get(self, key_hash: str, *, allow_stale: bool = False) -> Optional[ClientInfo]:
+        with self._lock:
+            entry = self._entries.get(key_hash)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            info, expires_at = entry
+            if expires_at <= time.monotonic():
+                if allow_stale:
+                    self._stats.stale_hits += 1
+                    return info
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key_hash)
+            self._stats.hits += 1
+            return info
+
+    def put(self, key_hash: str, info: ClientInfo) -> None:
+        ttl = self.ttl_seconds if info.is_active else self.negative_ttl_seconds
+        with self._lock:
+            self._entries[key_hash] = (info, time.monotonic() + ttl)
+            self._entries.move_to_end(key_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_client(self, client_id: Optional[str] = None) -> int:
+        """
+        Drop the entries of `client_id` (all entries when None).
+        """
+
+        with self._lock:
+            if client_id is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [key for key, (info, _) in self._entries.items() if info.id == client_id]
+                for key in stale:
+                    del self._entries[key]
+                dropped = len(stale)
+            self._stats.invalidations += 1
+            return dropped
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            self._stats.entries = len(self._entries)
+            return self._stats.as_dict()
+
+
+__all__ = ["ClientCache", "ClientCacheStats", "ClientInfo"]
@@ -5,19 +5,29 @@ Lightweight PostgreSQL helpers for recording image generation metadata.
 
 This module is intentionally minimal and synchronous. It is primarily used
 from the Celery worker processes, where blocking I/O is acceptable.
+
+Connections come from a per-process `psycopg_pool.ConnectionPool` (sized
+via DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE / DB_POOL_TIMEOUT), and the status
+writers send all statements of one update in a single pipelined round
+trip. Pool usage and per-operation latency are exposed by `get_db_stats()`.
 """
 
 from contextlib import contextmanager
 import hashlib
 import json
-from typing import Iterator, Optional
+import os
+import threading
+import time
+from typing import Any, Iterator, Optional, Sequence
 from uuid import UUID, uuid4
 
 import psycopg
 from psycopg import sql
-from psycopg.errors import UndefinedTable
+from psycopg.errors import UndefinedColumn, UndefinedTable
 
+from .client_cache import ClientCache, ClientInfo
 from .config import get_settings
+from .metrics import publish_stats
 from .types import GenerationResult, JSONDict
 
 
@@ -36,22 +46,98 @@ def _get_psycopg_dsn() -> str:
     return url
 
 
+_pool: Any = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> Any:
+    """
+    Return this process's connection pool, creating it on first use.
+
+    The pool is keyed by pid so that Celery's prefork children never reuse
+    sockets inherited from the parent. Returns None when psycopg_pool is
+    not installed, in which case callers fall back to one connection per call.
+    """
+
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == pid:
+            return _pool
+
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            return None
+
+        settings = get_settings()
+        _pool = ConnectionPool(
+            _get_psycopg_dsn(),
+            min_size=settings.db_pool_min_size,
+            max_size=max(settings.db_pool_max_size, settings.db_pool_min_size, 1),
+            timeout=settings.db_pool_timeout,
+            kwargs={"autocommit": True},
+            check=ConnectionPool.check_connection,
+            name=f"z-image-{pid}",
+            open=True,
+        )
+        _pool_pid = pid
+        return _pool
+
+
+def close_pool() -> None:
+    """
+    Close this process's pool (e.g. on worker shutdown).
+    """
+
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        pool, _pool, _pool_pid = _pool, None, None
+    if pool is not None:
+        try:
+            pool.close()
+        except Exception:
+            return
+
+
+@contextmanager
+def _get_connection() -> Iterator[psycopg.Connection]:
+    """
+    Borrow an autocommit connection from the pool (or open a short-lived
+    one when pooling is unavailable).
+    """
+
+    pool = _get_pool()
+    if pool is not None:
+        with pool.connection() as conn:
+            yield conn
+        return
+
+    conn = psycopg.connect(_get_psycopg_dsn(), autocommit=True)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
 @contextmanager
 def _get_cursor() -> Iterator[psycopg.Cursor]:
     """
-    Open a short-lived connection + cursor.
+    Borrow a pooled connection + cursor.
 
     The connection uses autocommit mode to keep the helpers simple and
     resilient for fire-and-forget logging purposes.
     """
 
-    dsn = _get_psycopg_dsn()
-    conn = psycopg.connect(dsn, autocommit=True)
-    try:
+    with _get_connection() as conn:
         with conn.cursor() as cur:
             yield cur
-    finally:
-        conn.close()
 
 
 @contextmanager
@@ -66,6 +152,64 @@ def get_db_cursor() -> Iterator[psycopg.Cursor]:
         yield cur
 
 
+# Per-operation latency counters: name -> {count, errors, total_ms, max_ms}.
+_op_stats: dict[str, dict[str, float]] = {}
+_op_stats_lock = threading.Lock()
+
+
+@contextmanager
+def _timed(name: str, *, publish: bool = True) -> Iterator[None]:
+    """
+    Record the latency of one DB operation. `publish=False` skips the
+    (synchronous) Redis snapshot, for callers running on an event loop.
+    """
+
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with _op_stats_lock:
+            entry = _op_stats.setdefault(name, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["count"] += 1
+            entry["errors"] += int(failed)
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        if publish:
+            publish_stats("db", get_db_stats(), min_interval_seconds=5.0)
+
+
+def get_db_stats() -> dict[str, Any]:
+    """
+    Pool size / waiting statistics plus per-operation latency for this process.
+    """
+
+    with _op_stats_lock:
+        operations = {
+            name: {
+                "count": int(entry["count"]),
+                "errors": int(entry["errors"]),
+                "mean_ms": round(entry["total_ms"] / entry["count"], 3) if entry["count"] else 0.0,
+                "max_ms": round(entry["max_ms"], 3),
+            }
+            for name, entry in sorted(_op_stats.items())
+        }
+
+    pool_stats: dict[str, int] = {}
+    pool = _pool if _pool_pid == os.getpid() else None
+    if pool is not None:
+        try:
+            pool_stats = dict(pool.get_stats())
+        except Exception:
+            pool_stats = {}
+
+    return {"pool": pool_stats, "operations": operations}
+
+
 def _safe_execute(fn) -> None:
     """
     Run a DB helper, swallowing missing-table errors so that the worker
@@ -74,7 +218,7 @@ def _safe_execute(fn) -> None:
 
     try:
         fn()
-    except UndefinedTable:
+    except (UndefinedTable, UndefinedColumn):
         # Migrations not applied yet; skip recording instead of failing.
         return
     except psycopg.OperationalError:
@@ -82,9 +226,57 @@ def _safe_execute(fn) -> None:
         return
 
 
-def _get_or_create_api_client_id(cur: psycopg.Cursor, raw_key: Optional[str]) -> Optional[str]:
+# api_key_hash -> ClientInfo, shared by the sync and async helpers of this
+# process (see libs/py_core/client_cache.py).
+_client_cache = ClientCache(
+    ttl_seconds=get_settings().api_client_cache_ttl_seconds,
+    negative_ttl_seconds=get_settings().api_client_cache_negative_ttl_seconds,
+)
+
+_SELECT_API_CLIENT_SQL = "SELECT id, role, is_active FROM api_clients WHERE api_key_hash = %s"
+_INSERT_API_CLIENT_SQL = """
+    INSERT INTO api_clients (id, display_name, role, api_key_hash)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (id) DO NOTHING
+"""
+_SET_API_CLIENT_ACTIVE_SQL = """
+    UPDATE api_clients
+    SET is_active = %s, updated_at = NOW()
+    WHERE id = %s
+"""
+
+
+def _hash_api_key(raw_key: str) -> str:
+    return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+
+def _new_api_client_row(raw_key: str, key_hash: str) -> tuple[str, str, str, str]:
+    """
+    (id, display_name, role, api_key_hash) for a key seen for the first time.
+    """
+
+    admin_key = get_settings().api_admin_key
+    if admin_key and raw_key == admin_key:
+        return "admin", "Admin", "admin", key_hash
+
+    suffix = key_hash[:8]
+    return f"key_{suffix}", f"API Key {suffix}", "first_party", key_hash
+
+
+def _client_info(row: Sequence[Any]) -> ClientInfo:
+    """
+    ClientInfo from a `_SELECT_API_CLIENT_SQL` row or a `_new_api_client_row`.
     """
-    Resolve a stable api_client_id for the given raw API key.
+
+    if len(row) == 3:
+        return ClientInfo(id=row[0], role=row[1], is_active=bool(row[2]))
+    return ClientInfo(id=row[0], role=row[2])
+
+
+def _get_or_create_api_client(cur: psycopg.Cursor, raw_key: Optional[str]) -> Optional[ClientInfo]:
+    """
+    Resolve the api_clients row for the given raw API key, creating it on
+    first sight.
 
     We never store the raw key in the database, only a SHA-256 hash and a
     derived logical id such as "admin" or "key_<hash8>".
@@ -93,39 +285,25 @@ def _get_or_create_api_client_id(cur: psycopg.Cursor, raw_key: Optional[str]) ->
     if not raw_key:
         return None
 
-    settings = get_settings()
-    admin_key = settings.api_admin_key
+    key_hash = _hash_api_key(raw_key)
+    cached = _client_cache.get(key_hash)
+    if cached is not None:
+        return cached
 
-    key_hash = hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
-
-    cur.execute(
-        "SELECT id FROM api_clients WHERE api_key_hash = %s",
-        (key_hash,),
-    )
+    cur.execute(_SELECT_API_CLIENT_SQL, (key_hash,))
     row = cur.fetchone()
-    if row:
-        return row[0]
+    if not row:
+        row = _new_api_client_row(raw_key, key_hash)
+        cur.execute(_INSERT_API_CLIENT_SQL, row)
 
-    if admin_key and raw_key == admin_key:
-        client_id = "admin"
-        display_name = "Admin"
-        role = "admin"
-    else:
-        suffix = key_hash[:8]
-        client_id = f"key_{suffix}"
-        display_name = f"API Key {suffix}"
-        role = "first_party"
+    info = _client_info(row)
+    _client_cache.put(key_hash, info)
+    return info
 
-    cur.execute(
-        """
-        INSERT INTO api_clients (id, display_name, role, api_key_hash)
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (id) DO NOTHING
-        """,
-        (client_id, display_name, role, key_hash),
-    )
 
-    return client_id
+def _get_or_create_api_client_id(cur: psycopg.Cursor, raw_key: Optional[str]) -> Optional[str]:
+    info = _get_or_create_api_client(cur, raw_key)
+    return info.id if info is not None else None
 
 
 def get_api_client_id_for_key(raw_key: Optional[str]) -> Optional[str]:
@@ -142,6 +320,25 @@ def get_api_client_id_for_key(raw_key: Optional[str]) -> Optional[str]:
         return _get_or_create_api_client_id(cur, raw_key)
 
 
+def set_api_client_active(client_id: str, active: bool) -> bool:
+    """
+    Enable / disable an API client; False when no such client exists.
+
+    Only this process's cache is invalidated; other processes learn about
+    the change via `events.publish_client_invalidation` (or their TTL).
+    """
+
+    with _timed("set_api_client_active"), _get_cursor() as cur:
+        cur.execute(_SET_API_CLIENT_ACTIVE_SQL, (active, client_id))
+        updated = cur.rowcount > 0
+    _client_cache.invalidate_client(client_id)
+    return updated
+
+
+def get_client_cache_stats() -> dict[str, int]:
+    return _client_cache.stats()
+
+
 def _extract_batch_info(
     metadata: Optional[JSONDict],
 ) -> tuple[UUID, int, int]:
@@ -178,6 +375,268 @@ def _extract_batch_info(
     return batch_id, batch_index, batch_size
 
 
+def _derive_base_seed(seed: Optional[int], batch_index: int) -> Optional[int]:
+    """
+    Derive a "base" seed for the batch (the seed of index 0) when possible.
+    """
+
+    if seed is None:
+        return None
+    try:
+        return int(seed) - int(batch_index)
+    except Exception:
+        return int(seed)
+
+
+def _batch_metadata(metadata: Optional[JSONDict]) -> Optional[JSONDict]:
+    if not isinstance(metadata, dict):
+        return None
+    batch_metadata = dict(metadata)
+    # These fields are tracked in dedicated columns.
+    batch_metadata.pop("batch_index", None)
+    batch_metadata.pop("batch_size", None)
+    return batch_metadata
+
+
+_ENQUEUE_SQL = """
+    WITH batch AS (
+        INSERT INTO image_generation_batches (
+            id,
+            api_client_id,
+            caller_label,
+            prompt,
+            negative_prompt,
+            width,
+            height,
+            num_inference_steps,
+            guidance_scale,
+            base_seed,
+            batch_size,
+            status,
+            metadata
+        ) VALUES (
+            %(batch_id)s, %(api_client_id)s, NULL,
+            %(prompt)s, %(negative_prompt)s,
+            %(width)s, %(height)s,
+            %(num_inference_steps)s, %(guidance_scale)s,
+            %(base_seed)s,
+            %(batch_size)s,
+            'pending',
+            %(batch_metadata)s
+        )
+        ON CONFLICT (id) DO NOTHING
+    )
+    INSERT INTO image_generation_tasks (
+        task_id,
+        batch_id,
+        batch_index,
+        seed,
+        status,
+        prompt,
+        negative_prompt,
+        width,
+        height,
+        num_inference_steps,
+        guidance_scale,
+        cfg_normalization,
+        cfg_truncation,
+        max_sequence_length,
+        metadata
+    )
+    SELECT
+        item.task_id,
+        %(batch_id)s,
+        item.batch_index,
+        item.seed,
+        'pending',
+        %(prompt)s, %(negative_prompt)s,
+        %(width)s, %(height)s,
+        %(num_inference_steps)s,
+        %(guidance_scale)s,
+        %(cfg_normalization)s,
+        %(cfg_truncation)s,
+        %(max_sequence_length)s,
+        item.metadata
+    FROM unnest(
+        %(task_ids)s::text[],
+        %(indices)s::integer[],
+        %(seeds)s::bigint[],
+        %(item_metadata)s::jsonb[]
+    ) AS item (task_id, batch_index, seed, metadata)
+    ON CONFLICT (task_id) DO NOTHING;
+"""
+
+# Completion webhook target (migration 004), run after `_ENQUEUE_SQL` with the
+# same parameters through `_execute_optional`.
+_SET_BATCH_CALLBACK_SQL = """
+    UPDATE image_generation_batches
+    SET callback_url = COALESCE(
+        %(callback_url)s,
+        (SELECT callback_url FROM api_clients WHERE id = %(api_client_id)s)
+    )
+    WHERE id = %(batch_id)s AND callback_url IS NULL
+"""
+
+
+def _enqueue_params(
+    task_ids: Sequence[str],
+    *,
+    api_client_id: Optional[str],
+    prompt: str,
+    height: int,
+    width: int,
+    num_inference_steps: int,
+    guidance_scale: float,
+    seeds: Sequence[Optional[int]],
+    negative_prompt: Optional[str],
+    cfg_normalization: Optional[bool],
+    cfg_truncation: Optional[float],
+    max_sequence_length: Optional[int],
+    metadata: Optional[JSONDict],
+    callback_url: Optional[str] = None,
+) -> dict[str, Any]:
+    """
+    Parameters for `_ENQUEUE_SQL` and `_SET_BATCH_CALLBACK_SQL` (shared
+    with the async API helpers).
+    """
+
+    batch_id, first_index, batch_size = _extract_batch_info(metadata)
+    base_metadata: JSONDict = dict(metadata) if isinstance(metadata, dict) else {}
+    batch_metadata = _batch_metadata(metadata)
+    indices = [first_index + offset for offset in range(len(task_ids))]
+
+    return {
+        "batch_id": str(batch_id),
+        "api_client_id": api_client_id,
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "width": width,
+        "height": height,
+        "num_inference_steps": num_inference_steps,
+        "guidance_scale": guidance_scale,
+        "base_seed": _derive_base_seed(seeds[0] if seeds else None, first_index),
+        "batch_size": batch_size,
+        "batch_metadata": json.dumps(batch_metadata) if batch_metadata is not None else None,
+        "callback_url": callback_url,
+        "cfg_normalization": cfg_normalization,
+        "cfg_truncation": cfg_truncation,
+        "max_sequence_length": max_sequence_length,
+        "task_ids": list(task_ids),
+        "indices": indices,
+        "seeds": list(seeds),
+        "item_metadata": [json.dumps({**base_metadata, "batch_index": index}) for index in indices],
+    }
+
+
+def record_generation_enqueued(
+    task_ids: Sequence[str],
+    *,
+    prompt: str,
+    height: int,
+    width: int,
+    num_inference_steps: int,
+    guidance_scale: float,
+    seeds: Sequence[Optional[int]],
+    negative_prompt: Optional[str],
+    cfg_normalization: Optional[bool],
+    cfg_truncation: Optional[float],
+    max_sequence_length: Optional[int],
+    auth_key: Optional[str],
+    metadata: Optional[JSONDict],
+    callback_url: Optional[str] = None,
+) -> None:
+    """
+    Record freshly enqueued tasks (called by the API before publishing).
+
+    Inserts the batch row and one `pending` row per task in a single
+    statement, so queued work shows up in history right away and workers
+    only need to flip the task status when they pick it up. `metadata`
+    carries batch_id / batch_size / batch_index (index of the first task).
+    `callback_url` (or else the client's registered one) is stored on the
+    batch for the completion webhook.
+    """
+
+    if not task_ids:
+        return
+
+    def _impl() -> None:
+        with _timed("record_generation_enqueued"), _get_cursor() as cur, cur.connection.transaction():
+            params = _enqueue_params(
+                task_ids,
+                api_client_id=_get_or_create_api_client_id(cur, auth_key),
+                prompt=prompt,
+                height=height,
+                width=width,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                seeds=seeds,
+                negative_prompt=negative_prompt,
+                cfg_normalization=cfg_normalization,
+                cfg_truncation=cfg_truncation,
+                max_sequence_length=max_sequence_length,
+                metadata=metadata,
+                callback_url=callback_url,
+            )
+            cur.execute(_ENQUEUE_SQL, params)
+            if params["callback_url"] is not None or params["api_client_id"] is not None:
+                _execute_optional(cur, _SET_BATCH_CALLBACK_SQL, params)
+
+    _safe_execute(_impl)
+
+
+def _mark_tasks_running(cur: psycopg.Cursor, task_ids: Sequence[str]) -> set[str]:
+    """
+    Flip `pending` task rows (and their batch) to `running`.
+
+    Returns the ids that already had a row, i.e. that were recorded at
+    enqueue time; rows in any other state are left untouched.
+    """
+
+    cur.execute(
+        """
+        WITH existing AS (
+            SELECT task_id, batch_id, status
+            FROM image_generation_tasks
+            WHERE task_id = ANY(%s)
+            FOR UPDATE
+        ),
+        started AS (
+            UPDATE image_generation_tasks AS t
+            SET status = 'running'
+            FROM existing
+            WHERE t.task_id = existing.task_id AND existing.status = 'pending'
+            RETURNING t.batch_id
+        ),
+        batches AS (
+            UPDATE image_generation_batches AS b
+            SET status = 'running'
+            WHERE b.id IN (SELECT batch_id FROM started) AND b.status = 'pending'
+        )
+        SELECT task_id FROM existing;
+        """,
+        (list(task_ids),),
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def mark_generations_running(task_ids: Sequence[str]) -> set[str]:
+    """
+    Bulk variant of the enqueue-time fast path in `record_generation_started`,
+    for workers that start several tasks at once. Returns the ids that were
+    found; callers should fall back to `record_generation_started` for the rest.
+    """
+
+    found: set[str] = set()
+
+    def _impl() -> None:
+        with _timed("mark_generations_running"), _get_cursor() as cur:
+            found.update(_mark_tasks_running(cur, task_ids))
+
+    if task_ids:
+        _safe_execute(_impl)
+    return found
+
+
 def record_generation_started(
     task_id: str,
     *,
@@ -196,191 +655,380 @@ def record_generation_started(
 ) -> None:
     """
     Record that a generation task has started (worker picked it up).
+
+    Tasks recorded by the API at enqueue time only get their status
+    flipped; older / directly-enqueued tasks fall back to a full upsert.
     """
 
     def _impl() -> None:
-        with _get_cursor() as cur:
+        with _timed("record_generation_started"), _get_cursor() as cur:
+            if task_id in _mark_tasks_running(cur, [task_id]):
+                return
+
             api_client_id = _get_or_create_api_client_id(cur, auth_key)
             batch_id, batch_index, batch_size = _extract_batch_info(metadata)
+            base_seed = _derive_base_seed(seed, batch_index)
+            batch_metadata = _batch_metadata(metadata)
 
-            # Derive a "base" seed for the batch when possible.
-            base_seed: Optional[int] = None
-            if seed is not None:
-                try:
-                    base_seed = int(seed) - int(batch_index)
-                except Exception:
-                    base_seed = int(seed)
-
-            # Batch-level upsert.
-            batch_metadata: Optional[JSONDict] = None
-            if isinstance(metadata, dict):
-                batch_metadata = dict(metadata)
-                # These fields are tracked in dedicated columns.
-                batch_metadata.pop("batch_index", None)
-                batch_metadata.pop("batch_size", None)
-
-            cur.execute(
-                """
-                INSERT INTO image_generation_batches (
-                    id,
-                    api_client_id,
-                    caller_label,
-                    prompt,
-                    negative_prompt,
-                    width,
-                    height,
-                    num_inference_steps,
-                    guidance_scale,
-                    base_seed,
-                    batch_size,
-                    status,
-                    metadata
-                ) VALUES (
-                    %s, %s, NULL,
-                    %s, %s,
-                    %s, %s,
-                    %s, %s,
-                    %s,
-                    %s,
-                    'running',
-                    %s
+            # Batch-level upsert + per-image row, sent in one round trip.
+            with cur.connection.pipeline():
+                cur.execute(
+                    """
+                    INSERT INTO image_generation_batches (
+                        id,
+                        api_client_id,
+                        caller_label,
+                        prompt,
+                        negative_prompt,
+                        width,
+                        height,
+                        num_inference_steps,
+                        guidance_scale,
+                        base_seed,
+                        batch_size,
+                        status,
+                        metadata
+                    ) VALUES (
+                        %s, %s, NULL,
+                        %s, %s,
+                        %s, %s,
+                        %s, %s,
+                        %s,
+                        %s,
+                        'running',
+                        %s
+                    )
+                    ON CONFLICT (id) DO UPDATE
+                    SET
+                        api_client_id = COALESCE(image_generation_batches.api_client_id, EXCLUDED.api_client_id),
+                        prompt = EXCLUDED.prompt,
+                        negative_prompt = EXCLUDED.negative_prompt,
+                        width = EXCLUDED.width,
+                        height = EXCLUDED.height,
+                        num_inference_steps = EXCLUDED.num_inference_steps,
+                        guidance_scale = EXCLUDED.guidance_scale,
+                        base_seed = COALESCE(image_generation_batches.base_seed, EXCLUDED.base_seed),
+                        batch_size = EXCLUDED.batch_size,
+                        status = CASE
+                            WHEN image_generation_batches.status = 'pending' THEN 'running'
+                            ELSE image_generation_batches.status
+                        END,
+                        metadata = COALESCE(image_generation_batches.metadata, EXCLUDED.metadata)
+                    ;
+                    """,
+                    (
+                        str(batch_id),
+                        api_client_id,
+                        prompt,
+                        negative_prompt,
+                        width,
+                        height,
+                        num_inference_steps,
+                        guidance_scale,
+                        base_seed,
+                        batch_size,
+                        json.dumps(batch_metadata) if batch_metadata is not None else None,
+                    ),
                 )
-                ON CONFLICT (id) DO UPDATE
-                SET
-                    api_client_id = COALESCE(image_generation_batches.api_client_id, EXCLUDED.api_client_id),
-                    prompt = EXCLUDED.prompt,
-                    negative_prompt = EXCLUDED.negative_prompt,
-                    width = EXCLUDED.width,
-                    height = EXCLUDED.height,
-                    num_inference_steps = EXCLUDED.num_inference_steps,
-                    guidance_scale = EXCLUDED.guidance_scale,
-                    base_seed = COALESCE(image_generation_batches.base_seed, EXCLUDED.base_seed),
-                    batch_size = EXCLUDED.batch_size,
-                    status = CASE
-                        WHEN image_generation_batches.status = 'pending' THEN 'running'
-                        ELSE image_generation_batches.status
-                    END,
-                    metadata = COALESCE(image_generation_batches.metadata, EXCLUDED.metadata)
-                ;
-                """,
-                (
-                    str(batch_id),
-                    api_client_id,
-                    prompt,
-                    negative_prompt,
-                    width,
-                    height,
-                    num_inference_steps,
-                    guidance_scale,
-                    base_seed,
-                    batch_size,
-                    json.dumps(batch_metadata) if batch_metadata is not None else None,
-                ),
-            )
 
-            # Per-image row.
-            cur.execute(
-                """
-                INSERT INTO image_generation_tasks (
-                    task_id,
-                    batch_id,
-                    batch_index,
-                    seed,
-                    status,
-                    prompt,
-                    negative_prompt,
-                    width,
-                    height,
-                    num_inference_steps,
-                    guidance_scale,
-                    cfg_normalization,
-                    cfg_truncation,
-                    max_sequence_length,
-                    metadata
-                ) VALUES (
-                    %s, %s, %s, %s,
-                    'running',
-                    %s, %s,
-                    %s, %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s
+                # Per-image row.
+                cur.execute(
+                    """
+                    INSERT INTO image_generation_tasks (
+                        task_id,
+                        batch_id,
+                        batch_index,
+                        seed,
+                        status,
+                        prompt,
+                        negative_prompt,
+                        width,
+                        height,
+                        num_inference_steps,
+                        guidance_scale,
+                        cfg_normalization,
+                        cfg_truncation,
+                        max_sequence_length,
+                        metadata
+                    ) VALUES (
+                        %s, %s, %s, %s,
+                        'running',
+                        %s, %s,
+                        %s, %s,
+                        %s,
+                        %s,
+                        %s,
+                        %s,
+                        %s,
+                        %s
+                    )
+                    ON CONFLICT (task_id) DO UPDATE
+                    SET
+                        -- Keep a terminal status on redelivery: the batch counters
+                        -- already include it, and _finish_task() moves them only
+                        -- when the final status actually changes.
+                        status = CASE
+                            WHEN image_generation_tasks.status IN ('success', 'error', 'cancelled')
+                                THEN image_generation_tasks.status
+                            ELSE EXCLUDED.status
+                        END,
+                        seed = EXCLUDED.seed,
+                        prompt = EXCLUDED.prompt,
+                        negative_prompt = EXCLUDED.negative_prompt,
+                        width = EXCLUDED.width,
+                        height = EXCLUDED.height,
+                        num_inference_steps = EXCLUDED.num_inference_steps,
+                        guidance_scale = EXCLUDED.guidance_scale,
+                        cfg_normalization = EXCLUDED.cfg_normalization,
+                        cfg_truncation = EXCLUDED.cfg_truncation,
+                        max_sequence_length = EXCLUDED.max_sequence_length,
+                        metadata = EXCLUDED.metadata
+                    ;
+                    """,
+                    (
+                        task_id,
+                        str(batch_id),
+                        batch_index,
+                        seed,
+                        prompt,
+                        negative_prompt,
+                        width,
+                        height,
+                        num_inference_steps,
+                        guidance_scale,
+                        cfg_normalization,
+                        cfg_truncation,
+                        max_sequence_length,
+                        json.dumps(metadata) if metadata is not None else None,
+                    ),
                 )
-                ON CONFLICT (task_id) DO UPDATE
-                SET
-                    status = EXCLUDED.status,
-                    seed = EXCLUDED.seed,
-                    prompt = EXCLUDED.prompt,
-                    negative_prompt = EXCLUDED.negative_prompt,
-                    width = EXCLUDED.width,
-                    height = EXCLUDED.height,
-                    num_inference_steps = EXCLUDED.num_inference_steps,
-                    guidance_scale = EXCLUDED.guidance_scale,
-                    cfg_normalization = EXCLUDED.cfg_normalization,
-                    cfg_truncation = EXCLUDED.cfg_truncation,
-                    max_sequence_length = EXCLUDED.max_sequence_length,
-                    metadata = EXCLUDED.metadata
-                ;
-                """,
-                (
-                    task_id,
-                    str(batch_id),
-                    batch_index,
-                    seed,
-                    prompt,
-                    negative_prompt,
-                    width,
-                    height,
-                    num_inference_steps,
-                    guidance_scale,
-                    cfg_normalization,
-                    cfg_truncation,
-                    max_sequence_length,
-                    json.dumps(metadata) if metadata is not None else None,
-                ),
-            )
 
     _safe_execute(_impl)
 
 
-def _update_batch_counters(cur: psycopg.Cursor, batch_id: str) -> None:
-    """
-    Recompute success/failed counts for a batch and derive its status.
-    """
+_TERMINAL_FAILED_STATUSES = ("error", "cancelled")
 
-    cur.execute(
-        """
-        WITH counts AS (
-            SELECT
-                COUNT(*) FILTER (WHERE status = 'success') AS success_count,
-                COUNT(*) FILTER (WHERE status IN ('error', 'cancelled')) AS failed_count
-            FROM image_generation_tasks
-            WHERE batch_id = %s
-        )
+
+# Task -> terminal status plus the matching batch counter / status move.
+# Only needs the base schema (001), so completions are always recorded;
+# covers (003 / 005) and the webhook outbox (004) are written by the
+# optional statements below.
+_FINISH_TASK_SQL = """
+    WITH prev AS (
+        SELECT task_id, status
+        FROM image_generation_tasks
+        WHERE task_id = %s
+        FOR UPDATE
+    ),
+    updated AS (
+        UPDATE image_generation_tasks AS t
+        SET
+            status = %s,
+            {assignments}
+        FROM prev
+        WHERE t.task_id = prev.task_id
+        RETURNING t.batch_id, prev.status AS old_status, t.status AS new_status
+    ),
+    delta AS (
+        SELECT
+            updated.*,
+            (CASE WHEN new_status = 'success' THEN 1 ELSE 0 END)
+                - (CASE WHEN old_status = 'success' THEN 1 ELSE 0 END) AS success_delta,
+            (CASE WHEN new_status = ANY(%s) THEN 1 ELSE 0 END)
+                - (CASE WHEN old_status = ANY(%s) THEN 1 ELSE 0 END) AS failed_delta
+        FROM updated
+    ),
+    batch AS (
         UPDATE image_generation_batches AS b
         SET
-            success_count = counts.success_count,
-            failed_count = counts.failed_count,
+            success_count = b.success_count + d.success_delta,
+            failed_count = b.failed_count + d.failed_delta,
             status = CASE
-                WHEN counts.success_count + counts.failed_count >= b.batch_size THEN
+                WHEN b.success_count + d.success_delta + b.failed_count + d.failed_delta >= b.batch_size THEN
                     CASE
-                        WHEN counts.failed_count = 0 THEN 'success'
+                        WHEN b.failed_count + d.failed_delta = 0 THEN 'success'
                         ELSE 'partial'
                     END
                 ELSE 'running'
             END,
             completed_at = CASE
-                WHEN counts.success_count + counts.failed_count >= b.batch_size THEN NOW()
+                WHEN b.success_count + d.success_delta + b.failed_count + d.failed_delta >= b.batch_size
+                    THEN COALESCE(b.completed_at, NOW())
                 ELSE b.completed_at
             END
-        FROM counts
-        WHERE b.id = %s;
+        FROM delta AS d
+        WHERE b.id = d.batch_id AND d.old_status IS DISTINCT FROM d.new_status
+        RETURNING b.id, b.completed_at
+    )
+    SELECT d.batch_id, d.old_status, d.new_status, b.completed_at
+    FROM delta AS d
+    LEFT JOIN batch AS b ON b.id = d.batch_id
+"""
+
+# The batch cover tracks the successful task with the lowest batch_index;
+# a cover task that stops being successful clears it. preview_variants is
+# read through to_jsonb() so a missing 005 column only drops that field.
+_UPDATE_BATCH_COVER_SQL = """
+    UPDATE image_generation_batches AS b
+    SET (
+        cover_batch_index,
+        cover_relative_path,
+        cover_preview_relative_path,
+        cover_preview_variants,
+        cover_width,
+        cover_height,
+        cover_seed
+    ) = (
+        SELECT
+            CASE WHEN d.takes THEN d.batch_index END,
+            CASE WHEN d.takes THEN d.relative_path END,
+            CASE WHEN d.takes THEN d.preview_relative_path END,
+            CASE WHEN d.takes THEN d.preview_variants END,
+            CASE WHEN d.takes THEN d.width END,
+            CASE WHEN d.takes THEN d.height END,
+            CASE WHEN d.takes THEN d.seed END
+    )
+    FROM (
+        SELECT
+            t.batch_id,
+            t.batch_index,
+            t.relative_path,
+            t.preview_relative_path,
+            to_jsonb(t) -> 'preview_variants' AS preview_variants,
+            t.width,
+            t.height,
+            t.seed,
+            t.status = 'success' AS takes
+        FROM image_generation_tasks AS t
+        WHERE t.task_id = %s
+    ) AS d
+    WHERE b.id = d.batch_id
+        AND CASE
+            -- A successful task becomes the cover if it precedes the current one.
+            WHEN d.takes THEN b.cover_batch_index IS NULL OR d.batch_index <= b.cover_batch_index
+            -- A cover task that is no longer successful clears the cover.
+            ELSE d.batch_index = b.cover_batch_index
+        END
+"""
+
+# At most one webhook delivery per completed batch (libs/py_core/webhooks.py).
+_QUEUE_WEBHOOK_SQL = """
+    INSERT INTO webhook_deliveries (batch_id, url)
+    SELECT id, callback_url
+    FROM image_generation_batches
+    WHERE id = %s AND callback_url IS NOT NULL
+    ON CONFLICT (batch_id) DO NOTHING
+"""
+
+
+# Not-yet-finished rows of a Celery task: the task itself, or the items
+# (`<id>-<index>`, metadata.batch_task_id = <id>) of a batch task, found
+# through the batch of item 0.
+_SELECT_UNFINISHED_FOR_CELERY_TASK_SQL = """
+    SELECT t.task_id, t.metadata
+    FROM image_generation_tasks AS t
+    WHERE t.status IN ('pending', 'running')
+        AND (
+            t.task_id = %(task_id)s
+            OR (
+                t.batch_id = (SELECT batch_id FROM image_generation_tasks WHERE task_id = %(task_id)s || '-0')
+                AND t.metadata ->> 'batch_task_id' = %(task_id)s
+            )
+        )
+    ORDER BY t.batch_index
+    FOR UPDATE OF t
+"""
+
+_CANCELLED_ASSIGNMENTS = sql.SQL(
+    """
+    error_code = 'cancelled',
+    error_hint = %s,
+    error_message = NULL,
+    finished_at = NOW()
+    """
+)
+CANCELLED_ERROR_HINT = "任务已取消。"
+
+
+def _has_column(cur: psycopg.Cursor, table: str, column: str) -> bool:
+    """Whether `table` in the current schema has `column` (i.e. its migration ran)."""
+
+    cur.execute(
+        """
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
         """,
-        (batch_id, batch_id),
+        (table, column),
     )
+    return cur.fetchone() is not None
+
+
+def _execute_optional(cur: psycopg.Cursor, query: Any, params: Any) -> None:
+    """
+    Run a statement that depends on a later migration in a savepoint, so a
+    missing table / column skips it without aborting the transaction.
+    """
+
+    try:
+        with cur.connection.transaction():
+            cur.execute(query, params)
+    except (UndefinedTable, UndefinedColumn):
+        return
+
+
+def _finish_task(
+    cur: psycopg.Cursor,
+    task_id: str,
+    *,
+    status: str,
+    assignments: sql.Composable,
+    params: tuple[Any, ...],
+    preview_variants: Optional[JSONDict] = None,
+) -> None:
+    """
+    Move a task to a terminal `status` and apply the matching +1 / -1 to
+    its batch's counters, in one transaction.
+
+    Counters only move when the task's status actually changes, so a
+    retried delivery that reports the same outcome twice is a no-op, and a
+    retry that turns an error into a success moves the task from
+    failed_count to success_count. Concurrent completions within a batch
+    serialize on the batch row and each sees the other's increment.
+
+    The task's preview_variants, the batch's cover_* columns and, when
+    this completes a batch that has a callback_url, its webhook delivery
+    row are written by follow-up statements that are skipped if their
+    migration (003-005) is missing. scripts/backfill_batch_covers.py
+    re-derives covers afterwards.
+    """
+
+    with cur.connection.transaction():
+        cur.execute(
+            sql.SQL(_FINISH_TASK_SQL).format(assignments=assignments),
+            (
+                task_id,
+                status,
+                *params,
+                list(_TERMINAL_FAILED_STATUSES),
+                list(_TERMINAL_FAILED_STATUSES),
+            ),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return
+        batch_id, old_status, new_status, completed_at = row
+
+        if preview_variants is not None:
+            _execute_optional(
+                cur,
+                "UPDATE image_generation_tasks SET preview_variants = %s WHERE task_id = %s",
+                (json.dumps(preview_variants), task_id),
+            )
+        if new_status == "success" or old_status == "success":
+            _execute_optional(cur, _UPDATE_BATCH_COVER_SQL, (task_id,))
+        if completed_at is not None:
+            _execute_optional(cur, _QUEUE_WEBHOOK_SQL, (batch_id,))
 
 
 def record_generation_succeeded(task_id: str, result: GenerationResult) -> None:
@@ -389,12 +1037,13 @@ def record_generation_succeeded(task_id: str, result: GenerationResult) -> None:
     """
 
     def _impl() -> None:
-        with _get_cursor() as cur:
-            cur.execute(
-                """
-                UPDATE image_generation_tasks
-                SET
-                    status = 'success',
+        with _timed("record_generation_succeeded"), _get_cursor() as cur:
+            _finish_task(
+                cur,
+                task_id,
+                status="success",
+                assignments=sql.SQL(
+                    """
                     error_code = NULL,
                     error_hint = NULL,
                     error_message = NULL,
@@ -412,10 +1061,9 @@ def record_generation_succeeded(task_id: str, result: GenerationResult) -> None:
                     relative_path = %s,
                     preview_relative_path = %s,
                     metadata = %s
-                WHERE task_id = %s
-                RETURNING batch_id;
-                """,
-                (
+                    """
+                ),
+                params=(
                     result["width"],
                     result["height"],
                     result["num_inference_steps"],
@@ -429,12 +1077,9 @@ def record_generation_succeeded(task_id: str, result: GenerationResult) -> None:
                     result["relative_path"],
                     result["preview_relative_path"],
                     json.dumps(result.get("metadata") or {}),
-                    task_id,
                 ),
+                preview_variants=result.get("preview_variants") or {},
             )
-            row = cur.fetchone()
-            if row and row[0]:
-                _update_batch_counters(cur, str(row[0]))
 
     _safe_execute(_impl)
 
@@ -451,23 +1096,206 @@ def record_generation_failed(
     """
 
     def _impl() -> None:
-        with _get_cursor() as cur:
-            cur.execute(
-                """
-                UPDATE image_generation_tasks
-                SET
-                    status = 'error',
+        with _timed("record_generation_failed"), _get_cursor() as cur:
+            _finish_task(
+                cur,
+                task_id,
+                status="error",
+                assignments=sql.SQL(
+                    """
                     error_code = %s,
                     error_hint = %s,
                     error_message = %s,
                     finished_at = NOW()
-                WHERE task_id = %s
-                RETURNING batch_id;
-                """,
-                (error_code, error_hint, error_message, task_id),
+                    """
+                ),
+                params=(error_code, error_hint, error_message),
             )
-            row = cur.fetchone()
-            if row and row[0]:
-                _update_batch_counters(cur, str(row[0]))
 
     _safe_execute(_impl)
+
+
+def reconcile_batch_counters(
+    batch_ids: Optional[list[str]] = None,
+    *,
+    dry_run: bool = False,
+) -> list[tuple[Any, ...]]:
+    """
+    Recount success/failed per batch from image_generation_tasks and fix
+    batches whose stored counters or status disagree.
+
+    Returns one row per affected batch:
+    (batch_id, old_success, old_failed, old_status, success, failed, status).
+    Used by scripts/repair_batch_counters.py; errors are not swallowed.
+    """
+
+    diff = sql.SQL(
+        """
+        WITH counts AS (
+            SELECT
+                b.id AS batch_id,
+                COUNT(t.task_id) FILTER (WHERE t.status = 'success') AS success_count,
+                COUNT(t.task_id) FILTER (WHERE t.status = ANY(%(failed)s)) AS failed_count
+            FROM image_generation_batches AS b
+            LEFT JOIN image_generation_tasks AS t ON t.batch_id = b.id
+            WHERE %(batch_ids)s::uuid[] IS NULL OR b.id = ANY(%(batch_ids)s::uuid[])
+            GROUP BY b.id
+        ),
+        expected AS (
+            SELECT
+                b.id AS batch_id,
+                b.success_count AS old_success_count,
+                b.failed_count AS old_failed_count,
+                b.status AS old_status,
+                c.success_count,
+                c.failed_count,
+                CASE
+                    WHEN c.success_count + c.failed_count >= b.batch_size THEN
+                        CASE
+                            WHEN c.failed_count = 0 THEN 'success'
+                            ELSE 'partial'
+                        END
+                    WHEN b.status IN ('success', 'partial') THEN 'running'
+                    ELSE b.status
+                END AS status
+            FROM image_generation_batches AS b
+            JOIN counts AS c ON c.batch_id = b.id
+        ),
+        diff AS (
+            SELECT *
+            FROM expected
+            WHERE (old_success_count, old_failed_count, old_status)
+                IS DISTINCT FROM (success_count, failed_count, status)
+        )
+        """
+    )
+
+    if dry_run:
+        query = diff + sql.SQL(
+            """
+            SELECT batch_id, old_success_count, old_failed_count, old_status,
+                   success_count, failed_count, status
+            FROM diff
+            ORDER BY batch_id;
+            """
+        )
+    else:
+        query = diff + sql.SQL(
+            """
+            UPDATE image_generation_batches AS b
+            SET
+                success_count = diff.success_count,
+                failed_count = diff.failed_count,
+                status = diff.status,
+                completed_at = CASE
+                    WHEN diff.status IN ('success', 'partial') THEN COALESCE(b.completed_at, NOW())
+                    ELSE b.completed_at
+                END
+            FROM diff
+            WHERE b.id = diff.batch_id
+            RETURNING diff.batch_id, diff.old_success_count, diff.old_failed_count, diff.old_status,
+                      diff.success_count, diff.failed_count, diff.status;
+            """
+        )
+
+    params = {
+        "failed": list(_TERMINAL_FAILED_STATUSES),
+        "batch_ids": list(batch_ids) if batch_ids else None,
+    }
+    with _timed("reconcile_batch_counters"), _get_cursor() as cur:
+        cur.execute(query, params)
+        return list(cur.fetchall())
+
+
+def backfill_batch_covers(
+    after_id: Optional[str] = None,
+    *,
+    limit: int = 500,
+    only_missing: bool = True,
+) -> tuple[Optional[str], int]:
+    """
+    Re-derive the cover_* columns for one chunk of batches (ordered by id,
+    starting after `after_id`) from their first successful task.
+
+    Returns (last batch id scanned, number of rows changed); the id is None
+    once there is nothing left. Used by scripts/backfill_batch_covers.py;
+    errors are not swallowed. On a DB without migration 005 the
+    cover_preview_variants column is left out rather than failing.
+    """
+
+    filter_sql = sql.SQL("AND cover_batch_index IS NULL AND success_count > 0" if only_missing else "")
+    query = sql.SQL(
+        """
+        WITH chunk AS (
+            SELECT id
+            FROM image_generation_batches
+            WHERE (%(after_id)s::uuid IS NULL OR id > %(after_id)s::uuid) {filter}
+            ORDER BY id
+            LIMIT %(limit)s
+        ),
+        cover AS (
+            SELECT DISTINCT ON (t.batch_id)
+                t.batch_id,
+                t.batch_index,
+                t.relative_path,
+                t.preview_relative_path,
+                to_jsonb(t) -> 'preview_variants' AS preview_variants,
+                t.width,
+                t.height,
+                t.seed
+            FROM image_generation_tasks AS t
+            JOIN chunk ON chunk.id = t.batch_id
+            WHERE t.status = 'success'
+            ORDER BY t.batch_id, t.batch_index
+        ),
+        changed AS (
+            UPDATE image_generation_batches AS b
+            SET
+                cover_batch_index = cover.batch_index,
+                cover_relative_path = cover.relative_path,
+                cover_preview_relative_path = cover.preview_relative_path,
+                {set_variants}
+                cover_width = cover.width,
+                cover_height = cover.height,
+                cover_seed = cover.seed
+            FROM chunk
+            LEFT JOIN cover ON cover.batch_id = chunk.id
+            WHERE b.id = chunk.id
+                AND (
+                    b.cover_batch_index,
+                    b.cover_relative_path,
+                    b.cover_preview_relative_path,
+                    {batch_variants}
+                    b.cover_width,
+                    b.cover_height,
+                    b.cover_seed
+                ) IS DISTINCT FROM (
+                    cover.batch_index,
+                    cover.relative_path,
+                    cover.preview_relative_path,
+                    {cover_variants}
+                    cover.width,
+                    cover.height,
+                    cover.seed
+                )
+            RETURNING b.id
+        )
+        SELECT
+            (SELECT id FROM chunk ORDER BY id DESC LIMIT 1),
+            (SELECT COUNT(*) FROM changed);
+        """
+    )
+
+    with _timed("backfill_batch_covers"), _get_cursor() as cur:
+        has_variants = _has_column(cur, "image_generation_batches", "cover_preview_variants")
+        query = query.format(
+            filter=filter_sql,
+            set_variants=sql.SQL("cover_preview_variants = cover.preview_variants," if has_variants else ""),
+            batch_variants=sql.SQL("b.cover_preview_variants," if has_variants else ""),
+            cover_variants=sql.SQL("cover.preview_variants," if has_variants else ""),
+        )
+        cur.execute(query, {"after_id": after_id, "limit": limit})
+        row = cur.fetchone()
+
+    last_id, changed = row if row else (None, 0)
+    return (str(last_id) if last_id is not None else None), int(changed or 0)
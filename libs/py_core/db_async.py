@@ -0,0 +1,306 @@
+"""
+Async PostgreSQL helpers for the FastAPI process.
+
+The API handlers are `async def`, so they must not block the event loop on
+psycopg calls. This module mirrors the subset of `libs.py_core.db` used by
+the HTTP layer on top of a `psycopg_pool.AsyncConnectionPool` (same
+DB_POOL_* sizing), reusing its SQL and the per-process client-id cache.
+
+The pool is opened by the API lifespan (`open_pool()` / `close_pool()`),
+and lazily on first use otherwise.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional, Sequence
+
+import psycopg
+from psycopg import sql
+from psycopg.errors import UndefinedColumn, UndefinedTable
+
+from .client_cache import ClientInfo
+from .config import get_settings
+from .db import (
+    _CANCELLED_ASSIGNMENTS,
+    _ENQUEUE_SQL,
+    _FINISH_TASK_SQL,
+    _INSERT_API_CLIENT_SQL,
+    _QUEUE_WEBHOOK_SQL,
+    _SELECT_API_CLIENT_SQL,
+    _SELECT_UNFINISHED_FOR_CELERY_TASK_SQL,
+    _SET_BATCH_CALLBACK_SQL,
+    _TERMINAL_FAILED_STATUSES,
+    _UPDATE_BATCH_COVER_SQL,
+    CANCELLED_ERROR_HINT,
+    _client_cache,
+    _client_info,
+    _enqueue_params,
+    _get_psycopg_dsn,
+    _hash_api_key,
+    _new_api_client_row,
+    _timed,
+)
+from .types import JSONDict
+
+
+_pool: Any = None
+_pool_lock: Optional[asyncio.Lock] = None
+
+
+async def open_pool() -> Any:
+    global _pool, _pool_lock
+
+    if _pool is not None:
+        return _pool
+
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+
+    async with _pool_lock:
+        if _pool is None:
+            from psycopg_pool import AsyncConnectionPool
+
+            settings = get_settings()
+            pool = AsyncConnectionPool(
+                _get_psycopg_dsn(),
+                min_size=settings.db_pool_min_size,
+                max_size=max(settings.db_pool_max_size, settings.db_pool_min_size, 1),
+                timeout=settings.db_pool_timeout,
+                kwargs={"autocommit": True},
+                check=AsyncConnectionPool.check_connection,
+                name="z-image-api",
+                open=False,
+            )
+            # Do not wait for min_size connections: the API should start
+            # (and serve Redis-only endpoints) even while Postgres is down.
+            await pool.open(wait=False)
+            _pool = pool
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool, _pool_lock
+
+    pool, _pool, _pool_lock = _pool, None, None
+    if pool is not None:
+        await pool.close()
+
+
+def get_pool_stats() -> dict[str, int]:
+    if _pool is None:
+        return {}
+    try:
+        return dict(_pool.get_stats())
+    except Exception:
+        return {}
+
+
+@asynccontextmanager
+async def get_db_cursor() -> AsyncIterator[psycopg.AsyncCursor]:
+    """
+    Borrow a pooled autocommit connection + cursor.
+    """
+
+    pool = await open_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            yield cur
+
+
+async def _get_or_create_api_client(cur: psycopg.AsyncCursor, raw_key: Optional[str]) -> Optional[ClientInfo]:
+    if not raw_key:
+        return None
+
+    key_hash = _hash_api_key(raw_key)
+    cached = _client_cache.get(key_hash)
+    if cached is not None:
+        return cached
+    return await _load_api_client(cur, raw_key, key_hash)
+
+
+async def _load_api_client(cur: psycopg.AsyncCursor, raw_key: str, key_hash: str) -> ClientInfo:
+    await cur.execute(_SELECT_API_CLIENT_SQL, (key_hash,))
+    row = await cur.fetchone()
+    if not row:
+        row = _new_api_client_row(raw_key, key_hash)
+        await cur.execute(_INSERT_API_CLIENT_SQL, row)
+
+    info = _client_info(row)
+    _client_cache.put(key_hash, info)
+    return info
+
+
+async def _get_or_create_api_client_id(cur: psycopg.AsyncCursor, raw_key: Optional[str]) -> Optional[str]:
+    info = await _get_or_create_api_client(cur, raw_key)
+    return info.id if info is not None else None
+
+
+async def resolve_api_client(raw_key: Optional[str]) -> Optional[ClientInfo]:
+    """
+    The caller's api_clients row (created on first sight), served from the
+    per-process client cache without touching the pool on a hit.
+
+    When Postgres cannot be reached, an expired cache entry is returned
+    rather than failing; errors are raised only for keys never seen.
+    """
+
+    if not raw_key:
+        return None
+
+    key_hash = _hash_api_key(raw_key)
+    cached = _client_cache.get(key_hash)
+    if cached is not None:
+        return cached
+
+    try:
+        async with get_db_cursor() as cur:
+            return await _load_api_client(cur, raw_key, key_hash)
+    except psycopg.OperationalError:
+        stale = _client_cache.get(key_hash, allow_stale=True)
+        if stale is None:
+            raise
+        return stale
+
+
+async def get_api_client_id_for_key(raw_key: Optional[str]) -> Optional[str]:
+    """
+    Async counterpart of `db.get_api_client_id_for_key`.
+    """
+
+    info = await resolve_api_client(raw_key)
+    return info.id if info is not None else None
+
+
+async def record_generation_enqueued(
+    task_ids: Sequence[str],
+    *,
+    prompt: str,
+    height: int,
+    width: int,
+    num_inference_steps: int,
+    guidance_scale: float,
+    seeds: Sequence[Optional[int]],
+    negative_prompt: Optional[str],
+    cfg_normalization: Optional[bool],
+    cfg_truncation: Optional[float],
+    max_sequence_length: Optional[int],
+    auth_key: Optional[str],
+    metadata: Optional[JSONDict],
+    callback_url: Optional[str] = None,
+) -> None:
+    """
+    Async counterpart of `db.record_generation_enqueued` (same statement,
+    same best-effort semantics).
+    """
+
+    if not task_ids:
+        return
+
+    try:
+        with _timed("record_generation_enqueued", publish=False):
+            async with get_db_cursor() as cur, cur.connection.transaction():
+                params = _enqueue_params(
+                    task_ids,
+                    api_client_id=await _get_or_create_api_client_id(cur, auth_key),
+                    prompt=prompt,
+                    height=height,
+                    width=width,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    seeds=seeds,
+                    negative_prompt=negative_prompt,
+                    cfg_normalization=cfg_normalization,
+                    cfg_truncation=cfg_truncation,
+                    max_sequence_length=max_sequence_length,
+                    metadata=metadata,
+                    callback_url=callback_url,
+                )
+                await cur.execute(_ENQUEUE_SQL, params)
+                if params["callback_url"] is not None or params["api_client_id"] is not None:
+                    await _execute_optional(cur, _SET_BATCH_CALLBACK_SQL, params)
+    except (UndefinedTable, UndefinedColumn):
+        # Migrations not applied yet; skip recording instead of failing.
+        return
+    except psycopg.OperationalError:
+        # Database is unavailable; the task is still enqueued.
+        return
+
+
+async def _execute_optional(cur: psycopg.AsyncCursor, query: Any, params: Any) -> None:
+    try:
+        async with cur.connection.transaction():
+            await cur.execute(query, params)
+    except (UndefinedTable, UndefinedColumn):
+        return
+
+
+async def _finish_task(
+    cur: psycopg.AsyncCursor,
+    task_id: str,
+    *,
+    status: str,
+    assignments: sql.Composable,
+    params: tuple[Any, ...],
+) -> None:
+    """
+    Async counterpart of `db._finish_task` (same statements).
+    """
+
+    async with cur.connection.transaction():
+        await cur.execute(
+            sql.SQL(_FINISH_TASK_SQL).format(assignments=assignments),
+            (task_id, status, *params, list(_TERMINAL_FAILED_STATUSES), list(_TERMINAL_FAILED_STATUSES)),
+        )
+        row = await cur.fetchone()
+        if row is None:
+            return
+        batch_id, old_status, new_status, completed_at = row
+        if new_status == "success" or old_status == "success":
+            await _execute_optional(cur, _UPDATE_BATCH_COVER_SQL, (task_id,))
+        if completed_at is not None:
+            await _execute_optional(cur, _QUEUE_WEBHOOK_SQL, (batch_id,))
+
+
+async def record_generation_cancelled(celery_task_id: str) -> list[tuple[str, Optional[JSONDict]]]:
+    """
+    Finish the still pending / running rows of a revoked Celery task as
+    `cancelled` (counted as failed by the batch). Returns the
+    (task_id, metadata) of the rows that were moved.
+    """
+
+    cancelled: list[tuple[str, Optional[JSONDict]]] = []
+    try:
+        with _timed("record_generation_cancelled", publish=False):
+            # One transaction: the selected rows stay locked, so a worker
+            # completing one of them meanwhile is not overwritten.
+            async with get_db_cursor() as cur, cur.connection.transaction():
+                await cur.execute(_SELECT_UNFINISHED_FOR_CELERY_TASK_SQL, {"task_id": celery_task_id})
+                rows = await cur.fetchall()
+                for task_id, metadata in rows:
+                    await _finish_task(
+                        cur,
+                        task_id,
+                        status="cancelled",
+                        assignments=_CANCELLED_ASSIGNMENTS,
+                        params=(CANCELLED_ERROR_HINT,),
+                    )
+                    cancelled.append((task_id, metadata if isinstance(metadata, dict) else None))
+    except UndefinedTable:
+        return cancelled
+    except psycopg.OperationalError:
+        return cancelled
+    return cancelled
+
+
+__all__ = [
+    "close_pool",
+    "get_api_client_id_for_key",
+    "get_db_cursor",
+    "get_pool_stats",
+    "open_pool",
+    "record_generation_cancelled",
+    "record_generation_enqueued",
+    "resolve_api_client",
+]
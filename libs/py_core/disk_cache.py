@@ -0,0 +1,131 @@
+"""
+Byte-bounded on-disk LRU cache of small immutable files.
+
+Entries are addressed by an arbitrary string key and stored under
+`<root>/<aa>/<blake2b(key)>`, so keys never become paths. Writes go to a
+temp file that is renamed into place, so readers never see a partial
+entry. Recency is the file mtime (refreshed on hits), which keeps the LRU
+order across restarts; the in-process index is rebuilt from a directory
+scan on first use.
+
+Several processes may share a directory: each evicts according to its own
+index, and `get()` always checks that the file still exists.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Optional
+
+
+@dataclass
+class DiskCache:
+    root: Path
+    max_bytes: int
+    _index: OrderedDict[str, int] = field(default_factory=OrderedDict)
+    _total_bytes: int = 0
+    _loaded: bool = False
+    _hits: int = 0
+    _misses: int = 0
+    _evictions: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def path_for(self, key: str) -> Path:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+        return self.root / digest[:2] / digest
+
+    def _load(self) -> None:
+        # Caller holds the lock.
+        if self._loaded:
+            return
+        self._loaded = True
+        entries: list[tuple[float, str, int]] = []
+        if self.root.is_dir():
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._index[path] = size
+            self._total_bytes += size
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self.path_for(key)
+        with self._lock:
+            self._load()
+            if not path.is_file():
+                # Evicted by another process sharing the directory.
+                self._total_bytes -= self._index.pop(str(path), 0)
+                self._misses += 1
+                return None
+            self._hits += 1
+            if str(path) in self._index:
+                self._index.move_to_end(str(path))
+        with suppress(OSError):
+            os.utime(path)
+        return path
+
+    def put(self, key: str, data: bytes | memoryview | Iterable[bytes]) -> Path:
+        """
+        Store `data` (a buffer, or chunks streamed straight to disk).
+        """
+
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        chunks = [data] if isinstance(data, (bytes, memoryview)) else data
+        size = 0
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in chunks:
+                    size += fh.write(chunk)
+            os.replace(tmp_name, path)
+        except BaseException:
+            with suppress(OSError):
+                os.unlink(tmp_name)
+            raise
+
+        with self._lock:
+            self._load()
+            self._total_bytes += size - self._index.pop(str(path), 0)
+            self._index[str(path)] = size
+            self._evict(keep=str(path))
+        return path
+
+    def _evict(self, *, keep: str) -> None:
+        # Caller holds the lock.
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            victim, size = next(iter(self._index.items()))
+            if victim == keep:
+                self._index.move_to_end(victim)
+                continue
+            del self._index[victim]
+            self._total_bytes -= size
+            self._evictions += 1
+            with suppress(OSError):
+                os.unlink(victim)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+__all__ = ["DiskCache"]
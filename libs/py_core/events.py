@@ -0,0 +1,352 @@
+"""
+Task / batch progress events published by the worker over Redis pub/sub.
+
+Every event is a small JSON message sent to the task's channel
+(`zimage:events:task:<task_id>`) and, for tasks that belong to a batch,
+to the batch channel (`zimage:events:batch:<batch_id>`). The API turns
+them into Server-Sent Events (see apps/api/routes/events.py), so clients
+no longer need to poll `/v1/history/{batch_id}`.
+
+Message shapes:
+
+- {"type": "progress", "task_id", "batch_id", "batch_index", "progress"}
+- {"type": "status", "task_id", "batch_id", "batch_index", "status",
+   ...output fields on "success" / error fields on "error"}
+
+Progress is coalesced by `ProgressReporter` (at most one update per
+Z_IMAGE_PROGRESS_MIN_INTERVAL_MS) and the latest value is also kept in a
+small TTL key, `zimage:progress:<task_id>`, which the API bulk-reads
+instead of Celery's PROGRESS state.
+
+Publishing is fire-and-forget: pub/sub has no history, so anything a
+client needs after (re)connecting is still read from Postgres / the
+Celery result backend / the progress keys.
+
+The same pipeline bumps small version counters that the API turns into
+ETags (apps/api/etags.py): `zimage:version:batch:<batch_id>` on every
+event of a batch item, and `zimage:version:history` on status changes.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections.abc import Sequence
+from functools import lru_cache
+from typing import Any, Optional
+
+from .config import get_settings
+from .types import GenerationResult, JSONDict
+
+
+TASK_CHANNEL_PREFIX = "zimage:events:task:"
+BATCH_CHANNEL_PREFIX = "zimage:events:batch:"
+PROGRESS_KEY_PREFIX = "zimage:progress:"
+BATCH_VERSION_KEY_PREFIX = "zimage:version:batch:"
+# History list versions: one per api_client_id plus the global one (admin /
+# anonymous history), so a client's ETag only moves with its own batches.
+HISTORY_VERSION_KEY = "zimage:version:history"
+HISTORY_VERSION_KEY_PREFIX = "zimage:version:history:"
+# Version keys of batches nobody touched for this long are dropped (the
+# API re-creates them with a random base value on the next read).
+VERSION_TTL_SECONDS = 7 * 24 * 60 * 60
+# {"client_id": ...}: drop cached api_clients rows (see client_cache.py);
+# a null client_id clears the whole cache.
+CLIENTS_CHANNEL = "zimage:events:clients"
+
+
+def task_channel(task_id: str) -> str:
+    return f"{TASK_CHANNEL_PREFIX}{task_id}"
+
+
+def batch_channel(batch_id: str) -> str:
+    return f"{BATCH_CHANNEL_PREFIX}{batch_id}"
+
+
+def progress_key(task_id: str) -> str:
+    return f"{PROGRESS_KEY_PREFIX}{task_id}"
+
+
+def batch_version_key(batch_id: str) -> str:
+    return f"{BATCH_VERSION_KEY_PREFIX}{batch_id}"
+
+
+def history_version_key(api_client_id: Optional[str]) -> str:
+    """
+    Version key of one client's history list (None: the global list).
+    """
+
+    return f"{HISTORY_VERSION_KEY_PREFIX}{api_client_id}" if api_client_id else HISTORY_VERSION_KEY
+
+
+def history_owner(metadata: Optional[JSONDict]) -> Optional[str]:
+    """
+    api_client_id the API stamped on a task's metadata at enqueue time.
+    """
+
+    owner = metadata.get("api_client_id") if isinstance(metadata, dict) else None
+    return owner if isinstance(owner, str) else None
+
+
+def queue_version_bump(
+    pipe: Any,
+    batch_id: Optional[str],
+    *,
+    history: bool,
+    api_client_id: Optional[str] = None,
+) -> None:
+    """
+    Add the version INCRs for a change to `batch_id` (and, with `history`,
+    to the global history list and that of its owner `api_client_id`) to a
+    sync or asyncio Redis pipeline.
+    """
+
+    if batch_id:
+        pipe.incr(batch_version_key(batch_id))
+        pipe.expire(batch_version_key(batch_id), VERSION_TTL_SECONDS)
+    if history:
+        pipe.incr(HISTORY_VERSION_KEY)
+        if api_client_id:
+            pipe.incr(history_version_key(api_client_id))
+            pipe.expire(history_version_key(api_client_id), VERSION_TTL_SECONDS)
+
+
+@lru_cache(maxsize=1)
+def _get_redis() -> Any:
+    import redis
+
+    return redis.Redis.from_url(str(get_settings().redis_url))
+
+
+def batch_position(metadata: Optional[JSONDict]) -> tuple[Optional[str], Optional[int]]:
+    """
+    (batch_id, batch_index) from task metadata, if present.
+    """
+
+    if not isinstance(metadata, dict):
+        return None, None
+    batch_id = metadata.get("batch_id")
+    batch_index = metadata.get("batch_index")
+    return (
+        batch_id if isinstance(batch_id, str) else None,
+        batch_index if isinstance(batch_index, int) else None,
+    )
+
+
+def _queue_event(
+    pipe: Any,
+    task_id: str,
+    event_type: str,
+    *,
+    batch_id: Optional[str],
+    batch_index: Optional[int],
+    api_client_id: Optional[str] = None,
+    **fields: Any,
+) -> None:
+    message = json.dumps(
+        {
+            "type": event_type,
+            "task_id": task_id,
+            "batch_id": batch_id,
+            "batch_index": batch_index,
+            **fields,
+        },
+        separators=(",", ":"),
+    )
+    pipe.publish(task_channel(task_id), message)
+    if batch_id:
+        pipe.publish(batch_channel(batch_id), message)
+        # Progress only shows up in the batch detail; status changes also
+        # move the history list (counters, cover, status).
+        queue_version_bump(pipe, batch_id, history=event_type == "status", api_client_id=api_client_id)
+
+
+def publish_task_event(
+    task_id: str,
+    event_type: str,
+    *,
+    batch_id: Optional[str] = None,
+    batch_index: Optional[int] = None,
+    api_client_id: Optional[str] = None,
+    **fields: Any,
+) -> None:
+    """
+    Best-effort: publish one event for `task_id` (and its batch, owned by
+    `api_client_id`).
+    """
+
+    try:
+        pipe = _get_redis().pipeline(transaction=False)
+        _queue_event(
+            pipe,
+            task_id,
+            event_type,
+            batch_id=batch_id,
+            batch_index=batch_index,
+            api_client_id=api_client_id,
+            **fields,
+        )
+        pipe.execute()
+    except Exception:
+        return
+
+
+class ProgressReporter:
+    """
+    Progress callback target for one or more tasks that advance together
+    (a single task, or every image of a batched pipeline call).
+
+    Updates closer than Z_IMAGE_PROGRESS_MIN_INTERVAL_MS to the previous one
+    are dropped, except 100%. Each emitted update is one pipelined round
+    trip: SET the TTL'd progress key and PUBLISH a progress event for every
+    task. `extra_task_ids` (e.g. the Celery id of a batch task, whose items
+    are reported individually) get the key and an event on their own task
+    channel only, so batch subscribers do not see it twice.
+    """
+
+    def __init__(
+        self,
+        task_ids: Sequence[str],
+        *,
+        batch_id: Optional[str] = None,
+        batch_indices: Optional[Sequence[Optional[int]]] = None,
+        extra_task_ids: Sequence[str] = (),
+    ) -> None:
+        settings = get_settings()
+        self.task_ids = list(task_ids)
+        self.batch_id = batch_id
+        self.batch_indices = list(batch_indices) if batch_indices is not None else [None] * len(self.task_ids)
+        self.extra_task_ids = list(extra_task_ids)
+        self.min_interval_seconds = max(0, settings.z_image_progress_min_interval_ms) / 1000.0
+        self.ttl_seconds = settings.z_image_progress_ttl_seconds
+        self._lock = threading.Lock()
+        self._last_sent_at: Optional[float] = None
+        self._last_progress: Optional[int] = None
+
+    def _should_send(self, progress: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if progress == self._last_progress:
+                return False
+            if (
+                progress < 100
+                and self._last_sent_at is not None
+                and now - self._last_sent_at < self.min_interval_seconds
+            ):
+                return False
+            self._last_sent_at = now
+            self._last_progress = progress
+            return True
+
+    def __call__(self, progress: int) -> None:
+        if not self._should_send(progress):
+            return
+
+        try:
+            pipe = _get_redis().pipeline(transaction=False)
+            for task_id in [*self.task_ids, *self.extra_task_ids]:
+                pipe.set(progress_key(task_id), progress, ex=self.ttl_seconds)
+            for task_id, batch_index in zip(self.task_ids, self.batch_indices):
+                _queue_event(pipe, task_id, "progress", batch_id=self.batch_id, batch_index=batch_index, progress=progress)
+            for task_id in self.extra_task_ids:
+                _queue_event(pipe, task_id, "progress", batch_id=None, batch_index=None, progress=progress)
+            pipe.execute()
+        except Exception:
+            return
+
+
+def publish_task_succeeded(task_id: str, result: GenerationResult) -> None:
+    batch_id, batch_index = batch_position(result.get("metadata"))
+    publish_task_event(
+        task_id,
+        "status",
+        batch_id=batch_id,
+        batch_index=batch_index,
+        api_client_id=history_owner(result.get("metadata")),
+        status="success",
+        relative_path=result.get("relative_path"),
+        preview_relative_path=result.get("preview_relative_path"),
+        width=result.get("width"),
+        height=result.get("height"),
+        seed=result.get("seed"),
+    )
+
+
+def publish_task_failed(
+    task_id: str,
+    metadata: Optional[JSONDict],
+    *,
+    error_code: Optional[str],
+    error_hint: Optional[str],
+) -> None:
+    batch_id, batch_index = batch_position(metadata)
+    publish_task_event(
+        task_id,
+        "status",
+        batch_id=batch_id,
+        batch_index=batch_index,
+        api_client_id=history_owner(metadata),
+        status="error",
+        error_code=error_code,
+        error_hint=error_hint,
+    )
+
+
+def queue_task_cancelled(pipe: Any, task_id: str, metadata: Optional[JSONDict]) -> None:
+    """
+    Queue the status event of a task cancelled by the API on the caller's
+    pipeline (sync or asyncio Redis).
+    """
+
+    batch_id, batch_index = batch_position(metadata)
+    _queue_event(
+        pipe,
+        task_id,
+        "status",
+        batch_id=batch_id,
+        batch_index=batch_index,
+        api_client_id=history_owner(metadata),
+        status="cancelled",
+    )
+
+
+def publish_client_invalidation(client_id: Optional[str]) -> bool:
+    """
+    Tell every API process to forget its cached row for `client_id`.
+
+    Returns False when Redis could not be reached (API processes then pick
+    the change up when their cache entry expires).
+    """
+
+    try:
+        _get_redis().publish(CLIENTS_CHANNEL, json.dumps({"client_id": client_id}))
+    except Exception:
+        return False
+    return True
+
+
+__all__ = [
+    "BATCH_CHANNEL_PREFIX",
+    "BATCH_VERSION_KEY_PREFIX",
+    "CLIENTS_CHANNEL",
+    "HISTORY_VERSION_KEY",
+    "HISTORY_VERSION_KEY_PREFIX",
+    "PROGRESS_KEY_PREFIX",
+    "ProgressReporter",
+    "TASK_CHANNEL_PREFIX",
+    "VERSION_TTL_SECONDS",
+    "batch_channel",
+    "batch_position",
+    "batch_version_key",
+    "history_owner",
+    "history_version_key",
+    "publish_client_invalidation",
+    "publish_task_event",
+    "publish_task_failed",
+    "publish_task_succeeded",
+    "progress_key",
+    "queue_task_cancelled",
+    "queue_version_bump",
+    "task_channel",
+]
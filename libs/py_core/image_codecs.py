@@ -0,0 +1,299 @@
+"""
+Image codec layer for generated outputs.
+
+All PNG / WebP encoding for generated images goes through this module so
+that the encoder backend and its settings can be tuned in one place:
+
+  - Z_IMAGE_CODEC_BACKEND        : "pillow" (default) or "opencv".
+  - Z_IMAGE_PNG_COMPRESS_LEVEL   : zlib level 0-9 (Pillow default: 6).
+  - Z_IMAGE_PNG_FILTER           : PNG row filter, for backends that expose it.
+  - Z_IMAGE_WEBP_QUALITY         : 0-100 (Pillow default: 80).
+  - Z_IMAGE_WEBP_METHOD          : 0-6 speed/size tradeoff (Pillow default: 4).
+  - Z_IMAGE_WEBP_LOSSLESS        : lossless WebP previews.
+
+Encoders accept either a PIL image or the pipeline's uint8 HxWx3 RGB array
+(see `Z_IMAGE_PIPELINE_OUTPUT_TYPE`), so outputs can be encoded without an
+intermediate PIL round trip. `encode_formats()` encodes several formats of
+the same image in parallel; both backends release the GIL while
+compressing. `encode_image_to()` writes into a file object instead of a
+buffer (e.g. `StorageBackend.put_stream`), so Pillow PNGs are streamed out
+in small blocks; WebP and OpenCV output is still produced in one piece by
+the underlying library, but is written out without further copies.
+
+`scripts/benchmark_image_codecs.py` reports ms per megapixel and bytes per
+image for each setting.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from io import BytesIO
+from typing import IO, Any, Protocol
+
+from .config import get_settings
+
+
+CONTENT_TYPES: dict[str, str] = {
+    "png": "image/png",
+    "webp": "image/webp",
+}
+
+# Pillow has no PNG filter option; OpenCV >= 4.10 exposes IMWRITE_PNG_FILTER.
+_OPENCV_PNG_FILTERS: dict[str, str] = {
+    "none": "IMWRITE_PNG_FILTER_NONE",
+    "sub": "IMWRITE_PNG_FILTER_SUB",
+    "up": "IMWRITE_PNG_FILTER_UP",
+    "avg": "IMWRITE_PNG_FILTER_AVG",
+    "paeth": "IMWRITE_PNG_FILTER_PAETH",
+    "fast": "IMWRITE_PNG_FAST_FILTERS",
+    "all": "IMWRITE_PNG_ALL_FILTERS",
+}
+
+
+@dataclass(frozen=True)
+class CodecSettings:
+    png_compress_level: int = 6
+    png_filter: str | None = None
+    webp_quality: int = 80
+    webp_method: int = 4
+    webp_lossless: bool = False
+
+    def with_overrides(self, **overrides: Any) -> CodecSettings:
+        return replace(self, **overrides)
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    # Zero-copy view over the encoder's output buffer where possible.
+    data: bytes | memoryview
+    format: str
+    content_type: str
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes if isinstance(self.data, memoryview) else len(self.data)
+
+
+class ImageEncoder(Protocol):
+    name: str
+
+    def encode(self, image: object, *, format: str, settings: CodecSettings) -> EncodedImage:
+        ...
+
+    def encode_to(self, image: object, fh: IO[bytes], *, format: str, settings: CodecSettings) -> None:
+        ...
+
+
+def _normalize_format(format: str) -> str:
+    fmt = format.strip().lower()
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported output format '{format}'. Valid options: {', '.join(CONTENT_TYPES)}")
+    return fmt
+
+
+def as_uint8_rgb(image: object) -> Any:
+    """
+    Return `image` as a uint8 HxWx3 array, accepting PIL images, uint8
+    arrays and the float [0, 1] arrays produced by diffusers' "np" output.
+    """
+
+    import numpy as np
+
+    array = np.asarray(image)
+    if array.dtype != np.uint8:
+        array = (array * 255).round().clip(0, 255).astype(np.uint8)
+    if array.ndim == 2:
+        array = np.stack([array] * 3, axis=-1)
+    return array
+
+
+class PillowEncoder:
+    name = "pillow"
+
+    def encode_to(self, image: object, fh: IO[bytes], *, format: str, settings: CodecSettings) -> None:
+        from PIL import Image
+
+        fmt = _normalize_format(format)
+        pil_image = image if isinstance(image, Image.Image) else Image.fromarray(as_uint8_rgb(image))
+
+        if fmt == "png":
+            # Pillow emits PNG data in ImageFile.MAXBLOCK-sized writes (or
+            # straight to the fd for real files).
+            pil_image.save(fh, format="PNG", compress_level=settings.png_compress_level)
+        else:
+            pil_image.save(
+                fh,
+                format="WEBP",
+                quality=settings.webp_quality,
+                method=settings.webp_method,
+                lossless=settings.webp_lossless,
+            )
+
+    def encode(self, image: object, *, format: str, settings: CodecSettings) -> EncodedImage:
+        fmt = _normalize_format(format)
+        buf = BytesIO()
+        self.encode_to(image, buf, format=fmt, settings=settings)
+        # getbuffer() exposes the encoded bytes without the getvalue() copy.
+        return EncodedImage(data=buf.getbuffer(), format=fmt, content_type=CONTENT_TYPES[fmt])
+
+
+class OpenCVEncoder:
+    """
+    Encodes straight from the uint8 RGB array via libpng / libwebp.
+
+    OpenCV has no WebP `method` knob; lossless WebP maps to quality > 100.
+    """
+
+    name = "opencv"
+
+    def encode(self, image: object, *, format: str, settings: CodecSettings) -> EncodedImage:
+        import cv2  # type: ignore[import-not-found]
+
+        fmt = _normalize_format(format)
+        bgr = cv2.cvtColor(as_uint8_rgb(image), cv2.COLOR_RGB2BGR)
+
+        params: list[int]
+        if fmt == "png":
+            params = [cv2.IMWRITE_PNG_COMPRESSION, settings.png_compress_level]
+            if settings.png_filter:
+                flag_name = _OPENCV_PNG_FILTERS.get(settings.png_filter.strip().lower())
+                if flag_name and hasattr(cv2, "IMWRITE_PNG_FILTER") and hasattr(cv2, flag_name):
+                    params += [cv2.IMWRITE_PNG_FILTER, getattr(cv2, flag_name)]
+        else:
+            quality = 101 if settings.webp_lossless else settings.webp_quality
+            params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+
+        ok, encoded = cv2.imencode(f".{fmt}", bgr, params)
+        if not ok:
+            raise RuntimeError(f"OpenCV failed to encode {fmt}")
+        return EncodedImage(data=memoryview(encoded).cast("B"), format=fmt, content_type=CONTENT_TYPES[fmt])
+
+    def encode_to(self, image: object, fh: IO[bytes], *, format: str, settings: CodecSettings) -> None:
+        # imencode only produces a whole buffer; hand over a view of it.
+        fh.write(self.encode(image, format=format, settings=settings).data)
+
+
+_ENCODERS: dict[str, type[PillowEncoder] | type[OpenCVEncoder]] = {
+    "pillow": PillowEncoder,
+    "opencv": OpenCVEncoder,
+}
+
+
+def get_encoder(name: str | None = None) -> ImageEncoder:
+    backend = (name or get_settings().z_image_codec_backend).strip().lower()
+    encoder_cls = _ENCODERS.get(backend)
+    if encoder_cls is None:
+        raise ValueError(f"Unknown codec backend '{backend}'. Valid options: {', '.join(_ENCODERS)}")
+    return encoder_cls()
+
+
+@lru_cache(maxsize=1)
+def get_codec_settings() -> CodecSettings:
+    settings = get_settings()
+    return CodecSettings(
+        png_compress_level=settings.z_image_png_compress_level,
+        png_filter=settings.z_image_png_filter,
+        webp_quality=settings.z_image_webp_quality,
+        webp_method=settings.z_image_webp_method,
+        webp_lossless=settings.z_image_webp_lossless,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_codec_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=get_settings().z_image_codec_workers,
+        thread_name_prefix="z-image-codec",
+    )
+
+
+def encode_image(
+    image: object,
+    *,
+    format: str,
+    settings: CodecSettings | None = None,
+    encoder: ImageEncoder | None = None,
+) -> EncodedImage:
+    return (encoder or get_encoder()).encode(image, format=format, settings=settings or get_codec_settings())
+
+
+def prepare_source(image: object, encoder: ImageEncoder) -> object:
+    """
+    Convert `image` once to what `encoder` consumes, so several formats can
+    share the same source buffer.
+    """
+
+    if encoder.name == "pillow":
+        from PIL import Image
+
+        return image if isinstance(image, Image.Image) else Image.fromarray(as_uint8_rgb(image))
+    return as_uint8_rgb(image)
+
+
+def encode_image_to(
+    image: object,
+    fh: IO[bytes],
+    *,
+    format: str,
+    settings: CodecSettings | None = None,
+    encoder: ImageEncoder | None = None,
+) -> None:
+    (encoder or get_encoder()).encode_to(image, fh, format=format, settings=settings or get_codec_settings())
+
+
+def encode_formats(
+    image: object,
+    formats: Sequence[str],
+    *,
+    settings: CodecSettings | None = None,
+    encoder: ImageEncoder | None = None,
+    return_exceptions: bool = False,
+) -> dict[str, EncodedImage | Exception]:
+    """
+    Encode one image into several formats in parallel.
+
+    With `return_exceptions=True`, a failing format maps to its exception
+    instead of aborting the others (e.g. to fall back to PNG previews).
+    """
+
+    resolved_encoder = encoder or get_encoder()
+    resolved_settings = settings or get_codec_settings()
+
+    # Convert once up front so all formats share the same source buffer.
+    source = prepare_source(image, resolved_encoder)
+
+    executor = get_codec_executor()
+    futures: dict[str, Future[EncodedImage]] = {
+        fmt: executor.submit(resolved_encoder.encode, source, format=fmt, settings=resolved_settings)
+        for fmt in formats
+    }
+
+    results: dict[str, EncodedImage | Exception] = {}
+    for fmt, future in futures.items():
+        try:
+            results[fmt] = future.result()
+        except Exception as exc:
+            if not return_exceptions:
+                raise
+            results[fmt] = exc
+    return results
+
+
+__all__ = [
+    "CodecSettings",
+    "EncodedImage",
+    "ImageEncoder",
+    "OpenCVEncoder",
+    "PillowEncoder",
+    "as_uint8_rgb",
+    "encode_formats",
+    "encode_image",
+    "encode_image_to",
+    "get_codec_executor",
+    "get_codec_settings",
+    "get_encoder",
+    "prepare_source",
+]
@@ -0,0 +1,81 @@
+"""
+Tiny per-process metrics registry shared through Redis.
+
+Worker-side components (prompt cache, micro-batcher, DB writer, ...) keep
+their counters in-process. Since the API cannot see into worker processes,
+each component periodically publishes a JSON snapshot to the Redis hash
+`zimage:stats:<name>`, one field per "<hostname>:<pid>", and the API's
+/metrics/* endpoints read them back.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+from functools import lru_cache
+from typing import Any
+
+from .config import get_settings
+
+
+STATS_KEY_PREFIX = "zimage:stats:"
+
+_last_published: dict[str, float] = {}
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _get_redis() -> Any:
+    import redis
+
+    return redis.Redis.from_url(str(get_settings().redis_url))
+
+
+def process_label() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def publish_stats(name: str, payload: dict[str, Any], *, min_interval_seconds: float = 0.0) -> None:
+    """
+    Best-effort: store `payload` as this process's snapshot for `name`.
+
+    Calls within `min_interval_seconds` of the previous publish are skipped
+    so hot paths can call this unconditionally.
+    """
+
+    now = time.monotonic()
+    with _lock:
+        last = _last_published.get(name)
+        if last is not None and now - last < min_interval_seconds:
+            return
+        _last_published[name] = now
+
+    try:
+        _get_redis().hset(f"{STATS_KEY_PREFIX}{name}", process_label(), json.dumps(payload))
+    except Exception:
+        return
+
+
+def read_stats(name: str) -> dict[str, dict[str, Any]]:
+    """
+    Return the last published snapshot of `name` for every process.
+    """
+
+    raw = _get_redis().hgetall(f"{STATS_KEY_PREFIX}{name}")
+    stats: dict[str, dict[str, Any]] = {}
+    for key, value in raw.items():
+        try:
+            stats[key.decode("utf-8")] = json.loads(value)
+        except Exception:
+            continue
+    return stats
+
+
+__all__ = [
+    "process_label",
+    "publish_stats",
+    "read_stats",
+]
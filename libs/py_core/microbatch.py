@@ -0,0 +1,267 @@
+"""
+Worker-side dynamic micro-batching for single-image generation tasks.
+
+When Z_IMAGE_MICROBATCH_MAX_SIZE > 1 the worker runs Celery's `threads`
+pool (see apps/worker/main.py), so several `z_image.generate_image` tasks
+are delivered to the same process concurrently. Each task thread submits
+its request here; the first request for a given shape (width, height,
+steps, guidance, CFG options) is held for Z_IMAGE_MICROBATCH_WINDOW_MS
+while compatible requests join it, and the whole group then runs as one
+batched `generate_images()` call.
+
+Results and failures are handed back to every original task thread, so
+each Celery task and DB row still completes individually.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+
+from .config import get_settings
+from .metrics import publish_stats, read_stats
+from .z_image_pipeline import generate_image, generate_images
+
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int, object], None]
+
+
+@dataclass(frozen=True)
+class MicroBatchKey:
+    """
+    Requests are only merged when every field here matches.
+    """
+
+    height: int
+    width: int
+    num_inference_steps: int
+    guidance_scale: float
+    cfg_normalization: bool | None
+    cfg_truncation: float | None
+    max_sequence_length: int | None
+
+
+@dataclass
+class MicroBatchRequest:
+    prompt: str
+    negative_prompt: str | None
+    seed: int | None
+    callback: ProgressCallback | None = None
+    done: threading.Event = field(default_factory=threading.Event)
+    image: object | None = None
+    error: BaseException | None = None
+
+
+@dataclass
+class MicroBatcher:
+    """
+    Groups compatible requests arriving within `window_seconds`.
+
+    The thread that opens a group acts as its leader: it waits for the
+    window to elapse (or the group to fill up), runs the batch and
+    distributes results; the other threads block until their result is set.
+    """
+
+    max_batch_size: int
+    window_seconds: float
+    run_batch: Callable[[MicroBatchKey, list[MicroBatchRequest]], list[object]]
+    _cond: threading.Condition = field(default_factory=threading.Condition)
+    _open_groups: dict[MicroBatchKey, list[MicroBatchRequest]] = field(default_factory=dict)
+    _size_histogram: Counter[int] = field(default_factory=Counter)
+
+    def submit(self, key: MicroBatchKey, request: MicroBatchRequest) -> object:
+        with self._cond:
+            group = self._open_groups.get(key)
+            is_leader = group is None
+            if group is None:
+                group = [request]
+                self._open_groups[key] = group
+            else:
+                group.append(request)
+                if len(group) >= self.max_batch_size:
+                    # Close the group now so later arrivals open a new one.
+                    self._open_groups.pop(key, None)
+                    self._cond.notify_all()
+
+        if not is_leader:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+            return request.image
+
+        deadline = time.monotonic() + self.window_seconds
+        with self._cond:
+            while len(group) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._open_groups.get(key) is group:
+                self._open_groups.pop(key, None)
+
+        self._execute(key, group)
+
+        if request.error is not None:
+            raise request.error
+        return request.image
+
+    def _execute(self, key: MicroBatchKey, group: list[MicroBatchRequest]) -> None:
+        try:
+            images = self.run_batch(key, group)
+            for member, image in zip(group, images):
+                member.image = image
+        except BaseException as exc:  # noqa: BLE001 - re-raised in every member
+            for member in group:
+                member.error = exc
+        finally:
+            for member in group:
+                member.done.set()
+
+        with self._cond:
+            self._size_histogram[len(group)] += 1
+        logger.info("micro-batch executed: size=%d key=%s", len(group), key)
+        publish_microbatch_stats(self)
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            histogram = dict(sorted(self._size_histogram.items()))
+        batches = sum(histogram.values())
+        items = sum(size * count for size, count in histogram.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window_ms": int(self.window_seconds * 1000),
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": (items / batches) if batches else 0.0,
+            "size_histogram": {str(size): count for size, count in histogram.items()},
+        }
+
+
+def _run_micro_batch(key: MicroBatchKey, group: list[MicroBatchRequest]) -> list[object]:
+    callbacks = [member.callback for member in group if member.callback is not None]
+
+    def _fan_out_progress(step: int, timestep: int, latents: object) -> None:
+        for callback in callbacks:
+            try:
+                callback(step, timestep, latents)
+            except Exception:
+                # One task's progress reporting must not break the batch.
+                continue
+
+    return generate_images(
+        prompt=[member.prompt for member in group],
+        negative_prompt=[member.negative_prompt for member in group],
+        seeds=[member.seed for member in group],
+        height=key.height,
+        width=key.width,
+        num_inference_steps=key.num_inference_steps,
+        guidance_scale=key.guidance_scale,
+        cfg_normalization=key.cfg_normalization,
+        cfg_truncation=key.cfg_truncation,
+        max_sequence_length=key.max_sequence_length,
+        callback=_fan_out_progress if callbacks else None,
+        callback_steps=1,
+    )
+
+
+def is_microbatching_enabled() -> bool:
+    return get_settings().z_image_microbatch_max_size > 1
+
+
+@lru_cache(maxsize=1)
+def get_micro_batcher() -> MicroBatcher:
+    settings = get_settings()
+    return MicroBatcher(
+        max_batch_size=max(1, settings.z_image_microbatch_max_size),
+        window_seconds=max(0, settings.z_image_microbatch_window_ms) / 1000.0,
+        run_batch=_run_micro_batch,
+    )
+
+
+def generate_image_microbatched(
+    *,
+    prompt: str,
+    height: int,
+    width: int,
+    num_inference_steps: int,
+    guidance_scale: float,
+    seed: int | None,
+    negative_prompt: str | None,
+    cfg_normalization: bool | None,
+    cfg_truncation: float | None,
+    max_sequence_length: int | None,
+    callback: ProgressCallback | None = None,
+) -> object:
+    """
+    Drop-in replacement for `generate_image()` that joins a micro-batch
+    when micro-batching is enabled, and calls straight through otherwise.
+    """
+
+    if not is_microbatching_enabled():
+        return generate_image(
+            prompt=prompt,
+            height=height,
+            width=width,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            negative_prompt=negative_prompt,
+            cfg_normalization=cfg_normalization,
+            cfg_truncation=cfg_truncation,
+            max_sequence_length=max_sequence_length,
+            callback=callback,
+            callback_steps=1,
+        )
+
+    key = MicroBatchKey(
+        height=height,
+        width=width,
+        num_inference_steps=num_inference_steps,
+        guidance_scale=guidance_scale,
+        cfg_normalization=cfg_normalization,
+        cfg_truncation=cfg_truncation,
+        max_sequence_length=max_sequence_length,
+    )
+    request = MicroBatchRequest(
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        seed=seed,
+        callback=callback,
+    )
+    return get_micro_batcher().submit(key, request)
+
+
+def publish_microbatch_stats(batcher: MicroBatcher) -> None:
+    """
+    Best-effort: publish the achieved batch-size distribution so that the
+    API (GET /metrics/microbatch) can report it.
+    """
+
+    publish_stats("microbatch", batcher.stats())
+
+
+def read_microbatch_stats() -> dict[str, dict[str, Any]]:
+    """
+    Return the last published batch-size distribution for every worker.
+    """
+
+    return read_stats("microbatch")
+
+
+__all__ = [
+    "MicroBatchKey",
+    "MicroBatchRequest",
+    "MicroBatcher",
+    "generate_image_microbatched",
+    "get_micro_batcher",
+    "is_microbatching_enabled",
+    "read_microbatch_stats",
+]
@@ -0,0 +1,128 @@
+"""
+Background post-processing stage for generated images.
+
+After the pipeline returns, the remaining per-image work (PNG / WebP
+encoding, storage uploads and the DB success record) is CPU / I/O bound.
+Running it on a small thread pool lets the worker start the next
+generation while the previous outputs are still being written.
+
+Backpressure: at most Z_IMAGE_POSTPROCESS_MAX_PENDING jobs may be queued
+or running at once. `submit()` blocks once that limit is reached, so a
+fast GPU cannot pile up decoded images in RAM faster than they are
+written out.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import TypeVar
+
+from .config import get_settings
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class PostProcessor:
+    max_workers: int
+    max_pending: int
+    _executor: ThreadPoolExecutor | None = None
+    _slots: threading.BoundedSemaphore | None = None
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def _ensure_started(self) -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+        with self._lock:
+            if self._executor is None or self._slots is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, self.max_workers),
+                    thread_name_prefix="z-image-postprocess",
+                )
+                self._slots = threading.BoundedSemaphore(max(1, self.max_pending))
+            return self._executor, self._slots
+
+    def submit(self, fn: Callable[[], T]) -> Future[T]:
+        """
+        Queue `fn` on the pool, blocking while the pending limit is reached.
+        """
+
+        executor, slots = self._ensure_started()
+        slots.acquire()
+        try:
+            future = executor.submit(fn)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def shutdown(self, *, wait: bool = True) -> None:
+        """
+        Wait for all queued jobs so that no output is lost on worker exit.
+        """
+
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+            self._slots = None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def when_all_done(
+    futures: Sequence[Future[T]],
+    callback: Callable[[list[Future[T]]], None],
+) -> None:
+    """
+    Invoke `callback(futures)` once, after every future has finished
+    (successfully or not). Runs on whichever pool thread finishes last.
+    """
+
+    remaining = len(futures)
+    if remaining == 0:
+        callback([])
+        return
+
+    lock = threading.Lock()
+    ordered = list(futures)
+
+    def _on_done(_: Future[T]) -> None:
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            is_last = remaining == 0
+        if is_last:
+            callback(ordered)
+
+    for future in ordered:
+        future.add_done_callback(_on_done)
+
+
+def is_async_postprocess_enabled() -> bool:
+    return get_settings().z_image_postprocess_async
+
+
+@lru_cache(maxsize=1)
+def get_postprocessor() -> PostProcessor:
+    settings = get_settings()
+    return PostProcessor(
+        max_workers=settings.z_image_postprocess_workers,
+        max_pending=settings.z_image_postprocess_max_pending,
+    )
+
+
+def drain_postprocessing() -> None:
+    get_postprocessor().shutdown(wait=True)
+
+
+__all__ = [
+    "PostProcessor",
+    "drain_postprocessing",
+    "get_postprocessor",
+    "is_async_postprocess_enabled",
+    "when_all_done",
+]
@@ -0,0 +1,130 @@
+"""
+Multi-size preview pyramid for generated images.
+
+Besides the full-size WebP preview, the worker writes one downscaled WebP
+per width in Z_IMAGE_PREVIEW_WIDTHS next to it
+(`<date>/<time>_<id>_w256.webp`) and records them in
+`image_generation_tasks.preview_variants` as {"<width>": relative_path}.
+History responses then point at the smallest variant that fits the card
+instead of a 1-4 MP preview.
+
+Rows written before this existed have no variants; for them the API links
+`/generated-images/<preview>?w=<width>`, which resizes on demand (widths
+snap up to the configured set, so the resize cache stays bounded).
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable, Mapping, Sequence
+from concurrent.futures import Future
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, Optional
+
+from .config import get_settings
+from .image_codecs import EncodedImage, as_uint8_rgb, encode_image, get_codec_executor
+
+
+@lru_cache(maxsize=1)
+def get_preview_widths() -> tuple[int, ...]:
+    raw = get_settings().z_image_preview_widths
+    widths = {int(part) for part in raw.split(",") if part.strip().isdigit() and int(part) > 0}
+    return tuple(sorted(widths))
+
+
+def variant_relative_path(preview_relative_path: str, width: int) -> str:
+    stem = preview_relative_path.rsplit(".", 1)[0]
+    return f"{stem}_w{width}.webp"
+
+
+def snap_preview_width(width: int, widths: Optional[Sequence[int]] = None) -> Optional[int]:
+    """
+    Smallest configured width >= `width` (None when larger than all).
+    """
+
+    for candidate in widths if widths is not None else get_preview_widths():
+        if candidate >= width:
+            return candidate
+    return None
+
+
+def pick_preview_variant(variants: Mapping[str, Any], width: int) -> Optional[str]:
+    """
+    Relative path of the smallest recorded variant at least `width` wide.
+    """
+
+    fitting = sorted(int(key) for key in variants if str(key).isdigit() and int(key) >= width)
+    if not fitting:
+        return None
+    path = variants.get(str(fitting[0]))
+    return str(path) if path else None
+
+
+def _to_pil(image: object) -> Any:
+    from PIL import Image
+
+    return image if isinstance(image, Image.Image) else Image.fromarray(as_uint8_rgb(image))
+
+
+def resize_to_width(image: object, width: int) -> Any:
+    """
+    Downscale to `width` keeping the aspect ratio (never upscales).
+    """
+
+    from PIL import Image
+
+    pil_image = _to_pil(image)
+    if pil_image.width <= width:
+        return pil_image
+    height = max(1, round(pil_image.height * width / pil_image.width))
+    # reducing_gap: a cheap box reduce first, then Lanczos on the remainder.
+    return pil_image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def encode_preview_variants(
+    image: object,
+    widths: Optional[Iterable[int]] = None,
+) -> dict[int, EncodedImage | Exception]:
+    """
+    Resize + WebP-encode one variant per width narrower than the image, in
+    parallel on the codec pool. A failing width maps to its exception.
+    """
+
+    pil_image = _to_pil(image)
+    executor = get_codec_executor()
+    futures: dict[int, Future[EncodedImage]] = {
+        width: executor.submit(lambda w: encode_image(resize_to_width(pil_image, w), format="webp"), width)
+        for width in (widths if widths is not None else get_preview_widths())
+        if width < pil_image.width
+    }
+
+    results: dict[int, EncodedImage | Exception] = {}
+    for width, future in futures.items():
+        try:
+            results[width] = future.result()
+        except Exception as exc:
+            results[width] = exc
+    return results
+
+
+def resize_encoded(data: bytes, width: int) -> EncodedImage:
+    """
+    Decode a stored image and return it as a WebP at most `width` wide.
+    """
+
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as source:
+        resized = resize_to_width(source.convert("RGB"), width)
+    return encode_image(resized, format="webp")
+
+
+__all__ = [
+    "encode_preview_variants",
+    "get_preview_widths",
+    "pick_preview_variant",
+    "resize_encoded",
+    "resize_to_width",
+    "snap_preview_width",
+    "variant_relative_path",
+]
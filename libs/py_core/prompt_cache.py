@@ -0,0 +1,302 @@
+"""
+Prompt-embedding cache for the Z-Image text encoder.
+
+Re-rolling the same prompt with new seeds is by far the most common usage
+pattern, so the (prompt, negative_prompt) encodings produced by the Qwen3
+text encoder are cached and passed to the pipeline as `prompt_embeds` /
+`negative_prompt_embeds` instead of the raw strings.
+
+Two tiers are used:
+  - an in-process LRU bounded by the total tensor size in bytes;
+  - an optional shared Redis tier so that one worker's encodings can be
+    reused by the other workers.
+
+Like `z_image_pipeline`, this module never imports torch at import time.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
+from functools import lru_cache
+from io import BytesIO
+from typing import Any
+
+from .config import get_settings
+from .metrics import publish_stats, read_stats
+
+
+REDIS_KEY_PREFIX = "zimage:prompt_embeds:"
+
+
+@dataclass(frozen=True)
+class PromptCacheKey:
+    prompt: str
+    # None means "classifier-free guidance disabled", i.e. no negative
+    # embedding is needed. An empty string is a real (encoded) negative prompt.
+    negative_prompt: str | None
+    max_sequence_length: int
+    model_revision: str
+
+    def digest(self) -> str:
+        raw = "\x1f".join(
+            [
+                self.model_revision,
+                str(self.max_sequence_length),
+                "\x00" if self.negative_prompt is None else "\x01" + self.negative_prompt,
+                self.prompt,
+            ]
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class PromptEmbeddings:
+    # Lists of per-prompt tensors, exactly as returned by
+    # ZImagePipeline.encode_prompt (variable sequence length per prompt).
+    prompt_embeds: list[Any]
+    negative_prompt_embeds: list[Any]
+    nbytes: int = 0
+
+    @classmethod
+    def from_tensors(cls, prompt_embeds: Sequence[Any], negative_prompt_embeds: Sequence[Any]) -> PromptEmbeddings:
+        prompt_list = list(prompt_embeds)
+        negative_list = list(negative_prompt_embeds)
+        nbytes = sum(_tensor_nbytes(t) for t in prompt_list + negative_list)
+        return cls(prompt_embeds=prompt_list, negative_prompt_embeds=negative_list, nbytes=nbytes)
+
+    def to(self, device: object) -> PromptEmbeddings:
+        return PromptEmbeddings(
+            prompt_embeds=[t.to(device) for t in self.prompt_embeds],
+            negative_prompt_embeds=[t.to(device) for t in self.negative_prompt_embeds],
+            nbytes=self.nbytes,
+        )
+
+
+def _tensor_nbytes(tensor: Any) -> int:
+    try:
+        return int(tensor.numel()) * int(tensor.element_size())
+    except Exception:  # pragma: no cover - defensive
+        return 0
+
+
+@dataclass
+class PromptCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    shared_hits: int = 0
+    shared_misses: int = 0
+    shared_errors: int = 0
+    entries: int = 0
+    bytes: int = 0
+    max_bytes: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return dict(self.__dict__)
+
+
+@dataclass
+class PromptEmbeddingCache:
+    """
+    Byte-bounded LRU of prompt embeddings with an optional Redis tier.
+
+    Entries are kept on CPU so that the cache does not compete with the
+    transformer for VRAM; callers move them to the execution device.
+    """
+
+    max_bytes: int
+    redis_url: str | None = None
+    redis_ttl_seconds: int = 24 * 60 * 60
+    _entries: OrderedDict[str, PromptEmbeddings] = field(default_factory=OrderedDict)
+    _stats: PromptCacheStats = field(default_factory=PromptCacheStats)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+    _redis: Any = None
+
+    def _get_redis(self) -> Any:
+        if not self.redis_url:
+            return None
+        if self._redis is None:
+            import redis
+
+            self._redis = redis.Redis.from_url(self.redis_url)
+        return self._redis
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            self._stats.entries = len(self._entries)
+            self._stats.max_bytes = self.max_bytes
+            return self._stats.as_dict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.bytes = 0
+
+    def _get_local(self, digest: str) -> PromptEmbeddings | None:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            self._entries.move_to_end(digest)
+            self._stats.hits += 1
+            return entry
+
+    def _put_local(self, digest: str, entry: PromptEmbeddings) -> None:
+        if entry.nbytes > self.max_bytes:
+            # Larger than the whole budget: never cache, never evict for it.
+            return
+
+        with self._lock:
+            previous = self._entries.pop(digest, None)
+            if previous is not None:
+                self._stats.bytes -= previous.nbytes
+            self._entries[digest] = entry
+            self._stats.bytes += entry.nbytes
+
+            while self._stats.bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._stats.bytes -= evicted.nbytes
+                self._stats.evictions += 1
+
+    def _get_shared(self, digest: str) -> PromptEmbeddings | None:
+        client = self._get_redis()
+        if client is None:
+            return None
+
+        try:
+            raw = client.get(f"{REDIS_KEY_PREFIX}{digest}")
+        except Exception:
+            # The shared tier is an optimization only; never fail generation.
+            with self._lock:
+                self._stats.shared_errors += 1
+            return None
+
+        if raw is None:
+            with self._lock:
+                self._stats.shared_misses += 1
+            return None
+
+        try:
+            import torch  # type: ignore[import-not-found]
+
+            payload = torch.load(BytesIO(raw), map_location="cpu", weights_only=True)
+            entry = PromptEmbeddings.from_tensors(payload["prompt_embeds"], payload["negative_prompt_embeds"])
+        except Exception:
+            with self._lock:
+                self._stats.shared_errors += 1
+            return None
+
+        with self._lock:
+            self._stats.shared_hits += 1
+        return entry
+
+    def _put_shared(self, digest: str, entry: PromptEmbeddings) -> None:
+        client = self._get_redis()
+        if client is None:
+            return
+
+        try:
+            import torch  # type: ignore[import-not-found]
+
+            buf = BytesIO()
+            torch.save(
+                {
+                    "prompt_embeds": entry.prompt_embeds,
+                    "negative_prompt_embeds": entry.negative_prompt_embeds,
+                },
+                buf,
+            )
+            client.setex(f"{REDIS_KEY_PREFIX}{digest}", self.redis_ttl_seconds, buf.getvalue())
+        except Exception:
+            with self._lock:
+                self._stats.shared_errors += 1
+
+    def get_or_encode(
+        self,
+        key: PromptCacheKey,
+        encode: Callable[[], tuple[Sequence[Any], Sequence[Any]]],
+    ) -> PromptEmbeddings:
+        """
+        Return cached embeddings for `key`, falling back to the shared tier
+        and finally to `encode()` (whose result is stored in both tiers).
+        """
+
+        digest = key.digest()
+
+        entry = self._get_local(digest)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            self._stats.misses += 1
+
+        entry = self._get_shared(digest)
+        if entry is None:
+            prompt_embeds, negative_prompt_embeds = encode()
+            entry = PromptEmbeddings.from_tensors(
+                [t.detach().to("cpu") for t in prompt_embeds],
+                [t.detach().to("cpu") for t in negative_prompt_embeds],
+            )
+            self._put_shared(digest, entry)
+
+        self._put_local(digest, entry)
+        return entry
+
+
+@lru_cache(maxsize=1)
+def get_prompt_embedding_cache() -> PromptEmbeddingCache:
+    """
+    Process-wide prompt embedding cache configured from shared settings.
+    """
+
+    settings = get_settings()
+    redis_url = str(settings.redis_url) if settings.z_image_prompt_cache_redis else None
+    return PromptEmbeddingCache(
+        max_bytes=max(0, settings.z_image_prompt_cache_max_bytes),
+        redis_url=redis_url,
+        redis_ttl_seconds=settings.z_image_prompt_cache_redis_ttl_seconds,
+    )
+
+
+def get_prompt_cache_stats() -> dict[str, int]:
+    """
+    Hit / miss / eviction counters for the current process, used to size
+    Z_IMAGE_PROMPT_CACHE_MAX_BYTES.
+    """
+
+    return get_prompt_embedding_cache().stats()
+
+
+def publish_prompt_cache_stats(*, min_interval_seconds: float = 5.0) -> None:
+    """
+    Best-effort: publish this process's counters so that the API
+    (GET /metrics/prompt-cache) can report them across all workers.
+
+    Called on every prompt encode, so publishes are throttled like the DB
+    stats; pass 0 to force one.
+    """
+
+    publish_stats("prompt_cache", get_prompt_cache_stats(), min_interval_seconds=min_interval_seconds)
+
+
+def read_prompt_cache_stats() -> dict[str, dict[str, int]]:
+    """
+    Return the last published counters for every worker process.
+    """
+
+    return read_stats("prompt_cache")
+
+
+__all__ = [
+    "PromptCacheKey",
+    "PromptEmbeddingCache",
+    "PromptEmbeddings",
+    "get_prompt_cache_stats",
+    "get_prompt_embedding_cache",
+    "publish_prompt_cache_stats",
+    "read_prompt_cache_stats",
+]
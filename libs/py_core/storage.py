@@ -1,35 +1,289 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from functools import lru_cache
+import abc
+import asyncio
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
 from io import BytesIO
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import IO, Iterable, Optional, Tuple
+from typing import IO, Any, Callable, Iterable, Optional, Protocol, Sequence, Tuple, TypeVar
 
 from .config import get_output_root, get_settings, is_s3_storage_enabled
+from .disk_cache import DiskCache
+from .image_codecs import encode_image
+
+
+T = TypeVar("T")
 
 
 class StorageConfigError(RuntimeError):
     pass
 
 
+class InvalidRangeError(ValueError):
+    """
+    The requested byte range lies outside the object (HTTP 416).
+    """
+
+
+@lru_cache(maxsize=1)
+def _get_io_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=get_settings().z_image_storage_io_concurrency,
+        thread_name_prefix="z-image-storage",
+    )
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface shared by LocalStorage and S3Storage.
+
+    Backends implement the blocking primitives (the abstract methods below;
+    a backend missing one fails at construction). `submit_*` run them on the
+    shared storage I/O pool (Z_IMAGE_STORAGE_IO_CONCURRENCY threads) and
+    return Futures, so e.g. the worker uploads all outputs of a task at
+    once; the `a*` coroutines await the same from asyncio code.
+
+    `put_stream` hands `write` a file object instead of taking a buffer:
+    locally a temp file renamed into place, on S3 a multipart upload fed in
+    S3_MULTIPART_CHUNK_BYTES parts. Either way the object only appears once
+    `write` returns, and is discarded if it raises.
+    """
+
+    @abc.abstractmethod
+    def put_bytes(self, *, relative_path: str, data: bytes | memoryview, content_type: str | None = None) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put_stream(
+        self, *, relative_path: str, write: Callable[[IO[bytes]], object], content_type: str | None = None
+    ) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_bytes(self, *, relative_path: str) -> bytes:
+        """
+        Raises FileNotFoundError when the object does not exist.
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, *, relative_path: str) -> None:
+        """
+        Remove the object; a missing object is not an error.
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def exists(self, *, relative_path: str) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def move(self, *, source_path: str, target_path: str) -> bool:
+        """
+        Move an object within the backend; False when `source_path` does
+        not exist (e.g. already moved).
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_relative_paths(self) -> Iterable[str]:
+        """
+        Relative paths of all stored objects.
+        """
+
+        raise NotImplementedError
+
+    def _submit(self, fn: Callable[..., T], **kwargs: Any) -> Future[T]:
+        return _get_io_executor().submit(fn, **kwargs)
+
+    def submit_put(
+        self, *, relative_path: str, data: bytes | memoryview, content_type: str | None = None
+    ) -> Future[str]:
+        return self._submit(self.put_bytes, relative_path=relative_path, data=data, content_type=content_type)
+
+    def submit_put_stream(
+        self, *, relative_path: str, write: Callable[[IO[bytes]], object], content_type: str | None = None
+    ) -> Future[str]:
+        return self._submit(self.put_stream, relative_path=relative_path, write=write, content_type=content_type)
+
+    def submit_get(self, *, relative_path: str) -> Future[bytes]:
+        return self._submit(self.get_bytes, relative_path=relative_path)
+
+    def submit_delete(self, *, relative_path: str) -> Future[None]:
+        return self._submit(self.delete, relative_path=relative_path)
+
+    def submit_exists(self, *, relative_path: str) -> Future[bool]:
+        return self._submit(self.exists, relative_path=relative_path)
+
+    async def aput(self, *, relative_path: str, data: bytes | memoryview, content_type: str | None = None) -> str:
+        return await asyncio.wrap_future(
+            self.submit_put(relative_path=relative_path, data=data, content_type=content_type)
+        )
+
+    async def aget(self, *, relative_path: str) -> bytes:
+        return await asyncio.wrap_future(self.submit_get(relative_path=relative_path))
+
+    async def adelete(self, *, relative_path: str) -> None:
+        await asyncio.wrap_future(self.submit_delete(relative_path=relative_path))
+
+    async def aexists(self, *, relative_path: str) -> bool:
+        return await asyncio.wrap_future(self.submit_exists(relative_path=relative_path))
+
+
 @dataclass(frozen=True)
-class LocalStorage:
+class LocalStorage(StorageBackend):
     root: Path
 
-    def put_bytes(self, *, relative_path: str, data: bytes, content_type: str | None = None) -> str:
-        rel = relative_path.lstrip("/")
-        full_path = (self.root / rel).resolve()
+    def _path(self, relative_path: str) -> Path:
+        return (self.root / relative_path.lstrip("/")).resolve()
+
+    def put_bytes(self, *, relative_path: str, data: bytes | memoryview, content_type: str | None = None) -> str:
+        full_path = self._path(relative_path)
         full_path.parent.mkdir(parents=True, exist_ok=True)
         full_path.write_bytes(data)
         return str(full_path)
 
+    def put_stream(
+        self, *, relative_path: str, write: Callable[[IO[bytes]], object], content_type: str | None = None
+    ) -> str:
+        full_path = self._path(relative_path)
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=full_path.parent, prefix=".tmp-")
+        try:
+            # mkstemp creates 0600 files; outputs must stay readable by e.g.
+            # the X-Accel-Redirect proxy, like those written by put_bytes.
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "wb") as fh:
+                write(fh)
+            os.replace(tmp_name, full_path)
+        except BaseException:
+            with suppress(OSError):
+                os.unlink(tmp_name)
+            raise
+        return str(full_path)
+
+    def get_bytes(self, *, relative_path: str) -> bytes:
+        return self._path(relative_path).read_bytes()
+
+    def delete(self, *, relative_path: str) -> None:
+        self._path(relative_path).unlink(missing_ok=True)
+
+    def exists(self, *, relative_path: str) -> bool:
+        return self._path(relative_path).is_file()
+
+    def move(self, *, source_path: str, target_path: str) -> bool:
+        target = self._path(target_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(self._path(source_path), target)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def iter_relative_paths(self) -> Iterable[str]:
+        root = self.root.resolve()
+        for path in root.rglob("*"):
+            # Skip leftovers of interrupted streaming writes (".tmp-*").
+            if path.is_file() and not path.name.startswith(".tmp-"):
+                yield path.relative_to(root).as_posix()
+
+
+class _S3StreamWriter(io.RawIOBase):
+    """
+    Write-only file object that uploads to S3 in `part_bytes` parts.
+
+    At most one part is buffered. An object that never fills a part is
+    sent with a single PutObject on `commit()`.
+    """
+
+    def __init__(self, client: Any, *, bucket: str, key: str, content_type: str, part_bytes: int) -> None:
+        super().__init__()
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._content_type = content_type
+        self._part_bytes = part_bytes
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: list[dict[str, Any]] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        view = memoryview(data).cast("B")
+        size = view.nbytes
+        while view.nbytes:
+            take = min(self._part_bytes - len(self._buffer), view.nbytes)
+            self._buffer += view[:take]
+            view = view[take:]
+            if len(self._buffer) >= self._part_bytes:
+                self._upload_part()
+        return size
+
+    def _upload_part(self) -> None:
+        if self._upload_id is None:
+            created = self._client.create_multipart_upload(
+                Bucket=self._bucket, Key=self._key, ContentType=self._content_type
+            )
+            self._upload_id = created["UploadId"]
+        part_number = len(self._parts) + 1
+        response = self._client.upload_part(
+            Bucket=self._bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=self._buffer,
+        )
+        self._parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        self._buffer = bytearray()
+
+    def commit(self) -> None:
+        if self._upload_id is None:
+            self._client.put_object(
+                Bucket=self._bucket, Key=self._key, Body=self._buffer, ContentType=self._content_type
+            )
+        else:
+            # The last part may be smaller than the minimum part size.
+            if self._buffer:
+                self._upload_part()
+            self._client.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        self._buffer = bytearray()
+        self.close()
+
+    def abort(self) -> None:
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            # Best effort; a bucket lifecycle rule should clean up leftovers.
+            with suppress(Exception):
+                self._client.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+        self.close()
+
 
 @dataclass(frozen=True)
 class S3Object:
     body: IO[bytes]
     content_type: Optional[str]
     content_length: Optional[int]
+    # "bytes <start>-<end>/<size>" when only a range was fetched.
+    content_range: Optional[str] = None
 
     def iter_chunks(self, chunk_size: int = 1024 * 1024) -> Iterable[bytes]:
         read = getattr(self.body, "read", None)
@@ -44,14 +298,82 @@ class S3Object:
             yield chunk
 
 
+@dataclass
+class PresignedUrlCache:
+    """
+    Thread-safe LRU of object key -> (presigned URL, reuse-until).
+
+    Signing is local CPU work, but handing out the same URL for as long as
+    it stays valid also lets browsers cache the image under a stable URL.
+    """
+
+    max_entries: int = 50_000
+    _entries: OrderedDict[str, tuple[str, float]] = field(default_factory=OrderedDict)
+    _hits: int = 0
+    _misses: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def peek(self, key: str) -> Optional[tuple[str, float]]:
+        """
+        Cached (url, reuse seconds) for `key` without signing on a miss.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0], entry[1] - now
+
+    def get_or_sign(self, key: str, *, reuse_seconds: float, sign: Callable[[], str]) -> tuple[str, float]:
+        """
+        Returns (url, seconds the URL may still be reused).
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0], entry[1] - now
+            self._misses += 1
+
+        url = sign()
+        if reuse_seconds > 0:
+            with self._lock:
+                self._entries[key] = (url, now + reuse_seconds)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return url, reuse_seconds
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "entries": len(self._entries)}
+
+
+_presigned_url_cache = PresignedUrlCache()
+
+
 @dataclass(frozen=True)
-class S3Storage:
+class S3Storage(StorageBackend):
     endpoint: str
     access_key: str
     secret_key: str
     bucket: str
     region: str
     prefix: str
+    public_endpoint: Optional[str] = None
+    presign_expiry_seconds: int = 3600
+    presign_refresh_margin_seconds: int = 300
+    # Objects at least this large go through a multipart upload with
+    # `multipart_concurrency` parts in flight.
+    multipart_threshold_bytes: int = 16 * 1024 * 1024
+    multipart_chunk_bytes: int = 8 * 1024 * 1024
+    multipart_concurrency: int = 4
 
     def _key_for_relative_path(self, relative_path: str) -> str:
         rel = relative_path.lstrip("/")
@@ -69,20 +391,114 @@ class S3Storage:
             region=self.region,
         )
 
-    def put_bytes(self, *, relative_path: str, data: bytes, content_type: str | None = None) -> str:
+    def _transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold_bytes,
+            multipart_chunksize=self.multipart_chunk_bytes,
+            max_concurrency=self.multipart_concurrency,
+        )
+
+    def put_bytes(self, *, relative_path: str, data: bytes | memoryview, content_type: str | None = None) -> str:
         key = self._key_for_relative_path(relative_path)
-        self.client.put_object(
-            Bucket=self.bucket,
-            Key=key,
-            Body=data,
-            ContentType=content_type or "application/octet-stream",
+        size = len(data) if isinstance(data, bytes) else data.nbytes
+        if size >= self.multipart_threshold_bytes:
+            self.client.upload_fileobj(
+                BytesIO(data),
+                self.bucket,
+                key,
+                ExtraArgs={"ContentType": content_type or "application/octet-stream"},
+                Config=self._transfer_config(),
+            )
+        else:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                # botocore only accepts bytes / file objects as the body.
+                Body=data if isinstance(data, bytes) else bytes(data),
+                ContentType=content_type or "application/octet-stream",
+            )
+        return f"s3://{self.bucket}/{key}"
+
+    def put_stream(
+        self, *, relative_path: str, write: Callable[[IO[bytes]], object], content_type: str | None = None
+    ) -> str:
+        key = self._key_for_relative_path(relative_path)
+        writer = _S3StreamWriter(
+            self.client,
+            bucket=self.bucket,
+            key=key,
+            content_type=content_type or "application/octet-stream",
+            part_bytes=self.multipart_chunk_bytes,
         )
+        try:
+            write(writer)  # type: ignore[arg-type]
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
         return f"s3://{self.bucket}/{key}"
 
-    def get_object(self, *, relative_path: str) -> S3Object:
+    def get_bytes(self, *, relative_path: str) -> bytes:
+        return b"".join(self.get_object(relative_path=relative_path).iter_chunks())
+
+    def delete(self, *, relative_path: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key_for_relative_path(relative_path))
+
+    def move(self, *, source_path: str, target_path: str) -> bool:
+        # S3 has no rename: server-side copy, then delete the source.
+        source_key = self._key_for_relative_path(source_path)
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=self._key_for_relative_path(target_path),
+                CopySource={"Bucket": self.bucket, "Key": source_key},
+            )
+        except Exception as exc:  # pragma: no cover - depends on botocore
+            from botocore.exceptions import ClientError
+
+            if isinstance(exc, ClientError):
+                code = str(exc.response.get("Error", {}).get("Code", ""))
+                if code in {"NoSuchKey", "404", "NotFound"}:
+                    return False
+            raise
+        self.client.delete_object(Bucket=self.bucket, Key=source_key)
+        return True
+
+    def iter_relative_paths(self) -> Iterable[str]:
+        prefix = self.prefix.strip().strip("/")
+        list_prefix = f"{prefix}/" if prefix else ""
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=list_prefix):
+            for item in page.get("Contents", []):
+                yield str(item["Key"])[len(list_prefix) :]
+
+    def exists(self, *, relative_path: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key_for_relative_path(relative_path))
+        except Exception as exc:  # pragma: no cover - depends on botocore
+            from botocore.exceptions import ClientError
+
+            if isinstance(exc, ClientError):
+                code = str(exc.response.get("Error", {}).get("Code", ""))
+                if code in {"NoSuchKey", "404", "NotFound"}:
+                    return False
+            raise
+        return True
+
+    def get_object(self, *, relative_path: str, byte_range: Optional[str] = None) -> S3Object:
+        """
+        `byte_range` is an HTTP Range value (e.g. "bytes=0-1023") passed
+        through to S3.
+        """
+
         key = self._key_for_relative_path(relative_path)
+        params = {"Bucket": self.bucket, "Key": key}
+        if byte_range:
+            params["Range"] = byte_range
         try:
-            resp = self.client.get_object(Bucket=self.bucket, Key=key)
+            resp = self.client.get_object(**params)
         except Exception as exc:  # pragma: no cover - depends on botocore
             # Defer import and error classification to keep local mode lightweight.
             from botocore.exceptions import ClientError
@@ -91,6 +507,8 @@ class S3Storage:
                 code = str(exc.response.get("Error", {}).get("Code", ""))
                 if code in {"NoSuchKey", "404", "NotFound"}:
                     raise FileNotFoundError(relative_path) from exc
+                if code in {"InvalidRange", "416"}:
+                    raise InvalidRangeError(byte_range) from exc
             raise
 
         body = resp.get("Body")
@@ -99,16 +517,164 @@ class S3Storage:
 
         content_type = resp.get("ContentType")
         content_length = resp.get("ContentLength")
-        return S3Object(body=body, content_type=content_type, content_length=content_length)
+        return S3Object(
+            body=body,
+            content_type=content_type,
+            content_length=content_length,
+            content_range=resp.get("ContentRange"),
+        )
+
+    @property
+    def presign_client(self):
+        # The signature covers the host, so URLs handed to browsers must be
+        # signed for the endpoint they will actually request.
+        if not self.public_endpoint:
+            return self.client
+        return _get_s3_client(
+            endpoint=self.public_endpoint,
+            access_key=self.access_key,
+            secret_key=self.secret_key,
+            region=self.region,
+        )
 
     def generate_presigned_get_url(self, *, relative_path: str, expires_in: int) -> str:
         key = self._key_for_relative_path(relative_path)
-        return self.client.generate_presigned_url(
+        return self.presign_client.generate_presigned_url(
             ClientMethod="get_object",
             Params={"Bucket": self.bucket, "Key": key},
             ExpiresIn=expires_in,
         )
 
+    def presigned_get_url(self, *, relative_path: str) -> tuple[str, int]:
+        """
+        Cached presigned GET URL for `relative_path`, plus how many seconds
+        it can still be handed out (valid for at least the refresh margin
+        longer than that).
+        """
+
+        expires_in = self.presign_expiry_seconds
+        reuse_seconds = max(expires_in - self.presign_refresh_margin_seconds, 0)
+        url, remaining = _presigned_url_cache.get_or_sign(
+            f"{self.public_endpoint or self.endpoint}|{self.bucket}|{self._key_for_relative_path(relative_path)}",
+            reuse_seconds=reuse_seconds,
+            sign=lambda: self.generate_presigned_get_url(relative_path=relative_path, expires_in=expires_in),
+        )
+        return url, int(remaining)
+
+    def presigned_get_url_for_existing(
+        self, *, relative_paths: Sequence[str], lookup: bool = True
+    ) -> Optional[tuple[str, int]]:
+        """
+        `presigned_get_url` for the first of `relative_paths` that exists in
+        the bucket (None when none does). The lookup is cached with the URL,
+        so the HEAD requests only happen when it is re-signed; with
+        `lookup=False` only an already cached URL is returned.
+        """
+
+        cache_key = f"{self.public_endpoint or self.endpoint}|{self.bucket}|?{self._key_for_relative_path(relative_paths[0])}"
+        cached = _presigned_url_cache.peek(cache_key)
+        if cached is not None:
+            return cached[0], int(cached[1])
+        if not lookup:
+            return None
+
+        found = next((path for path in relative_paths if self.exists(relative_path=path)), None)
+        if found is None:
+            return None
+        expires_in = self.presign_expiry_seconds
+        url, remaining = _presigned_url_cache.get_or_sign(
+            cache_key,
+            reuse_seconds=max(expires_in - self.presign_refresh_margin_seconds, 0),
+            sign=lambda: self.generate_presigned_get_url(relative_path=found, expires_in=expires_in),
+        )
+        return url, int(remaining)
+
+
+class ObjectSource(Protocol):
+    def get_object(self, *, relative_path: str) -> S3Object:
+        ...
+
+
+@dataclass
+class S3ReadCache:
+    """
+    Local read-through disk tier in front of S3 for the image-serving path.
+
+    Objects are immutable (unique file names), so a cached copy never goes
+    stale. A miss streams the object into the DiskCache (temp file +
+    rename, byte-bounded LRU); concurrent misses for the same path in this
+    process wait for the one in-flight fetch instead of each calling S3.
+    `source` is anything with `get_object(relative_path=...)` (an
+    S3Storage, or a local stand-in).
+    """
+
+    source: ObjectSource
+    disk: DiskCache
+    _inflight: dict[str, Future[Path]] = field(default_factory=dict)
+    _coalesced: int = 0
+    _bytes_saved: int = 0
+    _bytes_fetched: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def fetch(self, relative_path: str) -> Path:
+        """
+        Local path of the object's bytes; FileNotFoundError if S3 has none.
+        """
+
+        key = relative_path.lstrip("/")
+        path = self.disk.get(key)
+        if path is not None:
+            return self._served_locally(path)
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if future is None:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self._coalesced += 1
+        if not leader:
+            return self._served_locally(future.result())
+
+        try:
+            obj = self.source.get_object(relative_path=key)
+            path = self.disk.put(key, obj.iter_chunks())
+            size = path.stat().st_size
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(path)
+            with self._lock:
+                self._bytes_fetched += size
+            return path
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _served_locally(self, path: Path) -> Path:
+        try:
+            size = path.stat().st_size
+        except OSError:
+            size = 0
+        with self._lock:
+            self._bytes_saved += size
+        return path
+
+    def stats(self) -> dict[str, float]:
+        disk = self.disk.stats()
+        with self._lock:
+            lookups = disk["hits"] + disk["misses"]
+            return {
+                **disk,
+                "coalesced": self._coalesced,
+                # Share of requests that did not need their own S3 GET.
+                "hit_ratio": round((disk["hits"] + self._coalesced) / lookups, 4) if lookups else 0.0,
+                "bytes_saved": self._bytes_saved,
+                "bytes_fetched": self._bytes_fetched,
+            }
+
 
 def get_storage() -> LocalStorage | S3Storage:
     if is_s3_storage_enabled():
@@ -144,23 +710,48 @@ def get_s3_storage() -> S3Storage:
         bucket=bucket,
         region=settings.s3_region,
         prefix=settings.s3_prefix,
+        public_endpoint=(settings.s3_public_endpoint or "").strip() or None,
+        presign_expiry_seconds=settings.s3_presign_expiry_seconds,
+        presign_refresh_margin_seconds=settings.s3_presign_refresh_margin_seconds,
+        multipart_threshold_bytes=settings.s3_multipart_threshold_bytes,
+        multipart_chunk_bytes=settings.s3_multipart_chunk_bytes,
+        multipart_concurrency=settings.s3_multipart_concurrency,
+    )
+
+
+def get_presigned_url_cache_stats() -> dict[str, int]:
+    return _presigned_url_cache.stats()
+
+
+@lru_cache(maxsize=1)
+def get_s3_read_cache() -> Optional[S3ReadCache]:
+    """
+    The process-wide S3 read cache, or None when S3 is not the backend or
+    Z_IMAGE_S3_CACHE_MAX_BYTES is 0.
+    """
+
+    settings = get_settings()
+    if not is_s3_storage_enabled() or settings.z_image_s3_cache_max_bytes <= 0:
+        return None
+    return S3ReadCache(
+        source=get_s3_storage(),
+        disk=DiskCache(root=settings.z_image_s3_cache_dir.resolve(), max_bytes=settings.z_image_s3_cache_max_bytes),
     )
 
 
 def encode_image_bytes(*, image, format: str) -> Tuple[bytes, str]:
-    buf = BytesIO()
-    image.save(buf, format=format)
-    data = buf.getvalue()
+    """
+    Compatibility wrapper around `image_codecs.encode_image` for callers
+    that need a plain bytes object.
+    """
 
-    fmt = format.strip().lower()
-    if fmt == "png":
-        return data, "image/png"
-    if fmt == "webp":
-        return data, "image/webp"
-    return data, "application/octet-stream"
+    encoded = encode_image(image, format=format)
+    return bytes(encoded.data), encoded.content_type
 
 
-@lru_cache(maxsize=1)
+# One client per endpoint: the upload client and `presign_client`
+# (S3_PUBLIC_ENDPOINT) must not evict each other.
+@lru_cache(maxsize=None)
 def _get_s3_client(*, endpoint: str, access_key: str, secret_key: str, region: str):
     try:
         import boto3
@@ -170,7 +761,14 @@ def _get_s3_client(*, endpoint: str, access_key: str, secret_key: str, region: s
             "boto3 is required for Z_IMAGE_STORAGE_BACKEND=s3; add it to your app dependencies and run uv sync"
         ) from exc
 
-    config = Config(signature_version="s3v4", s3={"addressing_style": "path"})
+    # One client per process is shared by all threads; size its connection
+    # pool for the storage I/O pool plus multipart parts in flight.
+    config = Config(
+        signature_version="s3v4",
+        s3={"addressing_style": "path"},
+        max_pool_connections=get_settings().s3_max_pool_connections,
+        tcp_keepalive=True,
+    )
     return boto3.client(
         "s3",
         endpoint_url=endpoint,
@@ -0,0 +1,86 @@
+"""
+Storage key layout for generated images.
+
+Two layouts are supported (Z_IMAGE_STORAGE_KEY_LAYOUT):
+
+- "date" (legacy default): `YYYYMMDD/HHMMSS_<image_id>.png`. All of a
+  day's writes land in one directory / S3 prefix.
+- "sharded": `<aa>/<bb>/<image_id>.png`, where the levels are hex digits
+  of a hash of the image_id (Z_IMAGE_STORAGE_SHARD_LEVELS), so writes
+  spread evenly. Listing by date goes through the DB (`created_at`).
+
+WebP previews and preview variants share the PNG's stem in both layouts.
+
+Rows written under the date layout keep their paths. `candidate_paths()`
+maps such a path to its sharded location, so `/generated-images/...`
+finds the object both before and after
+`scripts/migrate_storage_layout.py` moved it.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+from datetime import datetime
+from typing import Optional
+
+from .config import get_settings
+
+
+# `YYYYMMDD/HHMMSS_<image_id>[_w<width>].<ext>`
+_DATE_PATH_RE = re.compile(
+    r"^(?P<date>\d{8})/(?P<time>\d{6})_(?P<image_id>[0-9a-f]{32})(?P<suffix>_w\d+)?\.(?P<ext>\w+)$"
+)
+
+
+def is_sharded_layout() -> bool:
+    return get_settings().z_image_storage_key_layout.strip().lower() == "sharded"
+
+
+def shard_prefix(image_id: str, levels: Optional[int] = None) -> str:
+    levels = levels if levels is not None else get_settings().z_image_storage_shard_levels
+    digest = hashlib.blake2b(image_id.encode("utf-8"), digest_size=8).hexdigest()
+    return "/".join(digest[i * 2 : i * 2 + 2] for i in range(levels))
+
+
+def output_stem(image_id: str, now: datetime) -> str:
+    """
+    Relative path of a new output without its extension.
+    """
+
+    if is_sharded_layout():
+        return f"{shard_prefix(image_id)}/{image_id}"
+    return f"{now.strftime('%Y%m%d')}/{now.strftime('%H%M%S')}_{image_id}"
+
+
+def sharded_path_for(relative_path: str) -> Optional[str]:
+    """
+    Sharded equivalent of a date-layout path (None for anything else).
+    """
+
+    match = _DATE_PATH_RE.match(relative_path.lstrip("/"))
+    if match is None:
+        return None
+    return f"{shard_prefix(match['image_id'])}/{match['image_id']}{match['suffix'] or ''}.{match['ext']}"
+
+
+def candidate_paths(relative_path: str) -> list[str]:
+    """
+    Locations to try for `relative_path`, most likely first: under the
+    sharded layout a date-layout path has probably been migrated.
+    """
+
+    relative_path = relative_path.lstrip("/")
+    sharded = sharded_path_for(relative_path)
+    if sharded is None:
+        return [relative_path]
+    return [sharded, relative_path] if is_sharded_layout() else [relative_path, sharded]
+
+
+__all__ = [
+    "candidate_paths",
+    "is_sharded_layout",
+    "output_stem",
+    "shard_prefix",
+    "sharded_path_for",
+]
@@ -2,16 +2,48 @@ from __future__ import annotations
 
 import json
 import uuid
+from collections.abc import Callable
+from concurrent.futures import Future
 from datetime import datetime, timezone
+from typing import NoReturn, TypedDict, TypeVar
+
+from celery import states
+from celery.exceptions import Ignore
+
 from .celery_app import celery_app
 from .db import (
+    mark_generations_running,
     record_generation_failed,
     record_generation_started,
     record_generation_succeeded,
 )
-from .storage import encode_image_bytes, get_storage
-from .z_image_pipeline import ZImageNotAvailable, generate_image
-from .types import GenerationResult, JSONDict
+from .events import (
+    ProgressReporter,
+    batch_position,
+    history_owner,
+    publish_task_event,
+    publish_task_failed,
+    publish_task_succeeded,
+)
+from .microbatch import generate_image_microbatched
+from .postprocess import get_postprocessor, is_async_postprocess_enabled, when_all_done
+from .image_codecs import CONTENT_TYPES, get_codec_executor, get_codec_settings, get_encoder, prepare_source
+from .previews import encode_preview_variants, variant_relative_path
+from .storage import get_storage
+from .storage_keys import output_stem
+from .z_image_pipeline import ZImageNotAvailable, generate_images
+from .types import BatchGenerationResult, BatchItemError, GenerationResult, JSONDict
+
+
+T = TypeVar("T")
+
+
+class _OutputPaths(TypedDict):
+    output_path: str
+    relative_path: str
+    preview_output_path: str
+    preview_relative_path: str
+    preview_variants: dict[str, str]
 
 
 def _serialize_generation_error(code: str, hint: str, detail: str | None = None) -> str:
@@ -50,6 +82,167 @@ def _classify_generation_exception(exc: Exception) -> tuple[str, str]:
     return "internal_error", "生成过程中出现未知异常，请稍后重试。"
 
 
+def _store_generation_outputs(image: object, *, image_id: str, now: datetime) -> _OutputPaths:
+    """
+    Encode a generated image as PNG (+ WebP preview and downscaled WebP
+    variants) and write the files to the configured storage backend.
+    """
+
+    # `YYYYMMDD/HHMMSS_<id>` or `<aa>/<bb>/<id>`, see storage_keys.py.
+    stem = output_stem(image_id, now)
+    png_relative_path = f"{stem}.png"
+
+    # In addition to the PNG used for downloads, also save a WebP version
+    # for UI previews to reduce bandwidth usage.
+    webp_relative_path = f"{stem}.webp"
+
+    storage = get_storage()
+
+    # PNG and WebP are encoded in parallel straight from the pipeline output,
+    # each streamed into storage as it is produced (temp file + rename /
+    # S3 multipart parts) rather than buffered whole. Uploads of the
+    # preview variants run concurrently on the storage I/O pool; all of
+    # them are awaited below.
+    encoder = get_encoder()
+    codec_settings = get_codec_settings()
+    source = prepare_source(image, encoder)
+
+    def _stream(fmt: str, relative_path: str) -> str:
+        return storage.put_stream(
+            relative_path=relative_path,
+            write=lambda fh: encoder.encode_to(source, fh, format=fmt, settings=codec_settings),
+            content_type=CONTENT_TYPES[fmt],
+        )
+
+    codec_executor = get_codec_executor()
+    png_upload = codec_executor.submit(_stream, "png", png_relative_path)
+    webp_upload = codec_executor.submit(_stream, "webp", webp_relative_path)
+
+    # Smaller previews for grids / cards; best effort like the WebP below
+    # (history falls back to on-demand resizing for missing widths).
+    variant_uploads: dict[str, tuple[str, Future[str]]] = {}
+    for width, variant in encode_preview_variants(image).items():
+        if isinstance(variant, Exception):
+            continue
+        variant_path = variant_relative_path(webp_relative_path, width)
+        variant_uploads[str(width)] = (
+            variant_path,
+            storage.submit_put(relative_path=variant_path, data=variant.data, content_type=variant.content_type),
+        )
+
+    png_output_path = png_upload.result()
+
+    # If WebP encoding or upload fails for any reason, fall back to the PNG
+    # path so callers still have a valid preview URL.
+    try:
+        preview_output_path = webp_upload.result()
+        preview_relative_path = webp_relative_path
+    except Exception:  # pragma: no cover - runtime only
+        preview_output_path = png_output_path
+        preview_relative_path = png_relative_path
+
+    preview_variants: dict[str, str] = {}
+    for width_key, (variant_path, upload) in variant_uploads.items():
+        try:
+            upload.result()
+        except Exception:  # pragma: no cover - runtime only
+            continue
+        preview_variants[width_key] = variant_path
+
+    return {
+        # PNG paths (for downloads / archival).
+        "output_path": str(png_output_path),
+        "relative_path": str(png_relative_path),
+        # WebP paths (for previews).
+        "preview_output_path": str(preview_output_path),
+        "preview_relative_path": str(preview_relative_path),
+        "preview_variants": preview_variants,
+    }
+
+
+def _record_failure(task_id: str, metadata: JSONDict | None, exc: Exception) -> RuntimeError:
+    """
+    Record a failed image in the DB, notify event subscribers, and return
+    the structured error the task should raise.
+    """
+
+    code, hint = _classify_generation_exception(exc)
+    detail = str(exc)
+    # Best-effort recording of failure to the DB. Any DB errors are
+    # swallowed inside record_generation_failed so they don't impact
+    # user-facing behaviour.
+    record_generation_failed(
+        task_id,
+        error_code=code,
+        error_hint=hint,
+        error_message=detail,
+    )
+    publish_task_failed(task_id, metadata, error_code=code, error_hint=hint)
+    return RuntimeError(_serialize_generation_error(code, hint, detail))
+
+
+def _finalize_outputs(
+    task_id: str,
+    metadata: JSONDict | None,
+    build: Callable[[], GenerationResult],
+) -> GenerationResult:
+    """
+    Run the encode / upload / DB-record tail for one image, recording a
+    structured failure when anything after generation goes wrong.
+    """
+
+    try:
+        return build()
+    except Exception as exc:  # pragma: no cover - runtime only
+        raise _record_failure(task_id, metadata, exc) from exc
+
+
+def _skip_if_revoked(task, task_id: str) -> None:
+    """
+    Drop a task the API already cancelled (result stored as REVOKED).
+
+    Celery's own revoke list only reaches workers that were running at the
+    time, so a queued message may still be delivered later.
+    """
+
+    try:
+        revoked = task.backend.get_state(task_id) == states.REVOKED
+    except Exception:  # pragma: no cover - backend unavailable
+        return
+    if revoked:
+        raise Ignore()
+
+
+def _store_task_outcome(task, task_id: str, future: Future[T]) -> None:
+    """
+    Publish the outcome of background post-processing as the Celery result,
+    exactly as if the task had returned / raised it itself.
+    """
+
+    exc = future.exception()
+    if exc is not None:
+        task.backend.mark_as_failure(task_id, exc)
+    else:
+        task.backend.mark_as_done(task_id, future.result())
+
+
+def _complete_in_background(task, task_id: str, job: Callable[[], T]) -> NoReturn:
+    """
+    Hand the post-processing tail to the background pool and release the
+    worker for the next task.
+
+    The task raises `Ignore` so Celery does not store a result now; the pool
+    stores SUCCESS / FAILURE once the outputs are durable, so clients never
+    see a result whose files are not yet written. The message is acked at
+    that point, so `task_acks_late` no longer covers a crash in the tail;
+    hence Z_IMAGE_POSTPROCESS_ASYNC is opt-in.
+    """
+
+    future = get_postprocessor().submit(job)
+    future.add_done_callback(lambda f: _store_task_outcome(task, task_id, f))
+    raise Ignore()
+
+
 @celery_app.task(name="z_image.generate_image", bind=True)
 def generate_image_task(
     self,
@@ -74,15 +267,19 @@ def generate_image_task(
 
     image_id = uuid.uuid4().hex
     task_id = self.request.id or image_id
+    _skip_if_revoked(self, task_id)
     now = datetime.now(timezone.utc)
 
     normalized_negative_prompt = negative_prompt if negative_prompt is not None else ""
+    batch_id, batch_index = batch_position(metadata)
+    # Bound to task_id explicitly: with micro-batching this callback may run
+    # on another task's thread, where self.request is a different task.
+    report_progress = ProgressReporter([task_id], batch_id=batch_id, batch_indices=[batch_index])
 
     def progress_callback(step: int, timestep: int, latents: object) -> None:
         # Calculate progress percentage (0-100)
         # step is 0-indexed, so we add 1.
-        progress = int(((step + 1) / num_inference_steps) * 100)
-        self.update_state(state="PROGRESS", meta={"progress": progress})
+        report_progress(int(((step + 1) / num_inference_steps) * 100))
 
     # Record the fact that the worker picked up this task in the DB.
     record_generation_started(
@@ -100,9 +297,19 @@ def generate_image_task(
         auth_key=auth_key,
         metadata=metadata,
     )
+    publish_task_event(
+        task_id,
+        "status",
+        batch_id=batch_id,
+        batch_index=batch_index,
+        api_client_id=history_owner(metadata),
+        status="running",
+    )
 
     try:
-        image = generate_image(
+        # Joins a worker-side micro-batch with other compatible tasks when
+        # Z_IMAGE_MICROBATCH_MAX_SIZE > 1; otherwise a plain single-image call.
+        image = generate_image_microbatched(
             prompt=prompt,
             height=height,
             width=width,
@@ -114,80 +321,242 @@ def generate_image_task(
             cfg_truncation=cfg_truncation,
             max_sequence_length=max_sequence_length,
             callback=progress_callback,
-            callback_steps=1,
         )
     except Exception as exc:  # pragma: no cover - runtime only
-        code, hint = _classify_generation_exception(exc)
-        detail = str(exc)
-        # Best-effort recording of failure to the DB. Any DB errors are
-        # swallowed inside record_generation_failed so they don't impact
-        # user-facing behaviour.
-        record_generation_failed(
-            task_id,
-            error_code=code,
-            error_hint=hint,
-            error_message=detail,
-        )
-        raise RuntimeError(_serialize_generation_error(code, hint, detail)) from exc
+        raise _record_failure(task_id, metadata, exc) from exc
 
-    timestamp = now.strftime("%H%M%S")
-    date_prefix = now.strftime("%Y%m%d")
-    png_filename = f"{timestamp}_{image_id}.png"
-    png_relative_path = f"{date_prefix}/{png_filename}"
+    def _build_result() -> GenerationResult:
+        output_paths = _store_generation_outputs(image, image_id=image_id, now=now)
 
-    # In addition to the PNG used for downloads, also save a WebP version
-    # for UI previews to reduce bandwidth usage.
-    webp_filename = f"{timestamp}_{image_id}.webp"
-    webp_relative_path = f"{date_prefix}/{webp_filename}"
+        result: GenerationResult = {
+            "image_id": image_id,
+            "prompt": prompt,
+            "height": height,
+            "width": width,
+            "num_inference_steps": num_inference_steps,
+            "guidance_scale": guidance_scale,
+            "seed": seed,
+            "negative_prompt": normalized_negative_prompt,
+            "cfg_normalization": cfg_normalization,
+            "cfg_truncation": cfg_truncation,
+            "max_sequence_length": max_sequence_length,
+            "created_at": now.isoformat(),
+            "auth_key": auth_key,
+            "metadata": metadata if metadata is not None else {},
+            **output_paths,
+        }
 
-    storage = get_storage()
+        # Persist the successful generation to the DB (fire-and-forget).
+        record_generation_succeeded(task_id, result)
+        publish_task_succeeded(task_id, result)
+        return result
+
+    def _job() -> GenerationResult:
+        return _finalize_outputs(task_id, metadata, _build_result)
+
+    if is_async_postprocess_enabled():
+        _complete_in_background(self, task_id, _job)
+
+    return _job()
+
+
+@celery_app.task(name="z_image.generate_image_batch", bind=True)
+def generate_image_batch_task(
+    self,
+    prompt: str,
+    *,
+    seeds: list[int | None],
+    height: int = 1024,
+    width: int = 1024,
+    num_inference_steps: int = 9,
+    guidance_scale: float = 0.0,
+    negative_prompt: str | None = None,
+    cfg_normalization: bool | None = None,
+    cfg_truncation: float | None = None,
+    max_sequence_length: int | None = None,
+    auth_key: str | None = None,
+    metadata: JSONDict | None = None,
+) -> BatchGenerationResult:
+    """
+    Celery task that generates one image per seed in a single batched
+    pipeline call.
+
+    Every image still gets its own `image_generation_tasks` row (keyed by
+    `<celery task id>-<index>`) and its own storage objects, so history and
+    batch detail views look exactly like N single-image tasks.
+    """
+
+    batch_task_id = self.request.id or uuid.uuid4().hex
+    _skip_if_revoked(self, batch_task_id)
+    now = datetime.now(timezone.utc)
+
+    normalized_negative_prompt = negative_prompt if negative_prompt is not None else ""
+
+    base_metadata: JSONDict = dict(metadata) if isinstance(metadata, dict) else {}
+    batch_id = base_metadata.get("batch_id")
+    if not isinstance(batch_id, str):
+        batch_id = str(uuid.uuid4())
+    base_metadata["batch_id"] = batch_id
+    base_metadata["batch_size"] = len(seeds)
+    base_metadata["batch_task_id"] = batch_task_id
 
-    png_bytes, _ = encode_image_bytes(image=image, format="PNG")
-    png_output_path = storage.put_bytes(
-        relative_path=png_relative_path,
-        data=png_bytes,
-        content_type="image/png",
+    item_task_ids = [f"{batch_task_id}-{index}" for index in range(len(seeds))]
+    item_metadata: list[JSONDict] = [
+        {**base_metadata, "batch_index": index} for index in range(len(seeds))
+    ]
+
+    # Every image of the batch advances in lockstep.
+    report_progress = ProgressReporter(
+        item_task_ids,
+        batch_id=batch_id,
+        batch_indices=range(len(item_task_ids)),
+        extra_task_ids=[batch_task_id],
     )
 
+    def progress_callback(step: int, timestep: int, latents: object) -> None:
+        report_progress(int(((step + 1) / num_inference_steps) * 100))
+
+    # Rows created by the API at enqueue time only need their status flipped.
+    already_recorded = mark_generations_running(item_task_ids)
+    for item_task_id, seed, item_meta in zip(item_task_ids, seeds, item_metadata):
+        if item_task_id in already_recorded:
+            continue
+        record_generation_started(
+            item_task_id,
+            prompt=prompt,
+            height=height,
+            width=width,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            negative_prompt=normalized_negative_prompt,
+            cfg_normalization=cfg_normalization,
+            cfg_truncation=cfg_truncation,
+            max_sequence_length=max_sequence_length,
+            auth_key=auth_key,
+            metadata=item_meta,
+        )
+    for index, item_task_id in enumerate(item_task_ids):
+        publish_task_event(
+            item_task_id,
+            "status",
+            batch_id=batch_id,
+            batch_index=index,
+            api_client_id=history_owner(metadata),
+            status="running",
+        )
+
     try:
-        webp_bytes, _ = encode_image_bytes(image=image, format="WEBP")
-        webp_output_path = storage.put_bytes(
-            relative_path=webp_relative_path,
-            data=webp_bytes,
-            content_type="image/webp",
+        images = generate_images(
+            prompt=prompt,
+            seeds=seeds,
+            height=height,
+            width=width,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            negative_prompt=normalized_negative_prompt,
+            cfg_normalization=cfg_normalization,
+            cfg_truncation=cfg_truncation,
+            max_sequence_length=max_sequence_length,
+            callback=progress_callback,
+            callback_steps=1,
         )
-        preview_output_path = webp_output_path
-        preview_relative_path = webp_relative_path
-    except Exception:  # pragma: no cover - runtime only
-        # If WebP save fails for any reason, fall back to the PNG path so
-        # callers still have a valid preview URL.
-        preview_output_path = png_output_path
-        preview_relative_path = png_relative_path
+    except Exception as exc:  # pragma: no cover - runtime only
+        errors = [
+            _record_failure(item_task_id, item_meta, exc)
+            for item_task_id, item_meta in zip(item_task_ids, item_metadata)
+        ]
+        publish_task_event(batch_task_id, "status", status="error")
+        raise errors[0] from exc
 
-    result: GenerationResult = {
-        "image_id": image_id,
-        "prompt": prompt,
-        "height": height,
-        "width": width,
-        "num_inference_steps": num_inference_steps,
-        "guidance_scale": guidance_scale,
-        "seed": seed,
-        "negative_prompt": normalized_negative_prompt,
-        "cfg_normalization": cfg_normalization,
-        "cfg_truncation": cfg_truncation,
-        "max_sequence_length": max_sequence_length,
-        "created_at": now.isoformat(),
-        "auth_key": auth_key,
-        "metadata": metadata if metadata is not None else {},
-        # PNG paths (for downloads / archival).
-        "output_path": str(png_output_path),
-        "relative_path": str(png_relative_path),
-        # WebP paths (for previews).
-        "preview_output_path": str(preview_output_path),
-        "preview_relative_path": str(preview_relative_path),
-    }
+    def _make_item_job(
+        item_task_id: str,
+        seed: int | None,
+        item_meta: JSONDict,
+        image: object,
+    ) -> Callable[[], GenerationResult]:
+        def _build_result() -> GenerationResult:
+            image_id = uuid.uuid4().hex
+            output_paths = _store_generation_outputs(image, image_id=image_id, now=now)
+
+            result: GenerationResult = {
+                "image_id": image_id,
+                "prompt": prompt,
+                "height": height,
+                "width": width,
+                "num_inference_steps": num_inference_steps,
+                "guidance_scale": guidance_scale,
+                "seed": seed,
+                "negative_prompt": normalized_negative_prompt,
+                "cfg_normalization": cfg_normalization,
+                "cfg_truncation": cfg_truncation,
+                "max_sequence_length": max_sequence_length,
+                "created_at": now.isoformat(),
+                "auth_key": auth_key,
+                "metadata": item_meta,
+                **output_paths,
+            }
+            record_generation_succeeded(item_task_id, result)
+            publish_task_succeeded(item_task_id, result)
+            return result
+
+        return lambda: _finalize_outputs(item_task_id, item_meta, _build_result)
+
+    # Items are encoded / uploaded in parallel on the post-processing pool.
+    postprocessor = get_postprocessor()
+    futures = [
+        postprocessor.submit(_make_item_job(item_task_id, seed, item_meta, image))
+        for item_task_id, seed, item_meta, image in zip(item_task_ids, seeds, item_metadata, images)
+    ]
+    # Drop our references so finished items can be freed while others upload.
+    del images
+
+    def _collect(done: list[Future[GenerationResult]]) -> BatchGenerationResult:
+        """
+        Per-item outcomes; the batch task only fails when every item did
+        (failed items are already recorded by `_finalize_outputs`).
+        """
 
-    # Persist the successful generation to the DB (fire-and-forget).
-    record_generation_succeeded(task_id, result)
+        items: list[GenerationResult | BatchItemError] = []
+        errors: list[BaseException] = []
+        for future in done:
+            exc = future.exception()
+            if exc is None:
+                items.append(future.result())
+            else:
+                errors.append(exc)
+                items.append({"error": str(exc)})
+        if errors and len(errors) == len(items):
+            raise errors[0]
+        return {
+            "batch_id": batch_id,
+            "task_ids": item_task_ids,
+            "auth_key": auth_key,
+            "status": "partial" if errors else "success",
+            "items": items,
+        }
 
-    return result
+    if is_async_postprocess_enabled():
+
+        def _on_all_done(done: list[Future[GenerationResult]]) -> None:
+            try:
+                self.backend.mark_as_done(batch_task_id, _collect(done))
+            except Exception as exc:  # pragma: no cover - runtime only
+                self.backend.mark_as_failure(batch_task_id, exc)
+                publish_task_event(batch_task_id, "status", status="error")
+            else:
+                publish_task_event(batch_task_id, "status", status="success")
+
+        when_all_done(futures, _on_all_done)
+        raise Ignore()
+
+    for future in futures:
+        future.exception()
+    try:
+        batch_result = _collect(futures)
+    except Exception:
+        publish_task_event(batch_task_id, "status", status="error")
+        raise
+    # Wakes long-polls on the batch task id (items have their own events).
+    publish_task_event(batch_task_id, "status", status="success")
+    return batch_result
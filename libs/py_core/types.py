@@ -35,9 +35,29 @@ class GenerationResult(TypedDict):
     # WebP paths (lightweight previews).
     preview_output_path: str
     preview_relative_path: str
+    # Downscaled WebP previews: {"<width>": relative_path} (see previews.py).
+    preview_variants: dict[str, str]
+
+
+class BatchItemError(TypedDict):
+    # Structured error JSON (code / message / detail) of a failed item.
+    error: str
+
+
+class BatchGenerationResult(TypedDict):
+    batch_id: str
+    # Per-image task ids as recorded in image_generation_tasks.
+    task_ids: list[str]
+    auth_key: str | None
+    # "success" when every item succeeded, "partial" otherwise.
+    status: str
+    # In task_ids order; failed items carry only their error.
+    items: list[GenerationResult | BatchItemError]
 
 
 __all__ = [
+    "BatchGenerationResult",
+    "BatchItemError",
     "GenerationResult",
     "JSONDict",
     "JSONScalar",
@@ -0,0 +1,481 @@
+"""
+Completion webhook dispatcher.
+
+A batch (a single-image generation is a batch of one) gets a
+`callback_url` at enqueue time, from the request or from
+`api_clients.callback_url`. When the worker completes the batch it also
+inserts a `webhook_deliveries` row in the same transaction (see
+`db._finish_task`), so every event of the batch is coalesced into one
+POST and nothing is lost if the dispatcher is down.
+
+This module drains that outbox in a separate process
+(scripts/webhook_dispatcher.py):
+
+- due rows are claimed with `FOR UPDATE SKIP LOCKED`, so several
+  dispatchers can run side by side; a claim pushes `next_attempt_at` out
+  by a lease, which re-delivers rows of a dispatcher that died mid-POST;
+- POSTs share one pooled `httpx.AsyncClient`, bounded overall
+  (WEBHOOK_MAX_CONNECTIONS) and per host (WEBHOOK_PER_HOST_CONCURRENCY);
+- non-2xx / network errors are retried with exponential backoff and
+  jitter (`Retry-After` is honoured); after WEBHOOK_MAX_ATTEMPTS the row
+  is left as `dead` with the last error, and can be re-queued;
+- `callback_url` comes from API clients, so its host is resolved at
+  delivery time and the POST goes to the checked address; hosts that
+  resolve to non-public addresses (private, loopback, link-local, ...)
+  are rejected unless listed in WEBHOOK_ALLOWED_HOSTS.
+
+Delivery is at-least-once: receivers should de-duplicate on
+`X-Zimage-Delivery` (or `batch_id`).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import socket
+from collections.abc import Sequence
+from typing import Any, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from .config import get_settings
+from .db_async import get_db_cursor
+
+
+logger = logging.getLogger(__name__)
+
+EVENT_BATCH_COMPLETED = "batch.completed"
+USER_AGENT = "z-image-webhooks/1"
+
+# Extra time a claimed row stays invisible to other dispatchers beyond the
+# worst-case wait for its host slot plus the request itself.
+_LEASE_GRACE_SECONDS = 30.0
+_MAX_ERROR_LENGTH = 500
+
+
+_CLAIM_SQL = """
+    UPDATE webhook_deliveries AS w
+    SET
+        attempts = w.attempts + 1,
+        next_attempt_at = NOW() + make_interval(secs => %(lease)s)
+    FROM (
+        SELECT id
+        FROM webhook_deliveries
+        WHERE status = 'pending' AND next_attempt_at <= NOW()
+        ORDER BY next_attempt_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ) AS due
+    WHERE w.id = due.id
+    RETURNING w.id, w.batch_id, w.url, w.attempts
+"""
+
+_PAYLOAD_SQL = """
+    SELECT
+        b.id,
+        b.status,
+        b.batch_size,
+        b.success_count,
+        b.failed_count,
+        b.created_at,
+        b.completed_at,
+        t.task_id,
+        t.batch_index,
+        t.status,
+        t.relative_path,
+        t.preview_relative_path,
+        t.width,
+        t.height,
+        t.seed,
+        t.error_code,
+        t.error_hint
+    FROM image_generation_batches AS b
+    LEFT JOIN image_generation_tasks AS t ON t.batch_id = b.id
+    WHERE b.id = ANY(%s)
+    ORDER BY b.id, t.batch_index
+"""
+
+_DELIVERED_SQL = """
+    UPDATE webhook_deliveries
+    SET status = 'delivered', delivered_at = NOW(), response_status = %s, last_error = NULL
+    WHERE id = %s
+"""
+
+_FAILED_SQL = """
+    UPDATE webhook_deliveries
+    SET
+        status = CASE WHEN attempts >= %(max_attempts)s THEN 'dead' ELSE 'pending' END,
+        next_attempt_at = NOW() + make_interval(secs => %(delay)s),
+        response_status = %(response_status)s,
+        last_error = %(error)s
+    WHERE id = %(id)s
+    RETURNING status
+"""
+
+_REQUEUE_DEAD_SQL = """
+    UPDATE webhook_deliveries
+    SET status = 'pending', attempts = 0, next_attempt_at = NOW()
+    WHERE status = 'dead'
+"""
+
+
+def _image_url(relative_path: Optional[str]) -> Optional[str]:
+    if not relative_path:
+        return None
+    base = (get_settings().webhook_public_base_url or "").rstrip("/")
+    return f"{base}/generated-images/{relative_path.lstrip('/')}"
+
+
+def _isoformat(value: Any) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _build_payloads(rows: Sequence[tuple[Any, ...]]) -> dict[str, dict[str, Any]]:
+    """
+    Group `_PAYLOAD_SQL` rows into one payload per batch id.
+    """
+
+    payloads: dict[str, dict[str, Any]] = {}
+    for (
+        batch_id,
+        batch_status,
+        batch_size,
+        success_count,
+        failed_count,
+        created_at,
+        completed_at,
+        task_id,
+        batch_index,
+        task_status,
+        relative_path,
+        preview_relative_path,
+        width,
+        height,
+        seed,
+        error_code,
+        error_hint,
+    ) in rows:
+        payload = payloads.get(str(batch_id))
+        if payload is None:
+            payload = payloads[str(batch_id)] = {
+                "event": EVENT_BATCH_COMPLETED,
+                "batch_id": str(batch_id),
+                "status": batch_status,
+                "batch_size": batch_size,
+                "success_count": success_count,
+                "failed_count": failed_count,
+                "created_at": _isoformat(created_at),
+                "completed_at": _isoformat(completed_at),
+                "items": [],
+            }
+        if task_id is None:
+            continue
+        payload["items"].append(
+            {
+                "task_id": task_id,
+                "index": batch_index,
+                "status": task_status,
+                "image_url": _image_url(relative_path),
+                "preview_url": _image_url(preview_relative_path),
+                "width": width,
+                "height": height,
+                "seed": seed,
+                "error_code": error_code,
+                "error_hint": error_hint,
+            }
+        )
+    return payloads
+
+
+def sign_body(body: bytes, secret: str) -> str:
+    """
+    Value of the X-Zimage-Signature header for `body`.
+    """
+
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def backoff_seconds(attempts: int, retry_after: Optional[float] = None) -> float:
+    """
+    Delay before the next attempt after `attempts` failures.
+    """
+
+    settings = get_settings()
+    delay = settings.webhook_backoff_base_seconds * (2 ** max(0, attempts - 1))
+    delay *= random.uniform(0.5, 1.0)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return min(delay, settings.webhook_backoff_max_seconds)
+
+
+class WebhookTargetRejected(Exception):
+    """
+    The callback host resolves to an address deliveries may not reach.
+    """
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def _pin_address(url: str, allowed_hosts: frozenset[str]) -> tuple[str, dict[str, str], dict[str, Any]]:
+    """
+    Resolve the host of `url` once and return (url to POST, extra headers,
+    httpx extensions) that connect to the checked address, so a DNS change
+    between check and connect cannot redirect the request.
+    """
+
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if not host or parts.scheme not in ("http", "https"):
+        raise WebhookTargetRejected(f"invalid callback url: {url}")
+    if host in allowed_hosts:
+        return url, {}, {}
+
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    addresses = [str(info[4][0]) for info in infos]
+    rejected = [address for address in addresses if not _is_public_address(address)]
+    if not addresses or rejected:
+        raise WebhookTargetRejected(f"{host} resolves to a non-public address ({', '.join(rejected) or 'none'})")
+
+    userinfo, _, hostport = parts.netloc.rpartition("@")
+    address = addresses[0]
+    netloc = f"[{address}]" if ":" in address else address
+    if parts.port:
+        netloc = f"{netloc}:{parts.port}"
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    pinned = urlunsplit((parts.scheme, netloc, parts.path, parts.query, ""))
+    # Host header and TLS SNI / certificate check keep the original name.
+    extensions = {"sni_hostname": host} if parts.scheme == "https" else {}
+    return pinned, {"Host": hostport}, extensions
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        # HTTP-date form is not worth parsing here; fall back to backoff.
+        return None
+
+
+class WebhookDispatcher:
+    """
+    Drains `webhook_deliveries`; see the module docstring.
+    """
+
+    def __init__(self) -> None:
+        settings = get_settings()
+        self.max_in_flight = settings.webhook_max_connections
+        self.per_host_concurrency = settings.webhook_per_host_concurrency
+        self.max_attempts = settings.webhook_max_attempts
+        self.poll_interval = settings.webhook_poll_interval_seconds
+        self.timeout = settings.webhook_timeout_seconds
+        self.secret = settings.webhook_secret
+        self.allowed_hosts = frozenset(
+            host.strip().lower() for host in settings.webhook_allowed_hosts.split(",") if host.strip()
+        )
+        queued_rounds = -(-self.max_in_flight // self.per_host_concurrency)
+        self.lease_seconds = self.timeout * queued_rounds + _LEASE_GRACE_SECONDS
+        self.stats = {"delivered": 0, "retried": 0, "dead": 0}
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+        self._client: Any = None
+
+    async def _claim(self, limit: int) -> list[tuple[Any, ...]]:
+        async with get_db_cursor() as cur:
+            await cur.execute(_CLAIM_SQL, {"lease": self.lease_seconds, "limit": limit})
+            return list(await cur.fetchall())
+
+    async def _load_payloads(self, batch_ids: Sequence[Any]) -> dict[str, dict[str, Any]]:
+        async with get_db_cursor() as cur:
+            await cur.execute(_PAYLOAD_SQL, (list(batch_ids),))
+            return _build_payloads(await cur.fetchall())
+
+    async def _mark_delivered(self, delivery_id: int, response_status: int) -> None:
+        async with get_db_cursor() as cur:
+            await cur.execute(_DELIVERED_SQL, (response_status, delivery_id))
+        self.stats["delivered"] += 1
+
+    async def _mark_failed(
+        self,
+        delivery_id: int,
+        attempts: int,
+        error: str,
+        *,
+        response_status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        final: bool = False,
+    ) -> None:
+        """
+        Schedule a retry, or leave the row 'dead' once its attempts are used
+        up (immediately with `final`).
+        """
+
+        async with get_db_cursor() as cur:
+            await cur.execute(
+                _FAILED_SQL,
+                {
+                    "id": delivery_id,
+                    "max_attempts": 0 if final else self.max_attempts,
+                    "delay": backoff_seconds(attempts, retry_after),
+                    "response_status": response_status,
+                    "error": error[:_MAX_ERROR_LENGTH],
+                },
+            )
+            row = await cur.fetchone()
+        if row and row[0] == "dead":
+            self.stats["dead"] += 1
+            logger.warning("webhook delivery %s is dead after %s attempts: %s", delivery_id, attempts, error)
+        else:
+            self.stats["retried"] += 1
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return limit
+
+    async def _deliver(self, delivery: tuple[Any, ...], payload: Optional[dict[str, Any]]) -> None:
+        delivery_id, batch_id, url, attempts = delivery
+        if payload is None:
+            # Batch deleted between completion and delivery (rows normally
+            # cascade away with it).
+            await self._mark_failed(delivery_id, attempts, "batch not found", final=True)
+            return
+
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": USER_AGENT,
+            "X-Zimage-Event": EVENT_BATCH_COMPLETED,
+            "X-Zimage-Delivery": str(delivery_id),
+            "X-Zimage-Attempt": str(attempts),
+        }
+        if self.secret:
+            headers["X-Zimage-Signature"] = sign_body(body, self.secret)
+
+        try:
+            target, extra_headers, extensions = await _pin_address(url, self.allowed_hosts)
+        except WebhookTargetRejected as exc:
+            # Not retryable: the same URL would be rejected again.
+            await self._mark_failed(delivery_id, attempts, str(exc), final=True)
+            return
+        except Exception as exc:
+            # DNS failure; retried with backoff like a network error.
+            await self._mark_failed(delivery_id, attempts, f"{type(exc).__name__}: {exc}")
+            return
+
+        try:
+            async with self._host_limit(url):
+                response = await self._client.post(
+                    target, content=body, headers={**headers, **extra_headers}, extensions=extensions
+                )
+        except Exception as exc:
+            await self._mark_failed(delivery_id, attempts, f"{type(exc).__name__}: {exc}")
+            return
+
+        if 200 <= response.status_code < 300:
+            await self._mark_delivered(delivery_id, response.status_code)
+            return
+        await self._mark_failed(
+            delivery_id,
+            attempts,
+            f"HTTP {response.status_code}: {response.text[:200]}",
+            response_status=response.status_code,
+            retry_after=_retry_after(response.headers.get("Retry-After")),
+        )
+
+    async def _deliver_safely(self, delivery: tuple[Any, ...], payload: Optional[dict[str, Any]]) -> None:
+        try:
+            await self._deliver(delivery, payload)
+        except Exception:
+            # DB hiccup while recording the outcome; the lease expires and
+            # the row is picked up again.
+            logger.exception("webhook delivery %s: failed to record outcome", delivery[0])
+
+    async def _start_due(self, limit: int, in_flight: set[asyncio.Task[None]]) -> int:
+        """
+        Claim up to `limit` due deliveries and start them; returns how many.
+        """
+
+        try:
+            claimed = await self._claim(limit)
+            payloads = await self._load_payloads([row[1] for row in claimed]) if claimed else {}
+        except Exception:
+            logger.warning("webhook dispatcher: claim failed, retrying", exc_info=True)
+            return 0
+
+        for delivery in claimed:
+            task = asyncio.create_task(self._deliver_safely(delivery, payloads.get(str(delivery[1]))))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        return len(claimed)
+
+    async def run(self, *, once: bool = False) -> None:
+        """
+        Deliver due webhooks until cancelled; with `once`, return as soon
+        as nothing is due and nothing is in flight.
+        """
+
+        import httpx
+
+        limits = httpx.Limits(
+            max_connections=self.max_in_flight,
+            max_keepalive_connections=self.max_in_flight,
+        )
+        in_flight: set[asyncio.Task[None]] = set()
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits, follow_redirects=False) as client:
+            self._client = client
+            try:
+                while True:
+                    capacity = self.max_in_flight - len(in_flight)
+                    claimed = await self._start_due(capacity, in_flight) if capacity > 0 else 0
+                    if once and not claimed and not in_flight:
+                        return
+                    if claimed and claimed == capacity:
+                        # Full claim: more rows are probably due.
+                        continue
+                    if in_flight:
+                        await asyncio.wait(in_flight, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                    else:
+                        await asyncio.sleep(self.poll_interval)
+            finally:
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
+                self._client = None
+
+
+async def requeue_dead_deliveries() -> int:
+    """
+    Move every 'dead' delivery back to 'pending' with a fresh attempt budget.
+    """
+
+    async with get_db_cursor() as cur:
+        await cur.execute(_REQUEUE_DEAD_SQL)
+        return cur.rowcount
+
+
+async def get_delivery_counts() -> dict[str, int]:
+    async with get_db_cursor() as cur:
+        await cur.execute("SELECT status, COUNT(*) FROM webhook_deliveries GROUP BY status")
+        return {status: count for status, count in await cur.fetchall()}
+
+
+__all__ = [
+    "EVENT_BATCH_COMPLETED",
+    "WebhookDispatcher",
+    "WebhookTargetRejected",
+    "backoff_seconds",
+    "get_delivery_counts",
+    "requeue_dead_deliveries",
+    "sign_body",
+]
@@ -14,12 +14,21 @@ from __future__ import annotations
 
 import json
 import os
+import threading
 from collections.abc import Callable, Sequence
+from contextlib import AbstractContextManager
 from functools import lru_cache
 from pathlib import Path
 from typing import Protocol, cast
 
 from .config import get_settings
+from .image_codecs import as_uint8_rgb
+from .prompt_cache import (
+    PromptCacheKey,
+    PromptEmbeddings,
+    get_prompt_embedding_cache,
+    publish_prompt_cache_stats,
+)
 
 
 class TorchCudaNamespace(Protocol):
@@ -30,12 +39,16 @@ class TorchGenerator(Protocol):
     def manual_seed(self, seed: int) -> TorchGenerator:
         ...
 
+    def seed(self) -> int:
+        ...
+
 
 class TorchModule(Protocol):
     cuda: TorchCudaNamespace
     bfloat16: object
     float32: object
     Generator: type[TorchGenerator]
+    no_grad: Callable[[], AbstractContextManager[object]]
 
 
 class PipelineResult(Protocol):
@@ -46,6 +59,9 @@ class ZImagePipelineProtocol(Protocol):
     transformer: object
     text_encoder: object
 
+    def encode_prompt(self, **kwargs: object) -> tuple[list[object], list[object]]:
+        ...
+
     def to(self, device: object) -> ZImagePipelineProtocol:
         ...
 
@@ -588,48 +604,243 @@ def get_zimage_pipeline(device: str | None = None, model_id: str | None = None)
     return pipe
 
 
-def generate_image(
+_PIPELINE_LOCK = threading.RLock()
+
+# diffusers' ZImagePipeline default when max_sequence_length is not given.
+_DEFAULT_MAX_SEQUENCE_LENGTH = 512
+
+
+def _resolve_model_revision() -> str:
+    """
+    Identify the loaded text encoder weights for prompt-cache keys.
+
+    Z_IMAGE_MODEL_REVISION can be bumped explicitly after swapping weights
+    in place; otherwise the variant, model id and DF11 root are used.
+    """
+
+    override = os.getenv("Z_IMAGE_MODEL_REVISION", "").strip()
+    if override:
+        return override
+
+    variant = os.getenv("Z_IMAGE_VARIANT", "turbo").lower()
+    variant_cfg = _VARIANT_REGISTRY.get(variant) or {}
+    model_id = os.getenv("Z_IMAGE_MODEL_ID") or variant_cfg.get("default_model_id") or DEFAULT_Z_IMAGE_MODEL_ID
+    df11_root = os.getenv("Z_IMAGE_DF11_ROOT", "")
+    return f"{variant}:{model_id}:{df11_root}"
+
+
+def _encode_prompt_cached(
+    torch: TorchModule,
+    pipeline: ZImagePipelineProtocol,
     *,
     prompt: str,
+    negative_prompt: str | None,
+    guidance_scale: float,
+    max_sequence_length: int | None,
+) -> PromptEmbeddings | None:
+    """
+    Look up (or compute and cache) the text-encoder output for a prompt.
+
+    Returns None when caching is disabled or the pipeline does not expose
+    `encode_prompt`, in which case callers pass the raw strings instead.
+    """
+
+    if not get_settings().z_image_prompt_cache:
+        return None
+
+    encode_prompt = getattr(pipeline, "encode_prompt", None)
+    if not callable(encode_prompt):
+        return None
+
+    # Mirrors ZImagePipeline.do_classifier_free_guidance: negative embeddings
+    # are only computed (and therefore only keyed) when CFG is active.
+    do_cfg = guidance_scale > 1
+    resolved_max_len = max_sequence_length or _DEFAULT_MAX_SEQUENCE_LENGTH
+    device = getattr(pipeline, "_execution_device", None) or getattr(pipeline, "device", None)
+
+    key = PromptCacheKey(
+        prompt=prompt,
+        negative_prompt=(negative_prompt or "") if do_cfg else None,
+        max_sequence_length=resolved_max_len,
+        model_revision=_resolve_model_revision(),
+    )
+
+    def _encode() -> tuple[list[object], list[object]]:
+        with _PIPELINE_LOCK, torch.no_grad():
+            return encode_prompt(
+                prompt=prompt,
+                device=device,
+                do_classifier_free_guidance=do_cfg,
+                negative_prompt=negative_prompt if do_cfg else None,
+                max_sequence_length=resolved_max_len,
+            )
+
+    embeddings = get_prompt_embedding_cache().get_or_encode(key, _encode)
+    publish_prompt_cache_stats()
+    return embeddings.to(device) if device is not None else embeddings
+
+
+def _build_generators(
+    torch: TorchModule,
+    pipeline: ZImagePipelineProtocol,
+    seeds: Sequence[int | None],
+) -> list[TorchGenerator] | None:
+    """
+    Build one generator per sample so that image `i` of a batch matches the
+    image a single-image call with `seeds[i]` would have produced.
+
+    Returns None when no sample has an explicit seed, letting the pipeline
+    draw fresh noise on its own.
+    """
+
+    if all(seed is None for seed in seeds):
+        return None
+
+    device = getattr(pipeline, "device", None) or "cuda" if torch.cuda.is_available() else "cpu"
+    generators: list[TorchGenerator] = []
+    for seed in seeds:
+        generator = torch.Generator(device=device)
+        if seed is not None:
+            generator.manual_seed(seed)
+        else:
+            # Unseeded samples inside a seeded batch still get independent noise.
+            generator.seed()
+        generators.append(generator)
+    return generators
+
+
+def _resolve_prompt_inputs(
+    torch: TorchModule,
+    pipeline: ZImagePipelineProtocol,
+    *,
+    prompt: str | Sequence[str],
+    negative_prompt: str | Sequence[str] | None,
+    num_images: int,
+    guidance_scale: float,
+    max_sequence_length: int | None,
+) -> dict[str, object]:
+    """
+    Build the prompt-related pipeline kwargs.
+
+    A single prompt string is encoded once and expanded via
+    `num_images_per_prompt`; a sequence provides one prompt per sample (as
+    used by the worker micro-batcher). Cached embeddings replace the raw
+    strings whenever the prompt cache is enabled.
+    """
+
+    if isinstance(prompt, str):
+        negative = negative_prompt if negative_prompt is None or isinstance(negative_prompt, str) else negative_prompt[0]
+        embeddings = _encode_prompt_cached(
+            torch,
+            pipeline,
+            prompt=prompt,
+            negative_prompt=negative,
+            guidance_scale=guidance_scale,
+            max_sequence_length=max_sequence_length,
+        )
+        kwargs: dict[str, object] = {"num_images_per_prompt": num_images}
+        if embeddings is not None:
+            kwargs["prompt_embeds"] = embeddings.prompt_embeds
+            if guidance_scale > 1:
+                kwargs["negative_prompt_embeds"] = embeddings.negative_prompt_embeds
+        else:
+            kwargs["prompt"] = prompt
+            if negative is not None:
+                kwargs["negative_prompt"] = negative
+        return kwargs
+
+    prompts = list(prompt)
+    if len(prompts) != num_images:
+        raise ValueError("One prompt per seed is required when passing a prompt sequence.")
+
+    if negative_prompt is None or isinstance(negative_prompt, str):
+        negatives: list[str | None] = [negative_prompt] * num_images
+    else:
+        negatives = list(negative_prompt)
+        if len(negatives) != num_images:
+            raise ValueError("One negative prompt per seed is required when passing a sequence.")
+
+    prompt_embeds: list[object] = []
+    negative_prompt_embeds: list[object] = []
+    for item_prompt, item_negative in zip(prompts, negatives):
+        embeddings = _encode_prompt_cached(
+            torch,
+            pipeline,
+            prompt=item_prompt,
+            negative_prompt=item_negative,
+            guidance_scale=guidance_scale,
+            max_sequence_length=max_sequence_length,
+        )
+        if embeddings is None:
+            # Cache disabled: let the pipeline encode all prompts itself.
+            kwargs = {"num_images_per_prompt": 1, "prompt": prompts}
+            if any(n is not None for n in negatives):
+                kwargs["negative_prompt"] = [n or "" for n in negatives]
+            return kwargs
+        prompt_embeds.extend(embeddings.prompt_embeds)
+        negative_prompt_embeds.extend(embeddings.negative_prompt_embeds)
+
+    kwargs = {"num_images_per_prompt": 1, "prompt_embeds": prompt_embeds}
+    if guidance_scale > 1:
+        kwargs["negative_prompt_embeds"] = negative_prompt_embeds
+    return kwargs
+
+
+def generate_images(
+    *,
+    prompt: str | Sequence[str],
+    seeds: Sequence[int | None],
     height: int = 1024,
     width: int = 1024,
     num_inference_steps: int = 9,
     guidance_scale: float = 0.0,
-    seed: int | None = None,
-    negative_prompt: str | None = None,
+    negative_prompt: str | Sequence[str] | None = None,
     cfg_normalization: bool | None = None,
     cfg_truncation: float | None = None,
     max_sequence_length: int | None = None,
     callback: Callable[[int, int, object], None] | None = None,
     callback_steps: int = 1,
-) -> object:
+) -> list[object]:
     """
-    Helper for running a single Z-Image generation step using the shared
-    pipeline configuration.
+    Run a batched Z-Image generation: one image per entry in `seeds`.
+
+    All samples share a single denoising loop; per-sample generators keep
+    every image identical to what `generate_image(seed=seeds[i])` would
+    return. `prompt` / `negative_prompt` may be a single string (encoded
+    once for the whole batch) or one entry per seed.
     """
 
+    if not seeds:
+        return []
+
     torch, _ = _ensure_runtime()
 
     pipeline = get_zimage_pipeline()
 
-    generator = None
-    if seed is not None:
-        device = getattr(pipeline, "device", None) or "cuda" if torch.cuda.is_available() else "cpu"
-        generator = torch.Generator(device=device).manual_seed(seed)
-
     call_kwargs: dict[str, object] = {
-        "prompt": prompt,
         "height": height,
         "width": width,
         "num_inference_steps": num_inference_steps,
         "guidance_scale": guidance_scale,
-        "generator": generator,
+        "generator": _build_generators(torch, pipeline, seeds),
     }
 
+    # Re-rolls of the same prompt skip the text encoder entirely: the cached
+    # embeddings replace the raw prompt / negative_prompt strings.
+    call_kwargs.update(
+        _resolve_prompt_inputs(
+            torch,
+            pipeline,
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            num_images=len(seeds),
+            guidance_scale=guidance_scale,
+            max_sequence_length=max_sequence_length,
+        )
+    )
+
     # 这些参数直接映射到 ZImagePipeline.__call__ 的可选项上，全部为可选，
     # 以便未来扩展时不破坏现有调用。
-    if negative_prompt is not None:
-        call_kwargs["negative_prompt"] = negative_prompt
     if cfg_normalization is not None:
         call_kwargs["cfg_normalization"] = cfg_normalization
     if cfg_truncation is not None:
@@ -659,5 +870,55 @@ def generate_image(
         # forward them to the public callback (even if currently unused).
         call_kwargs["callback_on_step_end_tensor_inputs"] = ["latents"]
 
-    result = pipeline(**call_kwargs)
-    return result.images[0]
+    # "np" skips diffusers' numpy -> PIL conversion; outputs are handed to
+    # the codec layer as uint8 arrays instead (see image_codecs.py).
+    output_type = get_settings().z_image_pipeline_output_type.strip().lower()
+    call_kwargs["output_type"] = "np" if output_type == "np" else "pil"
+
+    # The pipeline is not re-entrant; threaded workers (see microbatch.py)
+    # serialize GPU work here.
+    with _PIPELINE_LOCK:
+        result = pipeline(**call_kwargs)
+
+    if call_kwargs["output_type"] == "np":
+        # Convert the float [0, 1] batch once; uint8 is 4x smaller to hold
+        # while outputs wait for post-processing.
+        return [as_uint8_rgb(image) for image in result.images]
+    return list(result.images)
+
+
+def generate_image(
+    *,
+    prompt: str,
+    height: int = 1024,
+    width: int = 1024,
+    num_inference_steps: int = 9,
+    guidance_scale: float = 0.0,
+    seed: int | None = None,
+    negative_prompt: str | None = None,
+    cfg_normalization: bool | None = None,
+    cfg_truncation: float | None = None,
+    max_sequence_length: int | None = None,
+    callback: Callable[[int, int, object], None] | None = None,
+    callback_steps: int = 1,
+) -> object:
+    """
+    Helper for running a single Z-Image generation step using the shared
+    pipeline configuration.
+    """
+
+    images = generate_images(
+        prompt=prompt,
+        seeds=[seed],
+        height=height,
+        width=width,
+        num_inference_steps=num_inference_steps,
+        guidance_scale=guidance_scale,
+        negative_prompt=negative_prompt,
+        cfg_normalization=cfg_normalization,
+        cfg_truncation=cfg_truncation,
+        max_sequence_length=max_sequence_length,
+        callback=callback,
+        callback_steps=callback_steps,
+    )
+    return images[0]
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+root_env_file = REPO_ROOT / ".env"
+if root_env_file.exists():
+    load_dotenv(root_env_file, override=False)
+
+api_env_file = REPO_ROOT / "apps" / "api" / ".env"
+if api_env_file.exists():
+    load_dotenv(api_env_file, override=False)
+
+from libs.py_core.db import backfill_batch_covers  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Fill image_generation_batches.cover_* from the first successful task of each batch."
+    )
+    parser.add_argument("--chunk-size", type=int, default=500, help="Batches updated per statement (default: 500).")
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Re-check every batch instead of only those with success_count > 0 and no cover yet.",
+    )
+    args = parser.parse_args()
+
+    scanned_chunks = 0
+    updated = 0
+    after_id: str | None = None
+
+    while True:
+        after_id, changed = backfill_batch_covers(
+            after_id,
+            limit=max(1, args.chunk_size),
+            only_missing=not args.all,
+        )
+        if after_id is None:
+            break
+        scanned_chunks += 1
+        updated += changed
+        if scanned_chunks % 10 == 0:
+            print(f"[backfill_batch_covers] Processed {scanned_chunks} chunks, updated={updated}...")
+
+    print(f"[backfill_batch_covers] Done. updated={updated} all={args.all}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+root_env_file = REPO_ROOT / ".env"
+if root_env_file.exists():
+    load_dotenv(root_env_file, override=False)
+
+api_env_file = REPO_ROOT / "apps" / "api" / ".env"
+if api_env_file.exists():
+    load_dotenv(api_env_file, override=False)
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _hold_db_lock(seconds: float, started: threading.Event) -> None:
+    """
+    Simulate a slow query: keep image_generation_batches exclusively locked
+    so every /v1/history request blocks inside Postgres for `seconds`.
+    """
+
+    import psycopg
+
+    from libs.py_core.db import _get_psycopg_dsn
+
+    with psycopg.connect(_get_psycopg_dsn()) as conn:
+        with conn.cursor() as cur:
+            cur.execute("LOCK TABLE image_generation_batches IN ACCESS EXCLUSIVE MODE")
+            started.set()
+            time.sleep(seconds)
+        conn.rollback()
+
+
+async def _poll(
+    client,
+    path: str,
+    headers: dict[str, str],
+    deadline: float,
+    samples: list[float],
+    errors: list[int],
+) -> None:
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(path, headers=headers)
+            ok = response.status_code < 500
+        except Exception:
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        if ok:
+            samples.append(elapsed_ms)
+        else:
+            errors.append(1)
+
+
+async def _run(args: argparse.Namespace) -> dict[str, tuple[list[float], list[int]]]:
+    import httpx
+
+    headers = {"X-Auth-Key": args.auth_key} if args.auth_key else {}
+    task_id = args.task_id or str(uuid.uuid4())
+    paths = {
+        "task_status": f"/v1/tasks/{task_id}",
+        "history": f"/v1/history?limit={args.history_limit}",
+    }
+    results: dict[str, tuple[list[float], list[int]]] = {name: ([], []) for name in paths}
+
+    limits = httpx.Limits(max_connections=args.clients + args.history_clients)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        # Warm up connections / pools before measuring.
+        await client.get(paths["task_status"], headers=headers)
+
+        if args.db_stall_seconds > 0:
+            started = threading.Event()
+            threading.Thread(target=_hold_db_lock, args=(args.db_stall_seconds, started), daemon=True).start()
+            started.wait(timeout=10)
+
+        deadline = time.perf_counter() + args.duration
+        jobs = [
+            _poll(client, paths["task_status"], headers, deadline, *results["task_status"])
+            for _ in range(args.clients)
+        ] + [
+            _poll(client, paths["history"], headers, deadline, *results["history"])
+            for _ in range(args.history_clients)
+        ]
+        await asyncio.gather(*jobs)
+
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Measure API latency under concurrent polling: many clients poll GET /v1/tasks/{id} "
+            "while others load GET /v1/history. Optionally stall Postgres to show whether slow "
+            "DB calls block unrelated requests."
+        )
+    )
+    parser.add_argument("--base-url", type=str, default="http://127.0.0.1:8000")
+    parser.add_argument("--auth-key", type=str, default="admin")
+    parser.add_argument("--task-id", type=str, default="", help="Task to poll (default: a random, pending id).")
+    parser.add_argument("--clients", type=int, default=200, help="Concurrent task-status pollers.")
+    parser.add_argument("--history-clients", type=int, default=10, help="Concurrent /v1/history pollers.")
+    parser.add_argument("--history-limit", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds.")
+    parser.add_argument(
+        "--db-stall-seconds",
+        type=float,
+        default=0.0,
+        help="Hold an exclusive lock on image_generation_batches for this long at the start of the run.",
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(_run(args))
+
+    print(
+        f"[benchmark_api_polling] base_url={args.base_url} clients={args.clients} "
+        f"history_clients={args.history_clients} duration={args.duration}s db_stall={args.db_stall_seconds}s"
+    )
+    print(f"{'endpoint':<12} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, (samples, errors) in results.items():
+        mean_rps = len(samples) / args.duration if args.duration else 0.0
+        print(
+            f"{name:<12} {len(samples):>9} {len(errors):>7} {mean_rps:>8.1f} "
+            f"{statistics.median(samples) if samples else 0.0:>9.1f} "
+            f"{_percentile(samples, 95):>9.1f} {_percentile(samples, 99):>9.1f} "
+            f"{max(samples) if samples else 0.0:>9.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from libs.py_core.image_codecs import (  # noqa: E402
+    CodecSettings,
+    as_uint8_rgb,
+    encode_formats,
+    encode_image,
+    get_encoder,
+)
+
+
+def _load_image(path: str, width: int, height: int):
+    """
+    Load a real generated image when given; otherwise synthesize a smooth
+    gradient + noise image, which compresses roughly like model outputs.
+    """
+
+    import numpy as np
+
+    if path:
+        from PIL import Image
+
+        with Image.open(path) as img:
+            return as_uint8_rgb(img.convert("RGB"))
+
+    rng = np.random.default_rng(0)
+    y, x = np.meshgrid(
+        np.linspace(0.0, 1.0, height, dtype=np.float32),
+        np.linspace(0.0, 1.0, width, dtype=np.float32),
+        indexing="ij",
+    )
+    base = np.stack([x * (1 - y), y, (x + y) / 2], axis=-1)
+    noise = rng.normal(0.0, 0.04, size=(height, width, 3)).astype(np.float32)
+    return as_uint8_rgb(np.clip(base + noise, 0.0, 1.0))
+
+
+def _settings_grid() -> list[tuple[str, str, CodecSettings]]:
+    grid: list[tuple[str, str, CodecSettings]] = []
+    for level in (1, 3, 6, 9):
+        grid.append(("png", f"compress_level={level}", CodecSettings(png_compress_level=level)))
+    for quality in (75, 90):
+        for method in (0, 4, 6):
+            grid.append(
+                (
+                    "webp",
+                    f"quality={quality} method={method}",
+                    CodecSettings(webp_quality=quality, webp_method=method),
+                )
+            )
+    grid.append(("webp", "lossless method=0", CodecSettings(webp_lossless=True, webp_method=0)))
+    return grid
+
+
+def _time_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark PNG/WebP encoding settings for generated images.")
+    parser.add_argument("--input", type=str, default="", help="Optional image file to encode (default: synthetic).")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per setting; the median is reported.")
+    parser.add_argument(
+        "--backend",
+        action="append",
+        default=[],
+        help="Codec backend(s) to benchmark: pillow, opencv (default: pillow).",
+    )
+    args = parser.parse_args()
+
+    image = _load_image(args.input, args.width, args.height)
+    height, width = image.shape[:2]
+    megapixels = (width * height) / 1_000_000
+    backends = args.backend or ["pillow"]
+
+    print(f"[benchmark_image_codecs] image={width}x{height} ({megapixels:.2f} MP) repeat={args.repeat}")
+    print(f"{'backend':<8} {'format':<6} {'setting':<24} {'ms':>9} {'ms/MP':>9} {'bytes':>11}")
+
+    for backend in backends:
+        try:
+            encoder = get_encoder(backend)
+            encode_image(image, format="png", encoder=encoder)
+        except Exception as exc:
+            print(f"[benchmark_image_codecs] skip backend={backend}: {exc}")
+            continue
+
+        for fmt, label, settings in _settings_grid():
+            encoded = encode_image(image, format=fmt, settings=settings, encoder=encoder)
+            ms = _time_ms(lambda: encode_image(image, format=fmt, settings=settings, encoder=encoder), args.repeat)
+            print(f"{backend:<8} {fmt:<6} {label:<24} {ms:>9.1f} {ms / megapixels:>9.1f} {encoded.nbytes:>11,}")
+
+        # Default settings, PNG + WebP sequentially vs. in parallel.
+        sequential = _time_ms(
+            lambda: (
+                encode_image(image, format="png", encoder=encoder),
+                encode_image(image, format="webp", encoder=encoder),
+            ),
+            args.repeat,
+        )
+        parallel = _time_ms(lambda: encode_formats(image, ("png", "webp"), encoder=encoder), args.repeat)
+        print(
+            f"{backend:<8} {'both':<6} {'defaults sequential':<24} {sequential:>9.1f} {sequential / megapixels:>9.1f}"
+        )
+        print(f"{backend:<8} {'both':<6} {'defaults parallel':<24} {parallel:>9.1f} {parallel / megapixels:>9.1f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -24,7 +24,8 @@ from libs.py_core.storage import S3Storage, StorageConfigError, get_s3_storage
 
 def _iter_files(root: Path):
     for path in root.rglob("*"):
-        if path.is_file():
+        # Skip leftovers of interrupted streaming writes (".tmp-*").
+        if path.is_file() and not path.name.startswith(".tmp-"):
             yield path
 
 
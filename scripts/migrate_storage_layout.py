@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+root_env_file = REPO_ROOT / ".env"
+if root_env_file.exists():
+    load_dotenv(root_env_file, override=False)
+
+api_env_file = REPO_ROOT / "apps" / "api" / ".env"
+if api_env_file.exists():
+    load_dotenv(api_env_file, override=False)
+
+from libs.py_core.config import get_settings  # noqa: E402
+from libs.py_core.storage import LocalStorage, StorageConfigError, get_storage  # noqa: E402
+from libs.py_core.storage_keys import is_sharded_layout, sharded_path_for  # noqa: E402
+
+
+def _remove_empty_date_dirs(storage: LocalStorage) -> int:
+    removed = 0
+    for path in storage.root.iterdir():
+        if path.is_dir() and path.name.isdigit() and len(path.name) == 8:
+            try:
+                path.rmdir()
+            except OSError:
+                continue
+            removed += 1
+    return removed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Move generated images from the date layout (YYYYMMDD/HHMMSS_<id>.png) to the sharded layout "
+            "(<aa>/<bb>/<id>.png) of the configured storage backend. DB rows keep their old paths; "
+            "the API resolves them to the sharded location."
+        )
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Print planned moves without moving anything.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=get_settings().z_image_storage_io_concurrency,
+        help="Concurrent moves (default: Z_IMAGE_STORAGE_IO_CONCURRENCY).",
+    )
+    args = parser.parse_args()
+
+    try:
+        storage = get_storage()
+    except StorageConfigError as exc:
+        print(f"[migrate_storage_layout] {exc}")
+        return 2
+
+    if not is_sharded_layout():
+        print(
+            "[migrate_storage_layout] Warning: Z_IMAGE_STORAGE_KEY_LAYOUT is not 'sharded'; "
+            "new outputs will keep using the date layout."
+        )
+
+    moved = 0
+    missing = 0
+    failed = 0
+    planned = 0
+
+    def _collect(done: set[Future[bool]]) -> None:
+        nonlocal moved, missing, failed
+        for future in done:
+            source = futures.pop(future)
+            try:
+                if future.result():
+                    moved += 1
+                else:
+                    missing += 1
+            except Exception as exc:
+                failed += 1
+                print(f"[migrate_storage_layout] Failed to move {source}: {exc}")
+            if moved and moved % 1000 == 0:
+                print(f"[migrate_storage_layout] Moved {moved} objects...")
+
+    futures: dict[Future[bool], str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="z-image-migrate") as executor:
+        for source in storage.iter_relative_paths():
+            target = sharded_path_for(source)
+            if target is None:
+                continue
+            planned += 1
+            if args.dry_run:
+                print(f"[dry-run] move {source} -> {target}")
+                continue
+            futures[executor.submit(storage.move, source_path=source, target_path=target)] = source
+            # Bound the number of queued moves while listing continues.
+            if len(futures) >= args.workers * 4:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                _collect(done)
+        _collect(set(futures))
+
+    if isinstance(storage, LocalStorage) and not args.dry_run:
+        removed = _remove_empty_date_dirs(storage)
+        print(f"[migrate_storage_layout] Removed {removed} empty date directories.")
+
+    print(
+        f"[migrate_storage_layout] Done. planned={planned} moved={moved} missing={missing} "
+        f"failed={failed} dry_run={args.dry_run}"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+root_env_file = REPO_ROOT / ".env"
+if root_env_file.exists():
+    load_dotenv(root_env_file, override=False)
+
+api_env_file = REPO_ROOT / "apps" / "api" / ".env"
+if api_env_file.exists():
+    load_dotenv(api_env_file, override=False)
+
+from libs.py_core.db import reconcile_batch_counters  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Recount image_generation_batches success/failed counters and status from image_generation_tasks."
+    )
+    parser.add_argument(
+        "--batch-id",
+        action="append",
+        default=[],
+        help="Only check the given batch id (repeatable; default: all batches).",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Print mismatching batches without fixing them.")
+    args = parser.parse_args()
+
+    rows = reconcile_batch_counters(args.batch_id or None, dry_run=args.dry_run)
+
+    prefix = "[dry-run]" if args.dry_run else "[repair_batch_counters]"
+    for batch_id, old_success, old_failed, old_status, success, failed, status in rows:
+        print(
+            f"{prefix} {batch_id}: "
+            f"success {old_success}->{success} failed {old_failed}->{failed} status {old_status}->{status}"
+        )
+
+    print(f"[repair_batch_counters] Done. mismatched={len(rows)} dry_run={args.dry_run}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
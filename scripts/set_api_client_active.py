@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+root_env_file = REPO_ROOT / ".env"
+if root_env_file.exists():
+    load_dotenv(root_env_file, override=False)
+
+api_env_file = REPO_ROOT / "apps" / "api" / ".env"
+if api_env_file.exists():
+    load_dotenv(api_env_file, override=False)
+
+from libs.py_core.db import get_api_client_id_for_key, set_api_client_active  # noqa: E402
+from libs.py_core.events import publish_client_invalidation  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Enable or disable an API client and drop it from every API process's key cache."
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--client-id", help="api_clients.id, e.g. key_ab12cd34.")
+    target.add_argument("--key", help="Raw API key (its client id is derived / created).")
+    state = parser.add_mutually_exclusive_group(required=True)
+    state.add_argument("--disable", action="store_true", help="Reject this client's requests (403).")
+    state.add_argument("--enable", action="store_true", help="Accept this client's requests again.")
+    args = parser.parse_args()
+
+    client_id = args.client_id or get_api_client_id_for_key(args.key)
+    if not client_id:
+        print("[set_api_client_active] Could not resolve a client id.")
+        return 1
+
+    active = bool(args.enable)
+    if not set_api_client_active(client_id, active):
+        print(f"[set_api_client_active] No such client: {client_id}")
+        return 1
+
+    notified = publish_client_invalidation(client_id)
+    print(
+        f"[set_api_client_active] {client_id}: is_active={active} "
+        f"(cache invalidation {'published' if notified else 'NOT published; API processes pick it up within the cache TTL'})"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,14 @@
+-- Indexes for keyset (cursor) pagination of /v1/history.
+-- The history query orders by (created_at DESC, id DESC) and continues with
+-- (created_at, id) < (cursor); these indexes serve it for admin (all
+-- batches) and per-client views without scanning skipped rows.
+-- Safe to run multiple times.
+
+CREATE INDEX IF NOT EXISTS idx_image_generation_batches_created_id
+    ON image_generation_batches (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_image_generation_batches_client_created_id
+    ON image_generation_batches (api_client_id, created_at DESC, id DESC);
+
+-- Superseded by idx_image_generation_batches_client_created_id.
+DROP INDEX IF EXISTS idx_image_generation_batches_client_created;
@@ -0,0 +1,13 @@
+-- Denormalized "cover" image of each batch: the successful task with the
+-- lowest batch_index. Kept up to date by the worker when a task succeeds so
+-- that /v1/history can read image_generation_batches alone.
+-- Existing rows: run scripts/backfill_batch_covers.py once after this file.
+-- Safe to run multiple times.
+
+ALTER TABLE image_generation_batches
+    ADD COLUMN IF NOT EXISTS cover_batch_index           INTEGER,
+    ADD COLUMN IF NOT EXISTS cover_relative_path         TEXT,
+    ADD COLUMN IF NOT EXISTS cover_preview_relative_path TEXT,
+    ADD COLUMN IF NOT EXISTS cover_width                 INTEGER,
+    ADD COLUMN IF NOT EXISTS cover_height                INTEGER,
+    ADD COLUMN IF NOT EXISTS cover_seed                  BIGINT;
@@ -0,0 +1,37 @@
+-- Completion webhooks (see libs/py_core/webhooks.py).
+--
+-- - api_clients.callback_url: default callback for every batch a client
+--   creates (UPDATE api_clients SET callback_url = '...' WHERE id = '...').
+-- - image_generation_batches.callback_url: the URL resolved at enqueue time
+--   (request `callback_url`, falling back to the client's).
+-- - webhook_deliveries: outbox written by the worker in the same statement
+--   that completes a batch; one row (= one POST) per batch. Rows that run
+--   out of attempts stay with status 'dead' as the dead-letter record.
+-- Safe to run multiple times.
+
+ALTER TABLE api_clients
+    ADD COLUMN IF NOT EXISTS callback_url TEXT;
+
+ALTER TABLE image_generation_batches
+    ADD COLUMN IF NOT EXISTS callback_url TEXT;
+
+CREATE TABLE IF NOT EXISTS webhook_deliveries (
+    id              BIGSERIAL PRIMARY KEY,
+    batch_id        UUID NOT NULL REFERENCES image_generation_batches (id) ON DELETE CASCADE,
+    url             TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'pending', -- pending | delivered | dead
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    response_status INTEGER,
+    last_error      TEXT,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    delivered_at    TIMESTAMPTZ
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_webhook_deliveries_batch
+    ON webhook_deliveries (batch_id);
+
+-- Dispatcher claim: due pending rows in order.
+CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_due
+    ON webhook_deliveries (next_attempt_at)
+    WHERE status = 'pending';
@@ -0,0 +1,13 @@
+-- Downscaled WebP previews written by the worker next to each image (see
+-- libs/py_core/previews.py), as {"<width>": relative_path}. The batch keeps
+-- the cover's variants so /v1/history can pick a card-sized thumbnail from
+-- image_generation_batches alone.
+-- Rows from before this file have NULL here and are resized on demand
+-- (/generated-images/...?w=).
+-- Safe to run multiple times.
+
+ALTER TABLE image_generation_tasks
+    ADD COLUMN IF NOT EXISTS preview_variants JSONB;
+
+ALTER TABLE image_generation_batches
+    ADD COLUMN IF NOT EXISTS cover_preview_variants JSONB;
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+root_env_file = REPO_ROOT / ".env"
+if root_env_file.exists():
+    load_dotenv(root_env_file, override=False)
+
+api_env_file = REPO_ROOT / "apps" / "api" / ".env"
+if api_env_file.exists():
+    load_dotenv(api_env_file, override=False)
+
+from libs.py_core import db_async
+from libs.py_core.webhooks import WebhookDispatcher, get_delivery_counts, requeue_dead_deliveries
+
+
+async def _run(args: argparse.Namespace) -> int:
+    try:
+        if args.requeue_dead:
+            count = await requeue_dead_deliveries()
+            print(f"[webhook_dispatcher] Re-queued {count} dead deliveries.")
+
+        dispatcher = WebhookDispatcher()
+        print(
+            "[webhook_dispatcher] Delivering "
+            f"(max_in_flight={dispatcher.max_in_flight} per_host={dispatcher.per_host_concurrency} "
+            f"max_attempts={dispatcher.max_attempts} once={args.once})"
+        )
+        try:
+            await dispatcher.run(once=args.once)
+        finally:
+            print(f"[webhook_dispatcher] Done. {dispatcher.stats} outbox={await get_delivery_counts()}")
+    finally:
+        await db_async.close_pool()
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Deliver completion webhooks queued in webhook_deliveries.")
+    parser.add_argument("--once", action="store_true", help="Exit once nothing is due instead of polling forever.")
+    parser.add_argument(
+        "--requeue-dead",
+        action="store_true",
+        help="Move dead deliveries back to pending (fresh attempt budget) before starting.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    try:
+        return asyncio.run(_run(args))
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
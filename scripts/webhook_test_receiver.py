@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Local stand-in receiver for completion webhooks: prints each POST and answers 2xx (or fails on demand)."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9009)
+    parser.add_argument("--secret", default="", help="Verify X-Zimage-Signature with this WEBHOOK_SECRET.")
+    parser.add_argument(
+        "--fail-first",
+        type=int,
+        default=0,
+        help="Answer the first N requests with --fail-status to exercise retries.",
+    )
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=int, default=None, help="Retry-After seconds sent with failures.")
+    args = parser.parse_args()
+
+    lock = threading.Lock()
+    counter = {"requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:  # noqa: N802 - http.server API
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with lock:
+                counter["requests"] += 1
+                seq = counter["requests"]
+
+            signature = "-"
+            if args.secret:
+                expected = "sha256=" + hmac.new(args.secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+                signature = "ok" if hmac.compare_digest(expected, self.headers.get("X-Zimage-Signature", "")) else "BAD"
+
+            try:
+                payload = json.loads(body)
+                summary = (
+                    f"batch={payload.get('batch_id')} status={payload.get('status')} "
+                    f"items={len(payload.get('items') or [])}"
+                )
+            except ValueError:
+                summary = f"non-JSON body ({len(body)} bytes)"
+
+            status = args.fail_status if seq <= args.fail_first else 200
+            print(
+                f"[webhook_test_receiver] #{seq} {self.path} delivery={self.headers.get('X-Zimage-Delivery')} "
+                f"attempt={self.headers.get('X-Zimage-Attempt')} signature={signature} {summary} -> {status}",
+                flush=True,
+            )
+            self.send_response(status)
+            if status >= 300 and args.retry_after is not None:
+                self.send_header("Retry-After", str(args.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format: str, *log_args: object) -> None:  # noqa: A002
+            return
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"[webhook_test_receiver] Listening on http://{args.host}:{args.port}/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())